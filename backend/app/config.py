@@ -1,23 +1,101 @@
 from pydantic_settings import BaseSettings
 from functools import lru_cache
+from typing import Dict
 
 
 class Settings(BaseSettings):
     # Database
     database_url: str = "sqlite+aiosqlite:///./tradestars.db"
+    database_echo: bool = False  # Loga todo o SQL (debug)
+    database_read_pool_size: int = 5
+    database_read_max_overflow: int = 10
+    database_write_timeout_seconds: float = 300  # Espera máxima pela conexão de escrita
+    
+    # SQLite (aplicado em cada conexão nova)
+    sqlite_synchronous: str = "NORMAL"  # Com WAL, só perde as últimas transações numa queda de energia
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_mb: int = 32  # Por conexão
+    sqlite_mmap_size_mb: int = 256
+    sqlite_optimize_interval_minutes: float = 60
     
     # OpenAI
     openai_api_key: str = ""
+    openai_base_url: str = ""  # Opcional: endpoint compatível (ex: LLM fake local)
+    openai_model: str = "gpt-4-turbo-preview"
+    
+    # Geração agendada de insights (opt-in)
+    insights_scheduler_enabled: bool = False
+    insights_schedule_time: str = "18:30"  # Após o fechamento do mercado (HH:MM)
+    insights_workers: int = 2
+    insights_tokens_per_minute: int = 40000
     
     # Security
     secret_key: str = "your-secret-key-change-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
     
+    # MetaAPI
+    metaapi_base_url: str = "https://mt-client-api-v1.agiliumtrade.agiliumtrade.ai"
+    metaapi_history_window_days: int = 7
+    metaapi_history_concurrency: int = 4
+    metaapi_backfill_chunk_days: int = 30
+    metaapi_account_info_ttl_seconds: float = 10.0
+    
+    # Sync automático das contas MetaAPI cadastradas (opt-in)
+    metaapi_sync_scheduler_enabled: bool = False
+    metaapi_sync_interval_minutes: float = 15
+    metaapi_sync_jitter_seconds: float = 60
+    metaapi_sync_workers: int = 8
+    metaapi_sync_jobs_per_minute: int = 600
+    metaapi_sync_backfill_days: int = 30
+    
+    # Ingestão de webhooks do TradingView (fila + group commit)
+    webhook_queue_size: int = 10000
+    webhook_batch_size: int = 500
+    webhook_flush_ms: float = 5
+    webhook_spool_file: str = "./webhook_spool.jsonl"  # Alertas não gravados no desligamento (relidos no start)
+    
+    # Importação de vários arquivos / ZIP (pool de processos)
+    import_workers: int = 0  # 0 = um por CPU
+    import_max_file_mb: int = 200
+    
+    # Fila de jobs em background (imports, syncs, insights)
+    job_workers: Dict[str, int] = {}  # Concorrência por tipo, ex: {"metaapi_sync": 8}
+    job_max_attempts: int = 3
+    job_poll_seconds: float = 2.0
+    job_retention_days: int = 7
+    job_spool_dir: str = "./job_files"  # Arquivos enviados aguardando o job
+    
+    # Trades duplicados entre fontes (mesma execução via MetaAPI, CSV, TradingView...)
+    duplicate_time_tolerance_seconds: float = 60
+    duplicate_price_tolerance_pct: float = 0.05
+    duplicate_volume_tolerance_pct: float = 1.0
+    # Horas à frente de UTC dos horários gravados por fonte (MetaAPI já é UTC), ex: {"CSV": 3, "METATRADER": 3}
+    duplicate_source_utc_offset_hours: Dict[str, float] = {}
+    
+    # Cliente HTTP compartilhado (pool keep-alive)
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry_seconds: float = 30.0
+    http_timeout_seconds: float = 30.0
+    http2_enabled: bool = False
+    
+    # Resiliência de serviços externos (circuit breaker)
+    breaker_failure_threshold: int = 5
+    breaker_reset_seconds: float = 30.0
+    breaker_max_retries: int = 2
+    openai_timeout_seconds: float = 60.0
+    metaapi_timeout_seconds: float = 30.0
+    
     # MetaTrader
     mt5_login: int = 0
     mt5_password: str = ""
     mt5_server: str = ""
+    mt5_timeout_seconds: float = 30.0
+    # Terminal simulado (app/services/mt5_stub.py) para testes fora do Windows
+    mt5_use_stub: bool = False
+    mt5_stub_deals_per_day: int = 20
+    mt5_stub_latency_ms: float = 0
     
     class Config:
         env_file = ".env"
@@ -1,13 +1,62 @@
+from sqlalchemy import event, inspect, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import get_settings
 
 settings = get_settings()
 
-engine = create_async_engine(
-    settings.database_url,
-    echo=True
-)
+IS_SQLITE = settings.database_url.startswith("sqlite")
+
+if IS_SQLITE:
+    # Escritas: uma única conexão. Transações de escrita fazem fila no pool
+    # (asyncio) em vez de disputar o lock do arquivo ("database is locked")
+    engine = create_async_engine(
+        settings.database_url,
+        echo=settings.database_echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=settings.database_write_timeout_seconds
+    )
+    # Leituras: pool de conexões somente leitura; com WAL não esperam as escritas
+    read_engine = create_async_engine(
+        settings.database_url,
+        echo=settings.database_echo,
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=settings.database_read_pool_size,
+        max_overflow=settings.database_read_max_overflow
+    )
+else:
+    engine = read_engine = create_async_engine(settings.database_url, echo=settings.database_echo)
+
+
+def _sqlite_pragmas(dbapi_connection, read_only: bool):
+    cursor = dbapi_connection.cursor()
+    if not read_only:
+        # Persistente no arquivo; a conexão de escrita é a primeira a abrir (create_tables)
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA journal_size_limit=67108864")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_mb * 1024)}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb * 1024 * 1024)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    if read_only:
+        # Garante que toda escrita passe pela conexão única
+        cursor.execute("PRAGMA query_only=ON")
+    cursor.close()
+
+
+if IS_SQLITE:
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_write_connect(dbapi_connection, connection_record):
+        _sqlite_pragmas(dbapi_connection, read_only=False)
+
+    @event.listens_for(read_engine.sync_engine, "connect")
+    def _on_read_connect(dbapi_connection, connection_record):
+        _sqlite_pragmas(dbapi_connection, read_only=True)
+
 
 async_session = async_sessionmaker(
     engine,
@@ -15,17 +64,54 @@ async_session = async_sessionmaker(
     expire_on_commit=False
 )
 
+read_session = async_sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 
 class Base(DeclarativeBase):
     pass
 
 
+def _add_missing_columns(sync_conn):
+    """create_all não altera tabelas existentes; adiciona as colunas novas dos models (anuláveis)"""
+    inspector = inspect(sync_conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=sync_conn.dialect)
+                sync_conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+
+def _create_missing_indexes(sync_conn):
+    """create_all só cria índices junto com tabelas novas; garante os índices em bancos existentes"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 async def create_tables():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+
+
+def pool_status() -> dict:
+    """Conexões em uso nos pools de escrita e leitura"""
+    return {
+        "write_checked_out": engine.pool.checkedout(),
+        "read_checked_out": read_engine.pool.checkedout(),
+    }
 
 
 async def get_db():
+    """Sessão para rotas que gravam (conexão de escrita única)"""
     async with async_session() as session:
         try:
             yield session
@@ -33,3 +119,10 @@ async def get_db():
             await session.close()
 
 
+async def get_read_db():
+    """Sessão somente leitura (pool de leitura): analytics, listagens, chat"""
+    async with read_session() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
@@ -2,16 +2,48 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.routers import trades, analytics, integrations, ai_insights
-from app.database import create_tables
+from app.routers import trades, analytics, integrations, ai_insights, jobs
+from app.database import create_tables, async_session, pool_status, IS_SQLITE
+from app.config import get_settings
+from app.services.insight_scheduler import get_insight_scheduler
+from app.services.sync_scheduler import get_sync_scheduler
+from app.services.webhook_ingest import get_webhook_ingestor
+from app.services.bulk_import import shutdown_import_pool
+from app.services.jobs import get_job_runner
+from app.services.db_maintenance import get_db_maintenance
+from app.services.data_migrations import run_data_migrations
+from app.services.http_client import start_http_client, close_http_client, pool_stats
+from app.utils.metrics import metrics
+from app.utils.resilience import breaker_states
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    settings = get_settings()
+    
     # Startup
     await create_tables()
+    async with async_session() as db:
+        # Backfills de dados: cada um só na primeira subida depois de publicado
+        await run_data_migrations(db)
+    if IS_SQLITE:
+        await get_db_maintenance().start()  # ANALYZE / PRAGMA optimize periódico
+    await start_http_client()
+    await get_webhook_ingestor().start()
+    await get_job_runner().start()
+    if settings.insights_scheduler_enabled:
+        await get_insight_scheduler().start()
+    if settings.metaapi_sync_scheduler_enabled:
+        await get_sync_scheduler().start()
     yield
     # Shutdown
+    await get_job_runner().stop()  # Jobs em andamento voltam para a fila
+    await get_webhook_ingestor().stop()  # Grava os alertas ainda na fila
+    await get_sync_scheduler().stop()
+    await get_insight_scheduler().stop()
+    await close_http_client()
+    await get_db_maintenance().stop()
+    shutdown_import_pool()
 
 
 app = FastAPI(
@@ -35,6 +67,7 @@ app.include_router(trades.router, prefix="/api/trades", tags=["Trades"])
 app.include_router(analytics.router, prefix="/api/analytics", tags=["Analytics"])
 app.include_router(integrations.router, prefix="/api/integrations", tags=["Integrations"])
 app.include_router(ai_insights.router, prefix="/api/ai", tags=["AI Insights"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
 
 
 @app.get("/")
@@ -51,3 +84,19 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.get("/health/dependencies")
+async def dependencies_health():
+    """Estado dos circuit breakers dos serviços externos"""
+    states = breaker_states()
+    return {
+        "status": "degraded" if any(b["state"] != "closed" for b in states.values()) else "healthy",
+        "dependencies": states
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Métricas internas (contadores, gauges e latências)"""
+    return {**metrics.snapshot(), "http_pool": pool_stats(), "db_pools": pool_status()}
+
+
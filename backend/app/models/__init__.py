@@ -1,6 +1,13 @@
 from app.models.trade import Trade
 from app.models.user import User
+from app.models.insight import InsightSnapshot
+from app.models.sync_state import SyncState
+from app.models.broker_account import MetaAPIAccount
+from app.models.tradingview_position import TradingViewPosition
+from app.models.csv_profile import CsvMappingProfile
+from app.models.uploaded_file import UploadedFile
+from app.models.job import Job
+from app.models.webhook_dead_letter import WebhookDeadLetter
+from app.models.data_migration import DataMigration
 
-__all__ = ["Trade", "User"]
-
-
+__all__ = ["Trade", "User", "InsightSnapshot", "SyncState", "MetaAPIAccount", "TradingViewPosition", "CsvMappingProfile", "UploadedFile", "Job", "WebhookDeadLetter", "DataMigration"]
@@ -0,0 +1,30 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from app.database import Base
+
+
+class MetaAPIAccount(Base):
+    """Conta MetaAPI cadastrada para sincronização automática em background"""
+    __tablename__ = "metaapi_accounts"
+    __table_args__ = (
+        UniqueConstraint("user_id", "account_id", name="uq_metaapi_accounts_user_account"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    account_id = Column(String(100), nullable=False)
+    # Token criptografado (app/utils/crypto.py); a coluna mantém o nome antigo
+    api_token_encrypted = Column("api_token", Text, nullable=False)
+    
+    # Status
+    enabled = Column(Boolean, default=True)
+    last_synced_at = Column(DateTime, nullable=True)
+    last_error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<MetaAPIAccount user={self.user_id} {self.account_id}>"
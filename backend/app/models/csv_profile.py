@@ -0,0 +1,36 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from app.database import Base
+
+
+class CsvMappingProfile(Base):
+    """Mapeamento de colunas detectado para um layout de CSV (assinatura do cabeçalho)"""
+    __tablename__ = "csv_mapping_profiles"
+    __table_args__ = (
+        UniqueConstraint("user_id", "header_hash", name="uq_csv_mapping_profiles_header"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    header_hash = Column(String(40), nullable=False)
+    headers = Column(Text, nullable=False)  # JSON list (colunas normalizadas)
+    
+    # Resultado da detecção (ou correção do usuário)
+    mapping = Column(Text, nullable=False)  # JSON: {campo: coluna}
+    guessed = Column(Text, default="[]")  # JSON list: campos adivinhados (ex: profit)
+    date_format = Column(String(40), nullable=True)
+    close_date_format = Column(String(40), nullable=True)
+    encoding = Column(String(20), default="utf-8")
+    
+    # Confirmado/corrigido pelo usuário via API
+    confirmed = Column(Boolean, default=False)
+    use_count = Column(Integer, default=0)
+    last_used_at = Column(DateTime, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<CsvMappingProfile user={self.user_id} {self.header_hash[:8]}>"
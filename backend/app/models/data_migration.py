@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime
+from datetime import datetime
+
+from app.database import Base
+
+
+class DataMigration(Base):
+    """Migração de dados já aplicada (services/data_migrations); roda uma única vez por banco"""
+    __tablename__ = "data_migrations"
+    
+    name = Column(String(100), primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<DataMigration {self.name}>"
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from datetime import datetime
+
+from app.database import Base
+
+
+class InsightSnapshot(Base):
+    """Insights pré-gerados pelo scheduler, servidos direto em /api/ai/insights"""
+    __tablename__ = "insight_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True, index=True)
+    
+    # Conteúdo
+    insights = Column(Text, nullable=False)  # JSON list
+    trades_analyzed = Column(Integer, default=0)
+    
+    # Versão dos dados usada na geração ("<count>:<max updated_at>")
+    data_version = Column(String(64), nullable=False)
+    source = Column(String(20), default="SCHEDULER")  # SCHEDULER or ON_DEMAND
+    
+    # Timestamps
+    generated_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<InsightSnapshot user={self.user_id} {self.data_version}>"
@@ -0,0 +1,43 @@
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, ForeignKey, Index
+from datetime import datetime
+
+from app.database import Base
+
+
+class Job(Base):
+    """Operação longa (import, sync, insights) executada pelos workers de app/services/jobs.py"""
+    __tablename__ = "jobs"
+    __table_args__ = (
+        # Próximo job de um tipo: status + prioridade (services/jobs.claim_next)
+        Index("ix_jobs_kind_status_priority", "kind", "status", "priority", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    kind = Column(String(40), nullable=False)  # csv_import, metaapi_sync, mt5_sync...
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, succeeded, failed
+    priority = Column(Integer, default=0)  # Maior roda antes
+
+    # Entrada (JSON, apagada ao terminar) e saída (JSON)
+    payload = Column(Text, default="{}")
+    secrets = Column(Text, nullable=True)  # Credenciais (JSON criptografado), fora do payload
+    result = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+    # Tentativas (falhas temporárias voltam para a fila após run_after)
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=3)
+    run_after = Column(DateTime, default=datetime.utcnow)
+
+    # Progresso (0 a 1) e etapa atual
+    progress = Column(Float, default=0.0)
+    progress_message = Column(String(255), nullable=True)
+
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.kind} {self.status}>"
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from app.database import Base
+
+
+class SyncState(Base):
+    """Marca d'água de sincronização por conta de corretora (MetaAPI / MT5)"""
+    __tablename__ = "sync_states"
+    __table_args__ = (
+        UniqueConstraint("user_id", "source", "account_id", name="uq_sync_states_account"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    source = Column(String(20), nullable=False)  # METAAPI or METATRADER
+    account_id = Column(String(100), nullable=False)
+    
+    # Até onde os deals já foram importados
+    last_deal_time = Column(DateTime, nullable=True)
+    last_deal_id = Column(String(100), nullable=True)
+    
+    # Lotes ainda abertos no último sync e deals recentes já aplicados
+    # (JSON: {"positions": {position_id: ...}, "applied_deals": {deal_id: time}})
+    open_positions = Column(Text, default="{}")
+    
+    # Backfill inicial: início do período pedido (concluído quando last_deal_time alcança "agora")
+    backfill_start = Column(DateTime, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<SyncState {self.source} {self.account_id} @ {self.last_deal_time}>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -19,6 +19,17 @@ class TradeSource(str, enum.Enum):
 
 class Trade(Base):
     __tablename__ = "trades"
+    __table_args__ = (
+        # Consultas de analytics e ferramentas do chat sempre filtram por usuário
+        Index("ix_trades_user_open_time", "user_id", "open_time"),
+        Index("ix_trades_user_symbol_open_time", "user_id", "symbol", "open_time"),
+        # Deduplicação de imports/syncs (trade_writer.insert_trades)
+        Index("ix_trades_user_source_external_id", "user_id", "source", "external_id"),
+        # Trades sem external_id (CSV/Excel): anti-join pela chave natural
+        Index("ix_trades_user_natural_key", "user_id", "natural_key"),
+        # Trades que apontam para um canônico removido (services/duplicate_matcher)
+        Index("ix_trades_duplicate_of", "duplicate_of"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -48,6 +59,8 @@ class Trade(Base):
     # Metadata
     source = Column(String(20), default="CSV")
     external_id = Column(String(100), nullable=True)  # ID from MT5/TradingView
+    natural_key = Column(String(40), nullable=True)  # Hash de ativo/abertura/tipo/volume/preço/resultado (sem external_id)
+    duplicate_of = Column(Integer, nullable=True)  # Mesma execução importada por outra fonte (id do trade canônico)
     notes = Column(String(500), nullable=True)
     
     # Timestamps
@@ -0,0 +1,29 @@
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from app.database import Base
+
+
+class TradingViewPosition(Base):
+    """Posição aberta por alertas do TradingView, aguardando o alerta de saída"""
+    __tablename__ = "tradingview_positions"
+    __table_args__ = (
+        UniqueConstraint("user_id", "symbol", "strategy", name="uq_tradingview_positions_key"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String(50), nullable=False)
+    strategy = Column(String(100), nullable=False)
+    
+    # Trade aberto (fechado quando chegar CLOSE_LONG / CLOSE_SHORT)
+    trade_id = Column(Integer, ForeignKey("trades.id"), nullable=False)
+    trade_type = Column(String(10), nullable=False)  # BUY or SELL
+    entry_price = Column(Float, nullable=False)
+    volume = Column(Float, nullable=False)
+    open_time = Column(DateTime, nullable=False)
+    
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<TradingViewPosition {self.symbol} {self.strategy} {self.trade_type}>"
@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, UniqueConstraint
+from datetime import datetime
+
+from app.database import Base
+
+
+class UploadedFile(Base):
+    """Arquivo já importado, identificado pelo hash do conteúdo (re-upload idêntico é recusado)"""
+    __tablename__ = "uploaded_files"
+    __table_args__ = (
+        UniqueConstraint("user_id", "content_hash", name="uq_uploaded_files_content"),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    content_hash = Column(String(64), nullable=False)  # sha256 do arquivo
+    filename = Column(String(255), nullable=True)
+    size = Column(Integer, default=0)
+    kind = Column(String(20), nullable=True)  # csv, xlsx, mt5_report...
+    
+    # Resultado do último import deste arquivo
+    trades_imported = Column(Integer, default=0)
+    trades_skipped = Column(Integer, default=0)
+    import_count = Column(Integer, default=1)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<UploadedFile user={self.user_id} {self.filename}>"
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from datetime import datetime
+
+from app.database import Base
+
+
+class WebhookDeadLetter(Base):
+    """Alerta do TradingView já aceito (202) que não pôde ser gravado; guardado para inspeção"""
+    __tablename__ = "webhook_dead_letters"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
+    external_id = Column(String(100), nullable=True)
+    payload = Column(Text, nullable=False)  # Alerta como enfileirado (JSON)
+    error = Column(Text, nullable=True)
+    
+    # Timestamps
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<WebhookDeadLetter {self.external_id}>"
@@ -1,26 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import Optional
 from datetime import datetime, timedelta
+import json
 
-from app.database import get_db
+from app.database import get_read_db, async_session, read_session
 from app.models.trade import Trade
 from app.services.ai_service import AIService
+from app.services.insight_rules import RuleEngine, trades_to_frame
+from app.services.insight_scheduler import (
+    get_insight_scheduler,
+    get_fresh_snapshot,
+    get_data_version,
+    save_snapshot
+)
+from app.services.jobs import JobContext, job_handler, enqueue_job, job_ref
 from app.schemas.ai import InsightRequest, InsightResponse
 
 router = APIRouter()
 
 
-@router.get("/insights")
-async def get_ai_insights(
-    user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
-):
-    """Gera insights personalizados com IA baseado no histórico de trades"""
-    
+async def _generate_insights(db: AsyncSession, user_id: int) -> dict:
+    """Gera e salva os insights com os trades atuais (request ou job)"""
     # Buscar trades
-    query = select(Trade).where(Trade.user_id == user_id)
+    version, _ = await get_data_version(db, user_id)
+    query = select(Trade).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None))
     result = await db.execute(query)
     trades = result.scalars().all()
     
@@ -45,157 +51,93 @@ async def get_ai_insights(
         }
     
     ai_service = AIService()
-    insights = await ai_service.generate_insights(trades)
+    insights, from_llm = await ai_service.generate_insights(trades)
+    if from_llm:
+        # Leitura e chamada à IA fora da conexão de escrita; só o snapshot é gravado nela
+        async with async_session() as writer:
+            await save_snapshot(writer, user_id, insights, len(trades), version)
+    # Fallback por regras não vira snapshot: a próxima chamada tenta a IA de novo
     
     return {
         "has_data": True,
         "trades_analyzed": len(trades),
         "generated_at": datetime.now().isoformat(),
+        "cached": False,
+        "fallback": not from_llm,
         "insights": insights
     }
 
 
+@job_handler("ai_insights", concurrency=2)
+async def _insights_job(job: JobContext, payload: dict):
+    job.report(0.1, "Gerando insights")
+    async with read_session() as db:
+        return await _generate_insights(db, job.user_id)
+
+
+@router.get("/insights")
+async def get_ai_insights(
+    background: bool = False,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Gera insights personalizados com IA baseado no histórico de trades.
+    Com background=true, se não houver insights prontos para os dados atuais,
+    a geração roda como job (202 + job_id, ver /api/jobs/{job_id}).
+    """
+    
+    # Insights pré-gerados (scheduler ou chamada anterior) com os dados atuais
+    snapshot = await get_fresh_snapshot(db, user_id)
+    if snapshot:
+        return {
+            "has_data": True,
+            "trades_analyzed": snapshot.trades_analyzed,
+            "generated_at": snapshot.generated_at.isoformat(),
+            "cached": True,
+            "insights": json.loads(snapshot.insights)
+        }
+    
+    if background:
+        async with async_session() as writer:
+            job = await enqueue_job(writer, "ai_insights", {}, user_id=user_id, unique=True)
+        return JSONResponse(status_code=202, content=job_ref(job))
+    
+    return await _generate_insights(db, user_id)
+
+
+@router.get("/scheduler/status")
+async def insights_scheduler_status():
+    """Status do scheduler de insights: fila, throughput e rate limit"""
+    return get_insight_scheduler().status()
+
+
+@router.post("/scheduler/run")
+async def run_insights_scheduler():
+    """Enfileira agora os usuários com dados novos desde a última geração"""
+    scheduler = get_insight_scheduler()
+    if not scheduler.status()["running"]:
+        raise HTTPException(status_code=409, detail="Scheduler de insights desativado")
+    
+    enqueued = await scheduler.enqueue_changed_users()
+    return {"enqueued": enqueued, "queue_depth": scheduler.queue.qsize()}
+
+
 @router.get("/quick-analysis")
 async def quick_analysis(
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Análise rápida sem usar IA (baseada em regras)"""
     
-    query = select(Trade).where(Trade.user_id == user_id)
+    query = select(Trade.symbol, Trade.profit, Trade.open_time).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None))
     result = await db.execute(query)
-    trades = result.scalars().all()
+    trades = result.all()
     
     if not trades:
         return {"insights": [], "message": "Sem trades para analisar"}
     
-    insights = []
-    
-    # Análise de horários
-    hourly_performance = {}
-    for trade in trades:
-        hour = trade.open_time.hour
-        if hour not in hourly_performance:
-            hourly_performance[hour] = {"wins": 0, "losses": 0, "profit": 0}
-        
-        hourly_performance[hour]["profit"] += trade.profit
-        if trade.profit > 0:
-            hourly_performance[hour]["wins"] += 1
-        else:
-            hourly_performance[hour]["losses"] += 1
-    
-    # Encontrar melhor e pior horário
-    if hourly_performance:
-        best_hour = max(hourly_performance.items(), key=lambda x: x[1]["profit"])
-        worst_hour = min(hourly_performance.items(), key=lambda x: x[1]["profit"])
-        
-        if best_hour[1]["profit"] > 0:
-            insights.append({
-                "type": "success",
-                "category": "timing",
-                "title": "⏰ Melhor Horário",
-                "description": f"Seu melhor horário para operar é às {best_hour[0]:02d}:00. Você lucrou R$ {best_hour[1]['profit']:.2f} nesse horário.",
-                "action": f"Considere concentrar suas operações próximo das {best_hour[0]:02d}:00"
-            })
-        
-        if worst_hour[1]["profit"] < 0:
-            insights.append({
-                "type": "warning",
-                "category": "timing", 
-                "title": "⚠️ Horário Problemático",
-                "description": f"Evite operar às {worst_hour[0]:02d}:00. Você perdeu R$ {abs(worst_hour[1]['profit']):.2f} nesse horário.",
-                "action": f"Considere não operar entre {worst_hour[0]:02d}:00 e {worst_hour[0]+1:02d}:00"
-            })
-    
-    # Análise de símbolos
-    symbol_performance = {}
-    for trade in trades:
-        if trade.symbol not in symbol_performance:
-            symbol_performance[trade.symbol] = {"wins": 0, "total": 0, "profit": 0}
-        
-        symbol_performance[trade.symbol]["profit"] += trade.profit
-        symbol_performance[trade.symbol]["total"] += 1
-        if trade.profit > 0:
-            symbol_performance[trade.symbol]["wins"] += 1
-    
-    for symbol, data in symbol_performance.items():
-        win_rate = (data["wins"] / data["total"]) * 100 if data["total"] > 0 else 0
-        
-        if win_rate < 40 and data["total"] >= 5:
-            insights.append({
-                "type": "danger",
-                "category": "symbol",
-                "title": f"🚨 Baixo Win Rate em {symbol}",
-                "description": f"Seu win rate em {symbol} é de apenas {win_rate:.1f}% ({data['wins']}/{data['total']} trades).",
-                "action": f"Revise sua estratégia para {symbol} ou considere não operar esse ativo"
-            })
-        elif win_rate > 70 and data["total"] >= 5:
-            insights.append({
-                "type": "success",
-                "category": "symbol",
-                "title": f"🌟 Excelente em {symbol}",
-                "description": f"Seu win rate em {symbol} é de {win_rate:.1f}%! Lucro total: R$ {data['profit']:.2f}",
-                "action": f"Continue focando em {symbol}, você tem vantagem nesse ativo"
-            })
-    
-    # Análise de sequências (revenge trading)
-    losses_sequence = 0
-    max_losses_sequence = 0
-    for trade in sorted(trades, key=lambda x: x.open_time):
-        if trade.profit < 0:
-            losses_sequence += 1
-            max_losses_sequence = max(max_losses_sequence, losses_sequence)
-        else:
-            losses_sequence = 0
-    
-    if max_losses_sequence >= 3:
-        insights.append({
-            "type": "warning",
-            "category": "psychology",
-            "title": "🧠 Possível Revenge Trading",
-            "description": f"Você teve uma sequência de {max_losses_sequence} losses seguidos. Isso pode indicar revenge trading.",
-            "action": "Após 2 losses seguidos, faça uma pausa de pelo menos 15 minutos"
-        })
-    
-    # Win rate geral
-    wins = len([t for t in trades if t.profit > 0])
-    total = len(trades)
-    win_rate = (wins / total) * 100
-    
-    if win_rate < 50:
-        insights.append({
-            "type": "warning",
-            "category": "general",
-            "title": "📉 Win Rate Abaixo de 50%",
-            "description": f"Seu win rate geral é de {win_rate:.1f}%. Isso significa que você perde mais trades do que ganha.",
-            "action": "Revise seus critérios de entrada e considere ser mais seletivo"
-        })
-    
-    # Gestão de risco
-    profits = [t.profit for t in trades]
-    avg_win = sum(p for p in profits if p > 0) / max(1, len([p for p in profits if p > 0]))
-    avg_loss = abs(sum(p for p in profits if p < 0)) / max(1, len([p for p in profits if p < 0]))
-    
-    if avg_loss > avg_win * 1.5:
-        insights.append({
-            "type": "danger",
-            "category": "risk",
-            "title": "⚠️ Loss Médio Muito Alto",
-            "description": f"Seu loss médio (R$ {avg_loss:.2f}) é muito maior que seu gain médio (R$ {avg_win:.2f}).",
-            "action": "Use stop loss mais curto ou aumente seu take profit"
-        })
-    
-    # Recomendações de gestão
-    suggested_loss = avg_loss * 2
-    suggested_gain = avg_win * 3
-    
-    insights.append({
-        "type": "info",
-        "category": "management",
-        "title": "💰 Limites Sugeridos",
-        "description": f"Com base no seu histórico, sugerimos: Loss diário máximo de R$ {suggested_loss:.2f} e meta de gain de R$ {suggested_gain:.2f}",
-        "action": "Configure esses limites no seu operacional"
-    })
+    insights = RuleEngine().run(trades_to_frame(trades))
     
     return {
         "trades_analyzed": len(trades),
@@ -208,20 +150,17 @@ async def quick_analysis(
 async def chat_with_ai(
     message: str,
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Chat com IA sobre suas operações"""
     
-    query = select(Trade).where(Trade.user_id == user_id)
-    result = await db.execute(query)
-    trades = result.scalars().all()
-    
     ai_service = AIService()
-    response = await ai_service.chat(message, trades)
+    result = await ai_service.chat(message, db, user_id)
     
     return {
         "message": message,
-        "response": response,
+        "response": result["response"],
+        "tool_calls": result["tool_calls"],
         "timestamp": datetime.now().isoformat()
     }
 
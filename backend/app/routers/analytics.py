@@ -5,8 +5,10 @@ from typing import Optional
 from datetime import datetime, date, timedelta
 import pandas as pd
 
-from app.database import get_db
+from app.database import get_read_db
 from app.models.trade import Trade
+from app.models.user import User
+from app.services.behavior import BehaviorAnalyzer
 from app.schemas.analytics import (
     DashboardStats, 
     HourlyPerformance, 
@@ -24,10 +26,10 @@ async def get_dashboard_stats(
     user_id: int = 1,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Retorna estatísticas gerais do dashboard"""
-    query = select(Trade).where(Trade.user_id == user_id)
+    query = select(Trade).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None))
     
     if start_date:
         query = query.where(Trade.open_time >= datetime.combine(start_date, datetime.min.time()))
@@ -99,10 +101,10 @@ async def get_dashboard_stats(
 @router.get("/hourly-performance")
 async def get_hourly_performance(
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Análise de performance por horário"""
-    query = select(Trade).where(Trade.user_id == user_id)
+    query = select(Trade).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None))
     result = await db.execute(query)
     trades = result.scalars().all()
     
@@ -134,10 +136,10 @@ async def get_hourly_performance(
 @router.get("/symbol-performance")
 async def get_symbol_performance(
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Análise de performance por ativo"""
-    query = select(Trade).where(Trade.user_id == user_id)
+    query = select(Trade).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None))
     result = await db.execute(query)
     trades = result.scalars().all()
     
@@ -172,13 +174,14 @@ async def get_symbol_performance(
 async def get_daily_performance(
     user_id: int = 1,
     days: int = Query(30, ge=7, le=365),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Performance diária dos últimos X dias"""
     start_date = datetime.now() - timedelta(days=days)
     
     query = select(Trade).where(
         Trade.user_id == user_id,
+        Trade.duplicate_of.is_(None),
         Trade.open_time >= start_date
     ).order_by(Trade.open_time)
     
@@ -215,7 +218,7 @@ async def get_daily_performance(
 @router.get("/weekly-stats")
 async def get_weekly_stats(
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Estatísticas da semana atual"""
     today = datetime.now()
@@ -224,6 +227,7 @@ async def get_weekly_stats(
     
     query = select(Trade).where(
         Trade.user_id == user_id,
+        Trade.duplicate_of.is_(None),
         Trade.open_time >= start_of_week
     )
     
@@ -271,7 +275,7 @@ async def get_weekly_stats(
 @router.get("/monthly-stats")
 async def get_monthly_stats(
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Estatísticas do mês atual"""
     today = datetime.now()
@@ -279,6 +283,7 @@ async def get_monthly_stats(
     
     query = select(Trade).where(
         Trade.user_id == user_id,
+        Trade.duplicate_of.is_(None),
         Trade.open_time >= start_of_month
     )
     
@@ -311,3 +316,27 @@ async def get_monthly_stats(
     }
 
 
+
+
+@router.get("/behavior")
+async def get_behavior_analysis(
+    user_id: int = 1,
+    daily_loss_limit: Optional[float] = Query(None, ge=0),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Padrões comportamentais: revenge trading, aumento de mão após loss,
+    overtrading e operações após atingir o limite de loss diário
+    """
+    if daily_loss_limit is None:
+        user = await db.get(User, user_id)
+        daily_loss_limit = user.daily_loss_limit if user and user.daily_loss_limit else 0
+    
+    query = select(
+        Trade.open_time, Trade.close_time, Trade.profit, Trade.volume
+    ).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None)).order_by(Trade.open_time)
+    
+    result = await db.execute(query)
+    analyzer = BehaviorAnalyzer.from_rows(result.all())
+    
+    return analyzer.report(daily_loss_limit)
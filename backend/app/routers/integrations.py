@@ -1,19 +1,34 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, UploadFile, File
+from fastapi.responses import JSONResponse
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
+import asyncio
+import json
 from datetime import datetime, timedelta
 
-from app.database import get_db
+from app.config import get_settings
+from app.database import get_db, get_read_db, async_session
 from app.models.trade import Trade
+from app.models.broker_account import MetaAPIAccount
+from app.models.sync_state import SyncState
+from app.models.webhook_dead_letter import WebhookDeadLetter
 from app.schemas.integrations import (
     MT5Credentials, 
     MT5ConnectionStatus,
     TradingViewWebhook,
     SyncResult
 )
-from app.services.metatrader_service import MetaTraderService
+from app.services.metatrader_service import MetaTraderService, MetaTraderTimeout
 from app.services.tradingview_service import TradingViewService
 from app.services.metaapi_service import MetaAPIService, get_setup_instructions
+from app.services.sync_service import sync_metaapi_account, sync_mt5_account, mt5_trade_to_row
+from app.services.mt5_report import iter_report_trades, ReportFormatError
+from app.services.sync_scheduler import get_sync_scheduler
+from app.services.trade_writer import insert_trades
+from app.services.webhook_ingest import get_webhook_ingestor, IngestQueueFull
+from app.services.jobs import JobContext, RetryLater, job_handler, enqueue_job, job_ref
+from app.utils.crypto import encrypt_secret
 
 router = APIRouter()
 
@@ -23,8 +38,7 @@ router = APIRouter()
 @router.post("/mt5/connect")
 async def connect_mt5(
     credentials: MT5Credentials,
-    user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    user_id: int = 1
 ):
     """Conecta ao MetaTrader 5"""
     mt5_service = MetaTraderService()
@@ -59,22 +73,65 @@ async def connect_mt5(
                 "connected": False,
                 "message": result.get("message")
             }
+    except MetaTraderTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _run_mt5_sync(db: AsyncSession, user_id: int, credentials: MT5Credentials, days: int, full: bool) -> dict:
+    mt5_service = MetaTraderService()
+    result = await mt5_service.connect(
+        login=credentials.login,
+        password=credentials.password,
+        server=credentials.server
+    )
+    
+    if not result.get("success"):
+        return {
+            "success": False,
+            "message": result.get("message", "Falha na conexão com MT5"),
+            "trades_imported": 0,
+            "trades_skipped": 0
+        }
+    
+    try:
+        return await sync_mt5_account(db, user_id, mt5_service, credentials.login, days=days, full=full)
+    finally:
+        await mt5_service.disconnect()
+
+
+# A biblioteca do MT5 fala com um terminal por processo: syncs em série
+@job_handler("mt5_sync", concurrency=1)
+async def _mt5_sync_job(job: JobContext, payload: dict):
+    credentials = MT5Credentials(**payload["credentials"])
+    job.report(0.1, "Conectando ao MetaTrader 5")
+    async with async_session() as db:
+        result = await _run_mt5_sync(db, job.user_id, credentials, payload["days"], payload["full"])
+    if not result.get("success"):
+        raise RuntimeError(result["message"])
+    return result
+
+
 @router.post("/mt5/sync")
 async def sync_mt5_trades(
     credentials: MT5Credentials,
     days: int = 30,
+    full: bool = False,
+    background: bool = False,
     user_id: int = 1,
     db: AsyncSession = Depends(get_db)
 ):
-    """Sincroniza trades do MetaTrader 5"""
+    """
+    Sincroniza trades do MetaTrader 5.
+    Após o primeiro sync, busca apenas os deals novos desde a última sincronização;
+    use full=true para refazer o período inteiro.
+    Com background=true roda como job (202 + job_id, ver /api/jobs/{job_id}).
+    """
     import platform
     
-    # Verificar se está no Windows
-    if platform.system() != "Windows":
+    # Verificar se está no Windows (o stub local roda em qualquer sistema)
+    if platform.system() != "Windows" and not get_settings().mt5_use_stub:
         return {
             "success": False,
             "message": f"⚠️ Integração direta com MetaTrader5 só funciona no Windows. Você está usando {platform.system()}.",
@@ -89,91 +146,68 @@ async def sync_mt5_trades(
                 "step1": "Abra o MetaTrader 5",
                 "step2": "Vá em 'Caixa de Ferramentas' > aba 'Histórico'",
                 "step3": "Clique com botão direito > 'Relatório'",
-                "step4": "Escolha 'Open XML' ou salve como arquivo",
-                "step5": "Faça upload do arquivo aqui no TradeStars"
+                "step4": "Escolha 'XML' ou 'HTML' e salve o arquivo",
+                "step5": "Faça upload do arquivo aqui no TradeStars (/api/integrations/mt5/import-report)"
             }
         }
     
-    mt5_service = MetaTraderService()
+    if background:
+        # Credenciais criptografadas, guardadas só até o job terminar
+        job = await enqueue_job(
+            db, "mt5_sync", {"login": credentials.login, "server": credentials.server, "days": days, "full": full},
+            user_id=user_id, unique=True, secrets={"credentials": credentials.model_dump()}
+        )
+        return JSONResponse(status_code=202, content=job_ref(job))
     
     try:
-        result = await mt5_service.connect(
-            login=credentials.login,
-            password=credentials.password,
-            server=credentials.server
-        )
-        
-        if not result.get("success"):
-            return {
-                "success": False,
-                "message": result.get("message", "Falha na conexão com MT5"),
-                "trades_imported": 0,
-                "trades_skipped": 0
-            }
-        
-        # Buscar histórico
-        from_date = datetime.now() - timedelta(days=days)
-        trades_data = await mt5_service.get_history(from_date)
-        
-        if not trades_data:
-            return {
-                "success": True,
-                "message": "Nenhum trade encontrado no período",
-                "trades_imported": 0,
-                "trades_skipped": 0
-            }
-        
-        imported = 0
-        skipped = 0
-        
-        for trade in trades_data:
-            # Verificar se já existe
-            from sqlalchemy import select
-            existing = await db.execute(
-                select(Trade).where(
-                    Trade.user_id == user_id,
-                    Trade.external_id == str(trade["ticket"]),
-                    Trade.source == "METATRADER"
-                )
-            )
-            
-            if existing.scalar_one_or_none():
-                skipped += 1
-                continue
-            
-            db_trade = Trade(
-                user_id=user_id,
-                symbol=trade["symbol"],
-                trade_type=trade["type"],
-                volume=trade["volume"],
-                entry_price=trade["price_open"],
-                exit_price=trade["price_close"],
-                profit=trade["profit"],
-                commission=trade.get("commission", 0),
-                swap=trade.get("swap", 0),
-                open_time=trade["time_open"],
-                close_time=trade["time_close"],
-                duration_minutes=int((trade["time_close"] - trade["time_open"]).total_seconds() / 60),
-                source="METATRADER",
-                external_id=str(trade["ticket"])
-            )
-            db.add(db_trade)
-            imported += 1
-        
-        await db.commit()
-        await mt5_service.disconnect()
-        
-        return {
-            "success": True,
-            "message": f"✅ Sincronização concluída!",
-            "trades_imported": imported,
-            "trades_skipped": skipped
-        }
-        
+        return await _run_mt5_sync(db, user_id, credentials, days, full)
+    except MetaTraderTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/mt5/import-report")
+async def import_mt5_report(
+    file: UploadFile = File(...),
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Importa o relatório de histórico salvo pelo MT5 (XML ou HTML).
+    Alternativa ao sync direto para quem não usa Windows.
+    Cada lote é gravado numa transação curta; se o arquivo estiver corrompido no
+    meio, os lotes anteriores ficam e o reenvio do relatório corrigido só completa.
+    """
+    stats = {}
+    batches = iter_report_trades(file.file, file.filename, stats)
+    imported = skipped = 0
+    
+    try:
+        while True:
+            # Leitura incremental do arquivo, lote a lote, fora do event loop e sem
+            # transação aberta: a conexão de escrita só é usada para gravar o lote
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            batch_imported, batch_skipped = await insert_trades(
+                db, user_id, (mt5_trade_to_row(t) for t in batch), "METATRADER"
+            )
+            await db.commit()
+            imported += batch_imported
+            skipped += batch_skipped
+    except ReportFormatError as e:
+        raise HTTPException(status_code=400, detail=f"{e} ({imported} trades já importados)")
+    
+    return {
+        "success": True,
+        "message": f"✅ {imported} trades importados do relatório do MT5",
+        "trades_imported": imported,
+        "trades_skipped": skipped,
+        **stats
+    }
+
+
 @router.get("/mt5/status")
 async def mt5_status():
     """Verifica status da conexão MT5"""
@@ -201,8 +235,23 @@ async def test_metaapi_connection(
 ):
     """Testa a conexão com MetaAPI"""
     service = MetaAPIService(api_token=api_token, account_id=account_id)
-    result = await service.test_connection()
-    await service.close()
+    try:
+        return await service.test_connection()
+    finally:
+        await service.close()
+
+
+@job_handler("metaapi_sync", concurrency=4)
+async def _metaapi_sync_job(job: JobContext, payload: dict):
+    async with async_session() as db:
+        result = await sync_metaapi_account(
+            db, job.user_id, payload["api_token"], payload["account_id"],
+            days=payload["days"], full=payload["full"], progress=job.report
+        )
+    if not result.get("success"):
+        if result.get("rate_limited") or result.get("retry_after") is not None:
+            raise RetryLater(result["message"], result.get("retry_after"))
+        raise RuntimeError(result["message"])
     return result
 
 
@@ -211,161 +260,200 @@ async def sync_metaapi_trades(
     api_token: str,
     account_id: str,
     days: int = 30,
+    full: bool = False,
+    background: bool = False,
     user_id: int = 1,
     db: AsyncSession = Depends(get_db)
 ):
     """
     Sincroniza trades do MetaTrader via MetaAPI.
     Funciona em qualquer sistema operacional (Mac, Linux, Windows)!
+    Após o primeiro sync, busca apenas os deals novos (days só vale para o backfill
+    inicial ou com full=true).
+    Com background=true roda como job (202 + job_id, ver /api/jobs/{job_id}).
     """
-    service = MetaAPIService(api_token=api_token, account_id=account_id)
-    
-    # Testar conexão primeiro
-    connection = await service.test_connection()
-    if not connection.get("success"):
-        await service.close()
-        return {
-            "success": False,
-            "message": connection.get("message"),
-            "trades_imported": 0
-        }
-    
-    # Buscar histórico
-    history = await service.get_history(days=days)
+    if background:
+        job = await enqueue_job(
+            db, "metaapi_sync",
+            {"account_id": account_id, "days": days, "full": full},
+            user_id=user_id, unique=True, secrets={"api_token": api_token}
+        )
+        return JSONResponse(status_code=202, content=job_ref(job))
     
-    if not history.get("success"):
+    return await sync_metaapi_account(db, user_id, api_token, account_id, days=days, full=full)
+
+
+@router.get("/metaapi/account-info")
+async def get_metaapi_account(
+    api_token: str,
+    account_id: str
+):
+    """Busca informações da conta MT5 via MetaAPI"""
+    service = MetaAPIService(api_token=api_token, account_id=account_id)
+    try:
+        return await service.get_account_info()
+    finally:
         await service.close()
-        return {
-            "success": False,
-            "message": history.get("message"),
-            "trades_imported": 0
-        }
-    
-    trades_data = history.get("trades", [])
-    
-    if not trades_data:
+
+
+@router.post("/metaapi/accounts")
+async def register_metaapi_account(
+    api_token: str,
+    account_id: str,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Cadastra uma conta MetaAPI para sincronização automática em background.
+    O primeiro sync (backfill) é feito pelo scheduler logo após o cadastro.
+    """
+    service = MetaAPIService(api_token=api_token, account_id=account_id)
+    try:
+        connection = await service.test_connection()
+    finally:
         await service.close()
-        return {
-            "success": True,
-            "message": "✅ Conexão OK, mas nenhum trade encontrado no período",
-            "trades_imported": 0,
-            "account": connection.get("account")
-        }
-    
-    # Importar trades
-    imported = 0
-    skipped = 0
     
-    for trade in trades_data:
-        try:
-            # Criar ID único para o trade
-            external_id = f"metaapi_{trade.get('symbol')}_{trade.get('open_time')}"
-            
-            # Verificar se já existe
-            from sqlalchemy import select
-            existing = await db.execute(
-                select(Trade).where(
-                    Trade.user_id == user_id,
-                    Trade.external_id == external_id,
-                    Trade.source == "METAAPI"
-                )
-            )
-            
-            if existing.scalar_one_or_none():
-                skipped += 1
-                continue
-            
-            # Converter datetime string para objeto
-            open_time = datetime.fromisoformat(trade["open_time"].replace("Z", "+00:00"))
-            close_time = None
-            if trade.get("close_time"):
-                close_time = datetime.fromisoformat(trade["close_time"].replace("Z", "+00:00"))
-            
-            db_trade = Trade(
-                user_id=user_id,
-                symbol=trade["symbol"],
-                trade_type=trade["type"],
-                volume=trade.get("volume", 1),
-                entry_price=trade.get("entry_price", 0),
-                exit_price=trade.get("exit_price"),
-                profit=trade.get("profit", 0),
-                commission=trade.get("commission", 0),
-                swap=trade.get("swap", 0),
-                open_time=open_time,
-                close_time=close_time,
-                duration_minutes=trade.get("duration_minutes", 0),
-                source="METAAPI",
-                external_id=external_id
-            )
-            db.add(db_trade)
-            imported += 1
-            
-        except Exception as e:
-            print(f"Erro ao importar trade: {e}")
-            continue
+    if not connection.get("success"):
+        raise HTTPException(status_code=400, detail=connection.get("message"))
     
+    result = await db.execute(
+        select(MetaAPIAccount).where(
+            MetaAPIAccount.user_id == user_id,
+            MetaAPIAccount.account_id == account_id
+        )
+    )
+    account = result.scalar_one_or_none()
+    if account is None:
+        account = MetaAPIAccount(user_id=user_id, account_id=account_id)
+        db.add(account)
+    account.api_token_encrypted = encrypt_secret(api_token)
+    account.enabled = True
     await db.commit()
-    await service.close()
     
     return {
         "success": True,
-        "message": f"✅ Sincronização concluída!",
-        "trades_imported": imported,
-        "trades_skipped": skipped,
-        "total_found": len(trades_data),
-        "account": connection.get("account")
+        "message": "✅ Conta cadastrada para sincronização automática",
+        "account_id": account_id,
+        "account": connection.get("account"),
+        "scheduler_running": get_sync_scheduler().status()["running"]
     }
 
 
-@router.get("/metaapi/account-info")
-async def get_metaapi_account(
-    api_token: str,
-    account_id: str
+@router.get("/metaapi/accounts")
+async def list_metaapi_accounts(
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    """Busca informações da conta MT5 via MetaAPI"""
-    service = MetaAPIService(api_token=api_token, account_id=account_id)
-    result = await service.get_account_info()
-    await service.close()
-    return result
+    """Lista as contas MetaAPI cadastradas e o estado do último sync"""
+    result = await db.execute(
+        select(MetaAPIAccount, SyncState.last_deal_time)
+        .outerjoin(
+            SyncState,
+            (SyncState.user_id == MetaAPIAccount.user_id)
+            & (SyncState.source == "METAAPI")
+            & (SyncState.account_id == MetaAPIAccount.account_id)
+        )
+        .where(MetaAPIAccount.user_id == user_id)
+    )
+    
+    return [
+        {
+            "account_id": account.account_id,
+            "enabled": account.enabled,
+            "last_synced_at": account.last_synced_at.isoformat() if account.last_synced_at else None,
+            "synced_until": last_deal_time.isoformat() if last_deal_time else None,
+            "last_error": account.last_error
+        }
+        for account, last_deal_time in result.all()
+    ]
+
+
+@router.delete("/metaapi/accounts/{account_id}")
+async def remove_metaapi_account(
+    account_id: str,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """Remove a conta da sincronização automática (os trades importados são mantidos)"""
+    result = await db.execute(
+        select(MetaAPIAccount).where(
+            MetaAPIAccount.user_id == user_id,
+            MetaAPIAccount.account_id == account_id
+        )
+    )
+    account = result.scalar_one_or_none()
+    if account is None:
+        raise HTTPException(status_code=404, detail="Conta não cadastrada")
+    
+    await db.delete(account)
+    await db.commit()
+    return {"success": True}
+
+
+@router.get("/metaapi/scheduler/status")
+async def metaapi_scheduler_status():
+    """Status do sync automático: contas, fila, jobs e rate limit"""
+    return get_sync_scheduler().status()
 
 
 # ==================== TRADINGVIEW ====================
 
-@router.post("/tradingview/webhook")
+@router.post("/tradingview/webhook", status_code=202)
 async def tradingview_webhook(
     webhook: TradingViewWebhook,
-    user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    user_id: int = 1
 ):
-    """Recebe webhooks do TradingView para registrar trades"""
+    """
+    Recebe webhooks do TradingView para registrar trades.
+    O alerta é validado e enfileirado; a gravação acontece em lote logo em seguida.
+    """
     try:
         tv_service = TradingViewService()
         trade_data = tv_service.parse_webhook(webhook.dict())
-        
-        db_trade = Trade(
-            user_id=user_id,
-            symbol=trade_data["symbol"],
-            trade_type=trade_data["type"],
-            volume=trade_data.get("volume", 1.0),
-            entry_price=trade_data["price"],
-            profit=trade_data.get("profit", 0),
-            open_time=datetime.now(),
-            source="TRADINGVIEW",
-            external_id=trade_data.get("id"),
-            notes=trade_data.get("message")
-        )
-        
-        db.add(db_trade)
-        await db.commit()
-        
-        return {
-            "success": True,
-            "message": "Trade registrado via TradingView",
-            "trade_id": db_trade.id
-        }
-        
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        ingest_id = await get_webhook_ingestor().submit(user_id, trade_data)
+    except IngestQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
+    return {
+        "success": True,
+        "message": "Trade recebido via TradingView",
+        "id": ingest_id
+    }
+
+
+@router.get("/tradingview/webhook/status")
+async def tradingview_webhook_status():
+    """Fila de ingestão de webhooks (profundidade e parâmetros do group commit)"""
+    return get_webhook_ingestor().status()
+
+
+@router.get("/tradingview/webhook/dead-letters")
+async def tradingview_webhook_dead_letters(
+    user_id: int = 1,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Alertas aceitos que não puderam ser gravados (payload original e erro)"""
+    result = await db.execute(
+        select(WebhookDeadLetter)
+        .where(WebhookDeadLetter.user_id == user_id)
+        .order_by(WebhookDeadLetter.id.desc())
+        .limit(min(limit, 1000))
+    )
+    return [
+        {
+            "id": row.id,
+            "external_id": row.external_id,
+            "payload": json.loads(row.payload),
+            "error": row.error,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in result.scalars()
+    ]
 
 
 @router.get("/tradingview/setup")
@@ -386,8 +474,13 @@ async def tradingview_setup_info():
             "type": "{{strategy.order.action}}",
             "price": {{close}},
             "volume": {{strategy.order.contracts}},
-            "message": "{{strategy.order.comment}}"
+            "message": "{{strategy.order.comment}}",
+            "strategy": "Minha Estratégia",
+            "position": "{{strategy.market_position}}"
         }
+        
+        Alertas CLOSE_LONG / CLOSE_SHORT (ou com "position": "flat") fecham o
+        trade aberto do mesmo símbolo e estratégia, calculando o resultado.
         """,
         "example_payload": {
             "symbol": "WINZ24",
@@ -401,19 +494,38 @@ async def tradingview_setup_info():
 
 @router.post("/tradingview/import-csv")
 async def import_tradingview_csv(
+    file: UploadFile = File(...),
+    symbol: Optional[str] = None,
     user_id: int = 1,
     db: AsyncSession = Depends(get_db)
 ):
     """
-    Importa relatório exportado do TradingView
-    O TradingView permite exportar trades em CSV através do Strategy Tester
+    Importa a lista de trades exportada do Strategy Tester do TradingView.
+    Entradas e saídas são pareadas pelo Trade #; o CSV não traz o ativo,
+    então informe `symbol` (padrão: nome do arquivo).
     """
-    # Esta rota usa o mesmo parser de CSV, mas com mapeamento específico para TV
+    if not file.filename.lower().endswith('.csv'):
+        raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
+    
+    symbol = (symbol or file.filename.rsplit('.', 1)[0]).split(':')[-1].strip().upper()
+    contents = await file.read()
+    
+    try:
+        # Parsing em thread: backtests grandes não travam o event loop
+        trades_data = await asyncio.to_thread(
+            TradingViewService().parse_strategy_report_csv, contents, symbol
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao processar CSV do Strategy Tester: {str(e)}")
+    
+    imported, skipped = await insert_trades(db, user_id, trades_data, "TRADINGVIEW")
+    await db.commit()
+    
     return {
-        "message": "Use o endpoint /api/trades/upload-csv com o CSV exportado do TradingView",
-        "supported_formats": [
-            "Strategy Tester Export",
-            "Paper Trading History"
-        ]
+        "success": True,
+        "message": f"✅ {imported} trades importados do Strategy Tester",
+        "symbol": symbol,
+        "trades_imported": imported,
+        "trades_skipped": skipped
     }
 
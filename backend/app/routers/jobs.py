@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, desc
+from typing import Optional
+
+from app.database import get_read_db
+from app.models.job import Job
+from app.services.jobs import get_job_runner, job_to_dict
+
+router = APIRouter()
+
+
+@router.get("/")
+async def list_jobs(
+    user_id: int = 1,
+    status: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Jobs recentes do usuário (imports, syncs, insights)"""
+    query = select(Job).where(Job.user_id == user_id)
+    if status:
+        query = query.where(Job.status == status)
+    if kind:
+        query = query.where(Job.kind == kind)
+    result = await db.execute(query.order_by(desc(Job.id)).limit(limit))
+    return [job_to_dict(job) for job in result.scalars().all()]
+
+
+@router.get("/workers/status")
+async def job_workers_status():
+    """Workers por tipo de job e jobs em execução"""
+    return get_job_runner().status()
+
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: int,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Status, progresso e resultado de um job"""
+    result = await db.execute(select(Job).where(Job.id == job_id, Job.user_id == user_id))
+    job = result.scalar_one_or_none()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job_to_dict(job)
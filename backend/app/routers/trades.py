@@ -1,15 +1,26 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Query
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func
 from typing import List, Optional
 from datetime import datetime, date
 import pandas as pd
+import asyncio
 import io
 
-from app.database import get_db
+from app.database import get_db, get_read_db, async_session
 from app.models.trade import Trade
-from app.schemas.trade import TradeCreate, TradeResponse, TradeListResponse
-from app.services.csv_parser import parse_csv_trades
+from app.models.csv_profile import CsvMappingProfile
+from app.schemas.trade import TradeCreate, TradeUpdate, TradeResponse, TradeListResponse, CsvProfileUpdate
+from app.services.csv_parser import parse_csv, header_signature
+from app.services.csv_profiles import get_profile, profile_layout, save_detected, mark_used, apply_override, profile_to_dict
+from app.services.trade_writer import insert_trades, natural_key
+from app.services.bulk_import import import_files
+from app.services.xlsx_parser import TradeSheet
+from app.services.import_preview import PREVIEW_ROWS, read_head, preview_csv, preview_xlsx
+from app.services.upload_ledger import content_hash, stream_hash, find_upload, record_upload, duplicate_upload_detail
+from app.services.duplicate_matcher import mark_duplicates, rebuild_duplicates
+from app.services.jobs import JobContext, job_handler, enqueue_job, job_ref, spool_upload, SPOOL_FILE
 
 router = APIRouter()
 
@@ -22,10 +33,14 @@ async def get_trades(
     symbol: Optional[str] = None,
     start_date: Optional[date] = None,
     end_date: Optional[date] = None,
-    db: AsyncSession = Depends(get_db)
+    include_duplicates: bool = False,
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Retorna lista de trades do usuário"""
     query = select(Trade).where(Trade.user_id == user_id)
+    if not include_duplicates:
+        # Mesma execução importada por outra fonte (ver duplicate_matcher)
+        query = query.where(Trade.duplicate_of.is_(None))
     
     if symbol:
         query = query.where(Trade.symbol == symbol)
@@ -41,6 +56,8 @@ async def get_trades(
     
     # Count total
     count_query = select(Trade).where(Trade.user_id == user_id)
+    if not include_duplicates:
+        count_query = count_query.where(Trade.duplicate_of.is_(None))
     count_result = await db.execute(count_query)
     total = len(count_result.scalars().all())
     
@@ -59,9 +76,12 @@ async def create_trade(
     db: AsyncSession = Depends(get_db)
 ):
     """Cria um novo trade manualmente"""
+    data = trade.model_dump()
     db_trade = Trade(
         user_id=user_id,
-        **trade.model_dump()
+        # Sem external_id: o próximo import do mesmo extrato reconhece o trade
+        natural_key=None if data["external_id"] else natural_key(data),
+        **data
     )
     db.add(db_trade)
     await db.commit()
@@ -69,41 +89,347 @@ async def create_trade(
     return TradeResponse.model_validate(db_trade)
 
 
+async def _dry_run(preview, source, rows: Optional[int], profile):
+    """Roda a prévia com o layout salvo e, se ele não servir mais, com detecção"""
+    try:
+        try:
+            result = await asyncio.to_thread(preview, source, profile_layout(profile) if profile else None, rows)
+        except Exception:
+            if profile is None:
+                raise
+            profile = None
+            result = await asyncio.to_thread(preview, source, None, rows)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao processar arquivo: {str(e)}")
+    
+    return {
+        "dry_run": True,
+        "mapping_profile": profile_to_dict(profile) if profile else None,
+        **result
+    }
+
+
+async def _import_csv(db: AsyncSession, user_id: int, filename: str, contents: bytes,
+                      force: bool, progress=None) -> dict:
+    """Import de CSV já lido (request ou job): dedupe do arquivo, parse, gravação e commit"""
+    header_hash, headers = header_signature(contents)
+    profile = await get_profile(db, user_id, header_hash)
+    
+    file_hash = content_hash(contents)
+    upload = await find_upload(db, user_id, file_hash)
+    if upload is not None and not force:
+        raise HTTPException(status_code=409, detail=duplicate_upload_detail(upload))
+    # Devolve a conexão de escrita durante o parse (só houve leituras até aqui)
+    await db.commit()
+    
+    try:
+        trades_data, layout = await asyncio.to_thread(parse_csv, contents, profile_layout(profile) if profile else None)
+    except Exception as e:
+        if profile is None:
+            raise HTTPException(status_code=400, detail=f"Erro ao processar CSV: {str(e)}")
+        # Layout salvo não serve mais para este arquivo: detecta de novo (sem sobrescrever)
+        try:
+            trades_data, layout = await asyncio.to_thread(parse_csv, contents)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Erro ao processar CSV: {str(e)}")
+    
+    if progress:
+        progress(0.5, f"Gravando {len(trades_data)} trades")
+    
+    if profile is None:
+        profile = save_detected(db, user_id, header_hash, headers, layout)
+    mark_used(profile)
+    
+    imported, skipped = await insert_trades(db, user_id, trades_data, "CSV")
+    record_upload(db, user_id, file_hash, filename, len(contents), "csv", imported, skipped, upload)
+    await db.commit()
+    
+    return {
+        "message": f"✅ {imported} trades importados com sucesso!",
+        "count": imported,
+        "skipped": skipped,
+        "mapping_profile": profile_to_dict(profile),
+        "needs_confirmation": not profile.confirmed and bool(layout.get("guessed"))
+    }
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@job_handler("csv_import", concurrency=1)
+async def _csv_import_job(job: JobContext, payload: dict):
+    contents = await asyncio.to_thread(_read_file, payload[SPOOL_FILE])
+    job.report(0.1, "Lendo arquivo")
+    async with async_session() as db:
+        return await _import_csv(db, job.user_id, payload["filename"], contents, payload["force"], job.report)
+
+
 @router.post("/upload-csv")
 async def upload_csv(
     file: UploadFile = File(...),
+    dry_run: bool = False,
+    validate_all: bool = False,
+    preview_rows: int = Query(PREVIEW_ROWS, ge=1, le=10000),
+    force: bool = False,
+    background: bool = False,
     user_id: int = 1,  # TODO: Get from auth
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
 ):
-    """Upload de arquivo CSV com trades"""
+    """
+    Upload de arquivo CSV com trades.
+    O layout detectado (colunas, formato de data, encoding) fica salvo por
+    cabeçalho; uploads seguintes do mesmo layout pulam a detecção.
+    
+    Um arquivo idêntico a um já importado é recusado (409) sem ser lido;
+    force=true importa de novo. Trades que já existem (extratos que se
+    sobrepõem) são ignorados pela chave natural.
+    
+    Com dry_run=true nada é gravado: retorna o layout, uma amostra dos trades
+    e os erros por linha das primeiras `preview_rows` linhas (ou do arquivo
+    todo com validate_all=true).
+    
+    Com background=true o arquivo é guardado e importado por um job: a
+    resposta (202) traz o job_id para acompanhar em /api/jobs/{job_id}.
+    """
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="Arquivo deve ser CSV")
     
+    if dry_run:
+        if validate_all:
+            contents = await file.read()
+        else:
+            # Só o começo do arquivo: a prévia não depende do tamanho do upload
+            contents = await asyncio.to_thread(read_head, file.file, preview_rows + 1)
+        header_hash, _ = header_signature(contents)
+        # Prévia não grava nada: fica no pool de leitura
+        profile = await get_profile(read_db, user_id, header_hash)
+        return await _dry_run(preview_csv, contents, None if validate_all else preview_rows, profile)
+    
+    if background:
+        path = await asyncio.to_thread(spool_upload, file.file)
+        job = await enqueue_job(
+            db, "csv_import", {SPOOL_FILE: path, "filename": file.filename, "force": force}, user_id=user_id
+        )
+        return JSONResponse(status_code=202, content=job_ref(job))
+    
+    contents = await file.read()
+    return await _import_csv(db, user_id, file.filename, contents, force)
+
+
+@router.post("/upload-xlsx")
+async def upload_xlsx(
+    file: UploadFile = File(...),
+    dry_run: bool = False,
+    validate_all: bool = False,
+    preview_rows: int = Query(PREVIEW_ROWS, ge=1, le=10000),
+    force: bool = False,
+    user_id: int = 1,  # TODO: Get from auth
+    db: AsyncSession = Depends(get_db),
+    read_db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Upload de planilha Excel (.xlsx) com trades (Profit, Clear, ...).
+    A aba de operações é encontrada pelo cabeçalho e lida linha a linha em
+    lotes, cada um gravado numa transação curta; o layout detectado fica
+    salvo como nos uploads de CSV.
+    dry_run, validate_all e force funcionam como no upload de CSV.
+    """
+    if not file.filename.lower().endswith('.xlsx'):
+        raise HTTPException(status_code=400, detail="Arquivo deve ser .xlsx")
+    
+    upload = file_hash = None
+    if not dry_run:
+        file_hash = await asyncio.to_thread(stream_hash, file.file)
+        upload = await find_upload(db, user_id, file_hash)
+        if upload is not None and not force:
+            raise HTTPException(status_code=409, detail=duplicate_upload_detail(upload))
+        # Devolve a conexão de escrita enquanto a planilha é aberta (só houve leituras)
+        await db.commit()
+    
     try:
-        contents = await file.read()
-        trades_data = parse_csv_trades(contents)
-        
-        created_trades = []
-        for trade_data in trades_data:
-            db_trade = Trade(user_id=user_id, **trade_data)
-            db.add(db_trade)
-            created_trades.append(db_trade)
+        sheet = await asyncio.to_thread(TradeSheet, file.file)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Erro ao abrir planilha: {str(e)}")
+    
+    try:
+        if dry_run:
+            profile = await get_profile(read_db, user_id, sheet.header_hash)
+            result = await _dry_run(preview_xlsx, sheet, None if validate_all else preview_rows, profile)
+            return {"sheet": sheet.sheet.title, **result}
         
+        profile = await get_profile(db, user_id, sheet.header_hash)
         await db.commit()
-        
-        return {
-            "message": f"✅ {len(created_trades)} trades importados com sucesso!",
-            "count": len(created_trades)
-        }
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Erro ao processar CSV: {str(e)}")
+        layout = profile_layout(profile) if profile else None
+        imported = skipped = 0
+        while True:
+            batches = sheet.batches(layout)
+            try:
+                while True:
+                    # Leitura da planilha fora do event loop e sem transação aberta;
+                    # cada lote é commitado antes de ler o próximo
+                    batch = await asyncio.to_thread(next, batches, None)
+                    if batch is None:
+                        break
+                    batch_imported, batch_skipped = await insert_trades(db, user_id, batch, "CSV")
+                    await db.commit()
+                    imported += batch_imported
+                    skipped += batch_skipped
+                break
+            except Exception as e:
+                await db.rollback()
+                if layout is None or imported:
+                    # Lotes já gravados ficam; reenviar a planilha corrigida só completa
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Erro ao processar planilha: {str(e)} ({imported} trades já importados)"
+                    )
+                # Layout salvo não serve mais para esta planilha: detecta de novo (sem sobrescrever)
+                layout = None
+    finally:
+        sheet.close()
+    
+    if profile is None:
+        profile = save_detected(db, user_id, sheet.header_hash, sheet.headers, sheet.layout)
+    mark_used(profile)
+    record_upload(db, user_id, file_hash, file.filename, file.size or 0, "xlsx", imported, skipped, upload)
+    await db.commit()
+    
+    return {
+        "message": f"✅ {imported} trades importados com sucesso!",
+        "count": imported,
+        "skipped": skipped,
+        "sheet": sheet.sheet.title,
+        "mapping_profile": profile_to_dict(profile),
+        "needs_confirmation": not profile.confirmed and bool(sheet.layout.get("guessed"))
+    }
+
+
+@router.post("/import-files")
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    symbol: Optional[str] = None,
+    force: bool = False,
+    user_id: int = 1,  # TODO: Get from auth
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Importa vários arquivos de uma vez (ou um ZIP com eles): CSVs,
+    planilhas Excel, listas de trades do Strategy Tester do TradingView e relatórios do MT5
+    (XML/HTML). Os arquivos são processados em paralelo e o resultado traz
+    um relatório por arquivo. `symbol` vale para os CSVs do Strategy Tester
+    (padrão: nome do arquivo). Arquivos idênticos a um já importado são
+    pulados, a menos que force=true.
+    """
+    result = await import_files(db, user_id, [(f.filename or "", f.file) for f in files], symbol, force)
+    
+    return {
+        "message": f"✅ {result['trades_imported']} trades importados de {len(result['files'])} arquivos",
+        **result
+    }
+
+
+@router.get("/csv-profiles")
+async def list_csv_profiles(
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Layouts de CSV salvos (mapeamento de colunas, formato de data e encoding)"""
+    result = await db.execute(
+        select(CsvMappingProfile)
+        .where(CsvMappingProfile.user_id == user_id)
+        .order_by(desc(CsvMappingProfile.last_used_at))
+    )
+    return [profile_to_dict(p) for p in result.scalars().all()]
+
+
+@router.put("/csv-profiles/{profile_id}")
+async def update_csv_profile(
+    profile_id: int,
+    changes: CsvProfileUpdate,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """Confirma ou corrige o layout detectado (vale para os próximos uploads)"""
+    profile = await db.get(CsvMappingProfile, profile_id)
+    if profile is None or profile.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Layout não encontrado")
+    
+    try:
+        apply_override(profile, changes.model_dump(exclude_none=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    await db.commit()
+    return profile_to_dict(profile)
+
+
+@router.delete("/csv-profiles/{profile_id}")
+async def delete_csv_profile(
+    profile_id: int,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """Remove um layout salvo (o próximo upload detecta de novo)"""
+    profile = await db.get(CsvMappingProfile, profile_id)
+    if profile is None or profile.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Layout não encontrado")
+    
+    await db.delete(profile)
+    await db.commit()
+    return {"message": "Layout removido"}
+
+
+@router.get("/duplicates")
+async def duplicate_summary(
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Trades marcados como duplicata de outra fonte, por fonte"""
+    result = await db.execute(
+        select(Trade.source, func.count(Trade.id))
+        .where(Trade.user_id == user_id, Trade.duplicate_of.isnot(None))
+        .group_by(Trade.source)
+    )
+    by_source = dict(result.all())
+    return {"duplicates": sum(by_source.values()), "by_source": by_source}
+
+
+@job_handler("duplicates_rebuild", concurrency=1)
+async def _rebuild_duplicates_job(job: JobContext, payload: dict):
+    async with async_session() as db:
+        result = await rebuild_duplicates(db, job.user_id, progress=job.report)
+        await db.commit()
+    return result
+
+
+@router.post("/duplicates/rebuild")
+async def rebuild_duplicate_marks(
+    background: bool = False,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Refaz a detecção de duplicatas entre fontes em todo o histórico do usuário
+    (trades importados antes da detecção ou após mudar as tolerâncias).
+    Com background=true roda como job (202 + job_id).
+    """
+    if background:
+        job = await enqueue_job(db, "duplicates_rebuild", {}, user_id=user_id, unique=True)
+        return JSONResponse(status_code=202, content=job_ref(job))
+    
+    result = await rebuild_duplicates(db, user_id)
+    await db.commit()
+    return result
 
 
 @router.get("/{trade_id}", response_model=TradeResponse)
 async def get_trade(
     trade_id: int,
     user_id: int = 1,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """Retorna um trade específico"""
     query = select(Trade).where(Trade.id == trade_id, Trade.user_id == user_id)
@@ -116,6 +442,42 @@ async def get_trade(
     return TradeResponse.model_validate(trade)
 
 
+@router.put("/{trade_id}", response_model=TradeResponse)
+async def update_trade(
+    trade_id: int,
+    changes: TradeUpdate,
+    user_id: int = 1,
+    db: AsyncSession = Depends(get_db)
+):
+    """Edita um trade"""
+    query = select(Trade).where(Trade.id == trade_id, Trade.user_id == user_id)
+    result = await db.execute(query)
+    trade = result.scalar_one_or_none()
+    
+    if not trade:
+        raise HTTPException(status_code=404, detail="Trade não encontrado")
+    
+    before = {"symbol": trade.symbol, "open_time": trade.open_time, "source": trade.source}
+    for field, value in changes.model_dump(exclude_none=True).items():
+        setattr(trade, field, value)
+    if trade.external_id is None:
+        # A chave natural segue os campos que a compõem
+        trade.natural_key = natural_key({
+            "symbol": trade.symbol, "open_time": trade.open_time, "trade_type": trade.trade_type,
+            "volume": trade.volume, "entry_price": trade.entry_price, "profit": trade.profit,
+        })
+    await db.flush()
+    # Duplicatas revistas onde o trade estava e onde ficou (janelas separadas: podem estar longe)
+    after = {"symbol": trade.symbol, "open_time": trade.open_time, "source": trade.source}
+    await mark_duplicates(db, user_id, [before])
+    if after != before:
+        await mark_duplicates(db, user_id, [after])
+    await db.commit()
+    await db.refresh(trade)
+    
+    return TradeResponse.model_validate(trade)
+
+
 @router.delete("/{trade_id}")
 async def delete_trade(
     trade_id: int,
@@ -131,6 +493,9 @@ async def delete_trade(
         raise HTTPException(status_code=404, detail="Trade não encontrado")
     
     await db.delete(trade)
+    await db.flush()
+    # Duplicatas que apontavam para ele elegem outro canônico
+    await mark_duplicates(db, user_id, [{"symbol": trade.symbol, "open_time": trade.open_time, "source": trade.source}])
     await db.commit()
     
     return {"message": "Trade deletado com sucesso"}
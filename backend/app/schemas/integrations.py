@@ -18,11 +18,13 @@ class MT5ConnectionStatus(BaseModel):
 
 class TradingViewWebhook(BaseModel):
     symbol: str
-    type: str  # BUY or SELL
+    type: str  # BUY, SELL, CLOSE_LONG or CLOSE_SHORT
     price: float
     volume: Optional[float] = 1.0
     message: Optional[str] = None
     id: Optional[str] = None
+    strategy: Optional[str] = None  # Casa entradas e saídas do mesmo símbolo
+    position: Optional[str] = None  # {{strategy.market_position}}: "flat" = saída
 
 
 class SyncResult(BaseModel):
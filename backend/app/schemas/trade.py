@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 
@@ -27,9 +27,29 @@ class TradeCreate(TradeBase):
     pass
 
 
+class TradeUpdate(BaseModel):
+    """Edição parcial: só os campos enviados mudam"""
+    symbol: Optional[str] = None
+    trade_type: Optional[str] = None
+    volume: Optional[float] = None
+    entry_price: Optional[float] = None
+    exit_price: Optional[float] = None
+    stop_loss: Optional[float] = None
+    take_profit: Optional[float] = None
+    profit: Optional[float] = None
+    profit_pips: Optional[float] = None
+    commission: Optional[float] = None
+    swap: Optional[float] = None
+    open_time: Optional[datetime] = None
+    close_time: Optional[datetime] = None
+    duration_minutes: Optional[int] = None
+    notes: Optional[str] = None
+
+
 class TradeResponse(TradeBase):
     id: int
     user_id: int
+    duplicate_of: Optional[int] = None  # id do mesmo trade vindo de outra fonte
     created_at: datetime
     updated_at: datetime
     
@@ -44,3 +64,8 @@ class TradeListResponse(BaseModel):
     limit: int
 
 
+class CsvProfileUpdate(BaseModel):
+    mapping: Optional[Dict[str, str]] = None  # {campo: coluna}, ex: {"profit": "amount"}
+    date_format: Optional[str] = None  # ex: "%d/%m/%Y %H:%M"
+    close_date_format: Optional[str] = None
+    encoding: Optional[str] = None
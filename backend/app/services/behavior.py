@@ -0,0 +1,221 @@
+"""
+Behavioral pattern mining over a trader's history.
+
+Everything runs vectorized (NumPy) over arrays sorted by open_time, in a
+single linear pass per metric, so it stays interactive on multi-year
+histories:
+
+- time to next trade after a loss vs after a win (revenge trading)
+- volume escalation after losses (martingale / tilt)
+- days with abnormal trade counts vs the trader's own baseline (overtrading)
+- what happens after the daily loss limit is hit
+"""
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+QUICK_REENTRY_MINUTES = 5
+OUTLIER_Z_THRESHOLD = 3.5
+MAX_OUTLIER_DAYS = 10
+
+
+def _round(value: float, digits: int = 2) -> Optional[float]:
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def _stats(values: np.ndarray) -> Dict[str, Any]:
+    if not len(values):
+        return {"count": 0, "mean": None, "median": None}
+    return {"count": int(len(values)), "mean": _round(values.mean()), "median": _round(np.median(values))}
+
+
+class BehaviorAnalyzer:
+    """
+    Takes parallel arrays already sorted by open_time.
+
+    open_time/close_time are datetime64 (close_time may be NaT), profit and
+    volume are floats.
+    """
+
+    def __init__(self, open_time: np.ndarray, close_time: np.ndarray, profit: np.ndarray, volume: np.ndarray):
+        self.open_time = open_time.astype("datetime64[s]")
+        self.close_time = close_time.astype("datetime64[s]")
+        self.profit = profit.astype(float)
+        self.volume = volume.astype(float)
+        self.n = len(self.profit)
+
+        self.is_loss = self.profit < 0
+        self.is_win = self.profit > 0
+
+        # Índice do dia de cada trade (arrays ordenados => fronteiras por diff)
+        days = self.open_time.astype("datetime64[D]")
+        new_day = np.empty(self.n, dtype=bool)
+        if self.n:
+            new_day[0] = True
+            new_day[1:] = days[1:] != days[:-1]
+        self.day_index = np.cumsum(new_day) - 1
+        self.day_starts = np.flatnonzero(new_day)
+        self.days = days[self.day_starts]
+        self.same_day_as_next = ~new_day[1:] if self.n else new_day
+
+    @classmethod
+    def from_rows(cls, rows) -> "BehaviorAnalyzer":
+        """Builds from (open_time, close_time, profit, volume) rows ordered by open_time"""
+        rows = list(rows)
+        return cls(
+            np.array([r[0] for r in rows], dtype="datetime64[s]"),
+            np.array([r[1] if r[1] is not None else np.datetime64("NaT") for r in rows], dtype="datetime64[s]"),
+            np.fromiter((r[2] or 0.0 for r in rows), dtype=float, count=len(rows)),
+            np.fromiter((r[3] or 0.0 for r in rows), dtype=float, count=len(rows)),
+        )
+
+    def time_to_next_trade(self) -> Dict[str, Any]:
+        """Minutes between closing a trade and opening the next one, same day only"""
+        if self.n < 2:
+            return {"after_loss": _stats(np.array([])), "after_win": _stats(np.array([]))}
+
+        end = np.where(np.isnat(self.close_time), self.open_time, self.close_time)[:-1]
+        gaps = (self.open_time[1:] - end).astype(float) / 60.0
+        gaps = np.maximum(gaps, 0.0)
+        valid = self.same_day_as_next
+
+        after_loss = gaps[valid & self.is_loss[:-1]]
+        after_win = gaps[valid & self.is_win[:-1]]
+        loss_median = np.median(after_loss) if len(after_loss) else np.nan
+        win_median = np.median(after_win) if len(after_win) else np.nan
+
+        return {
+            "after_loss": {
+                **_stats(after_loss),
+                "quick_reentry_rate": _round((after_loss < QUICK_REENTRY_MINUTES).mean() * 100) if len(after_loss) else None,
+            },
+            "after_win": {
+                **_stats(after_win),
+                "quick_reentry_rate": _round((after_win < QUICK_REENTRY_MINUTES).mean() * 100) if len(after_win) else None,
+            },
+            # < 1 significa que o trader volta a operar mais rápido depois de perder
+            "loss_to_win_ratio": _round(loss_median / win_median) if win_median and not np.isnan(loss_median) else None,
+        }
+
+    def volume_escalation(self) -> Dict[str, Any]:
+        """Change in size on the next trade after a loss vs after a win"""
+        if self.n < 2:
+            return {"after_loss": None, "after_win": None}
+
+        prev_volume = self.volume[:-1]
+        ratio = np.divide(self.volume[1:], prev_volume, out=np.full(self.n - 1, np.nan), where=prev_volume > 0)
+        valid = self.same_day_as_next & (ratio > 0)
+
+        def summary(mask):
+            r = ratio[valid & mask]
+            if not len(r):
+                return None
+            # Razões são multiplicativas: a média aritmética é dominada por um 1→50
+            # isolado; média geométrica e mediana refletem a mão típica
+            return {
+                "count": int(len(r)),
+                "typical_size_ratio": _round(np.exp(np.log(r).mean())),
+                "median_size_ratio": _round(np.median(r)),
+                "escalation_rate": _round((r > 1).mean() * 100),
+            }
+
+        after_loss = summary(self.is_loss[:-1])
+        # Trades em que a mão aumentou logo após um loss
+        escalating = valid & self.is_loss[:-1] & (ratio > 1)
+        return {
+            "after_loss": after_loss,
+            "after_win": summary(self.is_win[:-1]),
+            "escalations_after_loss": int(escalating.sum()),
+            "loss_after_escalation": _round(self.profit[1:][escalating].sum()) if escalating.any() else 0.0,
+        }
+
+    def overtrading_days(self) -> Dict[str, Any]:
+        """Days whose trade count is a robust outlier (median/MAD z-score)"""
+        if not self.n:
+            return {"baseline_trades_per_day": 0, "outlier_days": []}
+
+        counts = np.bincount(self.day_index)
+        day_profit = np.bincount(self.day_index, weights=self.profit)
+        median = np.median(counts)
+        mad = np.median(np.abs(counts - median))
+        scale = 1.4826 * mad if mad else max(1.0, 0.25 * median)
+        z = (counts - median) / scale
+        outliers = np.flatnonzero(z > OUTLIER_Z_THRESHOLD)
+        normal = np.flatnonzero(z <= OUTLIER_Z_THRESHOLD)
+
+        top = outliers[np.argsort(-counts[outliers])][:MAX_OUTLIER_DAYS]
+        return {
+            "baseline_trades_per_day": _round(median, 1),
+            "threshold_trades_per_day": _round(median + OUTLIER_Z_THRESHOLD * scale, 1),
+            "outlier_day_count": int(len(outliers)),
+            "avg_profit_outlier_days": _round(day_profit[outliers].mean()) if len(outliers) else None,
+            "avg_profit_normal_days": _round(day_profit[normal].mean()) if len(normal) else None,
+            "outlier_days": [
+                {
+                    "date": str(self.days[i]),
+                    "trades": int(counts[i]),
+                    "profit": _round(day_profit[i]),
+                    "z_score": _round(z[i]),
+                }
+                for i in top
+            ],
+        }
+
+    def after_daily_loss_limit(self, daily_loss_limit: float) -> Dict[str, Any]:
+        """Trades opened after the day's running P&L already hit -daily_loss_limit"""
+        if not daily_loss_limit or daily_loss_limit <= 0:
+            return {"configured": False}
+
+        # P&L acumulado intradiário antes de cada trade (cumsum por grupo)
+        cumulative = np.cumsum(self.profit)
+        day_base = (cumulative - self.profit)[self.day_starts] if self.n else cumulative
+        intraday_before = cumulative - self.profit - day_base[self.day_index] if self.n else cumulative
+        after_limit = intraday_before <= -daily_loss_limit
+
+        hit_days = np.zeros(len(self.days), dtype=bool)
+        intraday_after = intraday_before + self.profit
+        np.logical_or.at(hit_days, self.day_index, intraday_after <= -daily_loss_limit)
+        continued_days = np.zeros(len(self.days), dtype=bool)
+        np.logical_or.at(continued_days, self.day_index, after_limit)
+
+        profits_after = self.profit[after_limit]
+        return {
+            "configured": True,
+            "daily_loss_limit": float(daily_loss_limit),
+            "days_limit_hit": int(hit_days.sum()),
+            "days_kept_trading": int(continued_days.sum()),
+            "trades_after_limit": int(after_limit.sum()),
+            "profit_after_limit": _round(profits_after.sum()) if len(profits_after) else 0.0,
+            "win_rate_after_limit": _round((profits_after > 0).mean() * 100) if len(profits_after) else None,
+            "win_rate_otherwise": _round(self.is_win[~after_limit].mean() * 100) if (~after_limit).any() else None,
+        }
+
+    def signals(self, report: Dict[str, Any]) -> List[str]:
+        """Short human-readable flags derived from the report"""
+        flags = []
+        timing = report["time_to_next_trade"]
+        if timing.get("loss_to_win_ratio") is not None and timing["loss_to_win_ratio"] < 0.5:
+            flags.append("revenge_trading")
+        after_loss = report["volume_escalation"].get("after_loss")
+        after_win = report["volume_escalation"].get("after_win")
+        # Mediana: um único trade fora do padrão não liga o sinal
+        if after_loss and after_win and after_loss["median_size_ratio"] > after_win["median_size_ratio"] * 1.2:
+            flags.append("size_escalation_after_losses")
+        if report["overtrading"].get("outlier_day_count"):
+            flags.append("overtrading_days")
+        if report["daily_loss_limit"].get("days_kept_trading"):
+            flags.append("ignores_daily_loss_limit")
+        return flags
+
+    def report(self, daily_loss_limit: float = 0) -> Dict[str, Any]:
+        result = {
+            "trades_analyzed": self.n,
+            "trading_days": int(len(self.days)),
+            "time_to_next_trade": self.time_to_next_trade(),
+            "volume_escalation": self.volume_escalation(),
+            "overtrading": self.overtrading_days(),
+            "daily_loss_limit": self.after_daily_loss_limit(daily_loss_limit),
+        }
+        result["signals"] = self.signals(result)
+        return result
@@ -0,0 +1,308 @@
+"""
+Multi-file and ZIP imports (e.g. a year of monthly statements at once).
+
+Uploaded files and ZIP members are read one at a time (members are
+extracted on demand, never the whole archive) and parsed in a process
+pool: pandas and the report readers are CPU bound, so threads would just
+take turns on the GIL. Parsed files are written in upload order through
+the shared bulk writer (insert_trades), each file in its own short
+transaction, while the pool keeps parsing the next ones; the write
+connection is never held while waiting for a parse. At most 2x workers
+files are in flight, which bounds memory for large archives.
+
+Supported files: generic CSV and Excel workbooks (using the saved layout
+for their header, see csv_profiles), TradingView Strategy Tester CSV, and MT5 history reports
+(XML/HTML). The result is a per-file report of rows, errors and timings.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+import zipfile
+
+from sqlalchemy import select
+
+from app.config import get_settings
+from app.models.csv_profile import CsvMappingProfile
+from app.models.uploaded_file import UploadedFile
+from app.services.csv_parser import header_signature
+from app.services.csv_profiles import profile_layout, save_detected, mark_used
+from app.services.trade_writer import insert_trades
+from app.services.upload_ledger import content_hash, record_upload, upload_to_dict
+from app.utils.metrics import metrics
+
+CSV, XLSX, TRADINGVIEW, MT5_REPORT = "csv", "xlsx", "tradingview", "mt5_report"
+
+SOURCES = {CSV: "CSV", XLSX: "CSV", TRADINGVIEW: "TRADINGVIEW", MT5_REPORT: "METATRADER"}
+
+# Colunas que só existem na lista de trades do Strategy Tester
+_TRADINGVIEW_HEADERS = {"trade_#", "signal"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def import_workers() -> int:
+    return get_settings().import_workers or os.cpu_count() or 1
+
+
+def get_import_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: processos limpos (sem herdar threads do servidor) e o mesmo
+        # comportamento no Windows, onde roda o terminal do MT5
+        _pool = ProcessPoolExecutor(import_workers(), mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_import_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def file_kind(filename: str, head: bytes) -> Optional[str]:
+    name = filename.lower()
+    if name.endswith(".csv"):
+        _, headers = header_signature(head)
+        return TRADINGVIEW if _TRADINGVIEW_HEADERS <= set(headers) else CSV
+    if name.endswith(".xlsx"):
+        return XLSX
+    if name.endswith((".xml", ".html", ".htm")):
+        return MT5_REPORT
+    return None
+
+
+def _stem(filename: str) -> str:
+    return os.path.basename(filename).rsplit(".", 1)[0]
+
+
+def parse_file(kind: str, filename: str, contents: bytes,
+               layouts: Dict[str, Dict[str, Any]], symbol: Optional[str]) -> Dict[str, Any]:
+    """
+    Runs in a pool process. Returns the trades (Trade column dicts) plus,
+    for CSV/Excel, the layout and header used, and the parse time.
+    `layouts` are the user's saved layouts by header hash.
+    """
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"layout": None, "stats": {}}
+
+    if kind == CSV:
+        from app.services.csv_parser import parse_csv
+        result["header_hash"], result["headers"] = header_signature(contents)
+        trades, result["layout"] = parse_csv(contents, layouts.get(result["header_hash"]))
+    elif kind == XLSX:
+        from app.services.xlsx_parser import read_xlsx_trades
+        result.update(read_xlsx_trades(contents, layouts))
+        trades = result.pop("trades")
+    elif kind == TRADINGVIEW:
+        from app.services.tradingview_service import TradingViewService
+        symbol = (symbol or _stem(filename)).split(":")[-1].strip().upper()
+        trades = TradingViewService().parse_strategy_report_csv(contents, symbol)
+    else:
+        from app.services.mt5_report import iter_report_trades
+        from app.services.sync_service import mt5_trade_to_row
+        trades = [
+            mt5_trade_to_row(trade)
+            for batch in iter_report_trades(io.BytesIO(contents), filename, result["stats"])
+            for trade in batch
+        ]
+
+    result["trades"] = trades
+    result["parse_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return result
+
+
+def iter_upload_members(uploads: List[Tuple[str, Any]], max_bytes: int) -> Iterator[Tuple[str, Callable[[], bytes]]]:
+    """
+    (name, reader) for every file to import; ZIP archives are expanded into
+    their members. Readers are called lazily, so only the files currently
+    being parsed are held in memory. Blocking (zip I/O): call from a thread.
+    """
+    for filename, stream in uploads:
+        if not filename.lower().endswith(".zip"):
+            yield filename, stream.read
+            continue
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile:
+            yield filename, _raiser(ValueError("ZIP inválido"))
+            continue
+        for info in archive.infolist():
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                continue
+            label = f"{filename}/{name}"
+            if info.file_size > max_bytes:
+                yield label, _raiser(ValueError(f"Arquivo maior que o limite de {max_bytes // (1024 * 1024)} MB"))
+            else:
+                yield label, (lambda archive=archive, info=info: archive.read(info))
+
+
+def _raiser(error: Exception) -> Callable[[], bytes]:
+    def read() -> bytes:
+        raise error
+    return read
+
+
+def _read_and_hash(read: Callable[[], bytes]) -> Tuple[bytes, str]:
+    contents = read()
+    return contents, content_hash(contents)
+
+
+async def _load_user_state(db, user_id: int) -> Tuple[Dict[str, CsvMappingProfile], Dict[str, UploadedFile]]:
+    """Saved layouts by header hash and upload ledger by content hash (refreshes expired instances)"""
+    result = await db.execute(
+        select(CsvMappingProfile).where(CsvMappingProfile.user_id == user_id)
+        .execution_options(populate_existing=True)
+    )
+    profiles = {p.header_hash: p for p in result.scalars()}
+    result = await db.execute(
+        select(UploadedFile).where(UploadedFile.user_id == user_id)
+        .execution_options(populate_existing=True)
+    )
+    ledger = {u.content_hash: u for u in result.scalars()}
+    return profiles, ledger
+
+
+async def import_files(db, user_id: int, uploads: List[Tuple[str, Any]], symbol: Optional[str] = None,
+                       force: bool = False) -> Dict[str, Any]:
+    """
+    Imports several files/ZIP archives for a user, committing each file
+    (trades, layout and ledger entry) as soon as it is written. `uploads`
+    is a list of (filename, binary file object). Files already in the
+    upload ledger are skipped unless `force`.
+    """
+    settings = get_settings()
+    loop = asyncio.get_running_loop()
+    pool = get_import_pool()
+    slots = asyncio.Semaphore(import_workers() * 2)
+    queue: asyncio.Queue = asyncio.Queue()
+
+    # Layouts salvos carregados antes: a sessão fica só com quem grava
+    profiles, ledger = await _load_user_state(db, user_id)
+    layouts = {header_hash: profile_layout(p) for header_hash, p in profiles.items()}
+    # O produtor só consulta esta cópia: os objetos do ORM ficam com o consumidor
+    ledger_view = {file_hash: upload_to_dict(u) for file_hash, u in ledger.items()}
+    # Só leituras até aqui: devolve a conexão de escrita enquanto os arquivos são lidos
+    await db.commit()
+    hashes_in_request = set()
+
+    members = iter_upload_members(uploads, settings.import_max_file_mb * 1024 * 1024)
+
+    async def produce():
+        try:
+            while True:
+                await slots.acquire()
+                item = await asyncio.to_thread(next, members, None)
+                if item is None:
+                    break
+                name, read = item
+                report = {"file": name, "kind": None, "rows": 0, "imported": 0, "skipped": 0, "errors": []}
+                try:
+                    contents, file_hash = await asyncio.to_thread(_read_and_hash, read)
+                    report["kind"] = kind = file_kind(name, contents[:4096])
+                    if kind is None:
+                        raise ValueError("Tipo de arquivo não suportado (use CSV, XLSX, XML, HTML ou ZIP)")
+                    # Arquivo idêntico já importado (ou repetido neste upload): nem é lido
+                    if file_hash in hashes_in_request or (file_hash in ledger_view and not force):
+                        report["already_imported"] = True
+                        if file_hash not in hashes_in_request:
+                            report["upload"] = ledger_view[file_hash]
+                        await queue.put((report, None, None, 0))
+                        continue
+                    hashes_in_request.add(file_hash)
+                    future = loop.run_in_executor(pool, parse_file, kind, name, contents, layouts, symbol)
+                    size = len(contents)
+                    del contents
+                    await queue.put((report, future, file_hash, size))
+                except Exception as e:
+                    report["errors"].append(str(e))
+                    await queue.put((report, None, None, 0))
+        finally:
+            await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    files: List[Dict[str, Any]] = []
+    started = time.perf_counter()
+
+    try:
+        while (item := await queue.get()) is not None:
+            report, future, file_hash, size = item
+            files.append(report)
+            if future is None:
+                slots.release()
+                continue
+            try:
+                parsed = await future
+            except Exception as e:
+                report["errors"].append(str(e))
+                slots.release()
+                continue
+            slots.release()
+
+            trades = parsed["trades"]
+            report["rows"] = len(trades)
+            report["parse_ms"] = parsed["parse_ms"]
+            if parsed["stats"]:
+                report["stats"] = parsed["stats"]
+
+            new_profile = None
+            write_started = time.perf_counter()
+            try:
+                if parsed["layout"] is not None:
+                    header_hash = parsed["header_hash"]
+                    profile = profiles.get(header_hash)
+                    if profile is None:
+                        profile = new_profile = save_detected(db, user_id, header_hash, parsed["headers"], parsed["layout"])
+                    mark_used(profile)
+
+                # Extratos que se sobrepõem (neste upload ou antes) são filtrados pela chave natural
+                imported, skipped = await insert_trades(db, user_id, trades, SOURCES[report["kind"]])
+                upload = record_upload(
+                    db, user_id, file_hash, os.path.basename(report["file"]), size, report["kind"],
+                    imported, skipped, ledger.get(file_hash)
+                )
+                # Transação curta por arquivo: o próximo parse não segura a conexão de escrita
+                await db.commit()
+            except Exception as e:
+                # Só este arquivo é perdido; os anteriores já estão gravados e os próximos seguem
+                await db.rollback()
+                metrics.inc("import.write_errors")
+                report["errors"].append(f"Erro ao gravar: {e}")
+                # O rollback expira os layouts e o ledger carregados: relê antes do próximo arquivo
+                reloaded_profiles, reloaded_ledger = await _load_user_state(db, user_id)
+                profiles.clear()
+                profiles.update(reloaded_profiles)
+                ledger.clear()
+                ledger.update(reloaded_ledger)
+                await db.commit()
+                continue
+
+            if new_profile is not None:
+                profiles[header_hash] = new_profile
+            ledger[file_hash] = upload
+            ledger_view[file_hash] = upload_to_dict(upload)
+            report["imported"] = imported
+            report["skipped"] = skipped
+            report["write_ms"] = round((time.perf_counter() - write_started) * 1000, 1)
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    elapsed = time.perf_counter() - started
+    metrics.inc("import.files", len(files))
+    metrics.observe("import.batch_seconds", elapsed)
+    return {
+        "files": files,
+        "trades_imported": sum(f["imported"] for f in files),
+        "trades_skipped": sum(f["skipped"] for f in files),
+        "failed_files": sum(1 for f in files if f["errors"]),
+        "already_imported_files": sum(1 for f in files if f.get("already_imported")),
+        "elapsed_ms": round(elapsed * 1000, 1),
+        "workers": import_workers(),
+    }
@@ -0,0 +1,231 @@
+"""
+Tools exposed to the chat model (OpenAI function calling).
+
+Instead of stuffing the trade history into the prompt, the model asks for
+exactly the aggregate it needs. Every tool runs a single indexed SQL
+aggregate over the user's trades and caps its result size.
+"""
+
+from datetime import datetime, date, time as dtime
+from typing import Any, Dict, List, Optional
+import json
+import time
+
+import numpy as np
+from sqlalchemy import select, func, case, and_, cast, Integer
+
+from app.models.trade import Trade
+from app.services.insight_rules import max_run
+from app.utils.metrics import metrics
+
+MAX_TOOL_ROWS = 20
+
+WEEKDAYS_PT = ["domingo", "segunda", "terça", "quarta", "quinta", "sexta", "sábado"]
+
+_FILTER_PROPERTIES = {
+    "symbol": {"type": "string", "description": "Ativo, ex: WDO, WINZ24. Prefixos também casam (WDO casa WDOZ24)."},
+    "weekday": {"type": "integer", "minimum": 0, "maximum": 6, "description": "Dia da semana (0=domingo ... 6=sábado)"},
+    "hour_from": {"type": "integer", "minimum": 0, "maximum": 23, "description": "Hora inicial de abertura (inclusive)"},
+    "hour_to": {"type": "integer", "minimum": 0, "maximum": 23, "description": "Hora final de abertura (inclusive)"},
+    "start_date": {"type": "string", "description": "Data inicial YYYY-MM-DD"},
+    "end_date": {"type": "string", "description": "Data final YYYY-MM-DD"},
+}
+
+TOOL_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "grouped_stats",
+            "description": "Estatísticas (trades, lucro, win rate, média) agrupadas por ativo, hora, dia da semana, mês ou direção, com filtros opcionais.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "group_by": {"type": "string", "enum": ["symbol", "hour", "weekday", "month", "trade_type"]},
+                    **_FILTER_PROPERTIES,
+                },
+                "required": ["group_by"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "date_range_stats",
+            "description": "Estatísticas totais (trades, lucro, win rate, profit factor, melhor/pior trade) para um período e filtros.",
+            "parameters": {"type": "object", "properties": dict(_FILTER_PROPERTIES)},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "streaks",
+            "description": "Maiores sequências de gains e losses e a sequência atual, com filtros opcionais.",
+            "parameters": {"type": "object", "properties": dict(_FILTER_PROPERTIES)},
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "worst_trades",
+            "description": "Lista os piores (ou melhores) trades individuais, com filtros opcionais.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "limit": {"type": "integer", "minimum": 1, "maximum": MAX_TOOL_ROWS},
+                    "best": {"type": "boolean", "description": "true para listar os melhores trades"},
+                    **_FILTER_PROPERTIES,
+                },
+            },
+        },
+    },
+]
+
+
+def _parse_date(value: Optional[str]) -> Optional[date]:
+    return datetime.strptime(value, "%Y-%m-%d").date() if value else None
+
+
+class ChatTools:
+    def __init__(self, db, user_id: int):
+        self.db = db
+        self.user_id = user_id
+
+    def _filters(self, args: Dict[str, Any]) -> list:
+        conditions = [Trade.user_id == self.user_id, Trade.duplicate_of.is_(None)]
+        if args.get("symbol"):
+            conditions.append(Trade.symbol.like(f"{str(args['symbol']).upper()}%"))
+        if args.get("weekday") is not None:
+            conditions.append(func.strftime("%w", Trade.open_time) == str(int(args["weekday"])))
+        if args.get("hour_from") is not None:
+            conditions.append(cast(func.strftime("%H", Trade.open_time), Integer) >= int(args["hour_from"]))
+        if args.get("hour_to") is not None:
+            conditions.append(cast(func.strftime("%H", Trade.open_time), Integer) <= int(args["hour_to"]))
+        start = _parse_date(args.get("start_date"))
+        if start:
+            conditions.append(Trade.open_time >= datetime.combine(start, dtime.min))
+        end = _parse_date(args.get("end_date"))
+        if end:
+            conditions.append(Trade.open_time <= datetime.combine(end, dtime.max))
+        return conditions
+
+    @staticmethod
+    def _aggregates():
+        return (
+            func.count(Trade.id),
+            func.coalesce(func.sum(Trade.profit), 0),
+            func.coalesce(func.sum(case((Trade.profit > 0, 1), else_=0)), 0),
+        )
+
+    @staticmethod
+    def _stats_row(count, profit, wins) -> Dict[str, Any]:
+        return {
+            "trades": int(count),
+            "profit": round(float(profit), 2),
+            "win_rate": round(wins / count * 100, 1) if count else 0.0,
+            "average_profit": round(float(profit) / count, 2) if count else 0.0,
+        }
+
+    async def grouped_stats(self, group_by: str = "symbol", **args) -> Dict[str, Any]:
+        keys = {
+            "symbol": Trade.symbol,
+            "hour": func.strftime("%H", Trade.open_time),
+            "weekday": func.strftime("%w", Trade.open_time),
+            "month": func.strftime("%Y-%m", Trade.open_time),
+            "trade_type": Trade.trade_type,
+        }
+        if group_by not in keys:
+            return {"error": f"group_by inválido: {group_by}"}
+
+        key = keys[group_by].label("key")
+        query = (
+            select(key, *self._aggregates())
+            .where(and_(*self._filters(args)))
+            .group_by(key)
+            .order_by(func.count(Trade.id).desc())
+            .limit(MAX_TOOL_ROWS + 1)
+        )
+        rows = (await self.db.execute(query)).all()
+
+        groups = []
+        for value, count, profit, wins in rows[:MAX_TOOL_ROWS]:
+            if group_by == "weekday":
+                value = WEEKDAYS_PT[int(value)]
+            elif group_by == "hour":
+                value = f"{value}:00"
+            groups.append({group_by: value, **self._stats_row(count, profit, wins)})
+        return {"group_by": group_by, "groups": groups, "truncated": len(rows) > MAX_TOOL_ROWS}
+
+    async def date_range_stats(self, **args) -> Dict[str, Any]:
+        gross_win = func.coalesce(func.sum(case((Trade.profit > 0, Trade.profit), else_=0)), 0)
+        gross_loss = func.coalesce(func.sum(case((Trade.profit < 0, Trade.profit), else_=0)), 0)
+        query = select(
+            *self._aggregates(), gross_win, gross_loss,
+            func.max(Trade.profit), func.min(Trade.profit),
+            func.min(Trade.open_time), func.max(Trade.open_time),
+        ).where(and_(*self._filters(args)))
+        count, profit, wins, won, lost, best, worst, first, last = (await self.db.execute(query)).one()
+
+        return {
+            **self._stats_row(count, profit, wins),
+            "profit_factor": round(won / abs(lost), 2) if lost else 0.0,
+            "best_trade": round(best or 0, 2),
+            "worst_trade": round(worst or 0, 2),
+            "first_trade": first.isoformat() if first else None,
+            "last_trade": last.isoformat() if last else None,
+        }
+
+    async def streaks(self, **args) -> Dict[str, Any]:
+        query = select(Trade.profit).where(and_(*self._filters(args))).order_by(Trade.open_time)
+        profits = np.fromiter((p or 0.0 for p in (await self.db.execute(query)).scalars()), dtype=float)
+        if not len(profits):
+            return {"trades": 0}
+
+        last_win = profits[-1] > 0
+        flips = np.flatnonzero((profits > 0) != last_win)
+        current = len(profits) - (flips[-1] + 1 if len(flips) else 0)
+        return {
+            "trades": int(len(profits)),
+            "max_win_streak": max_run(profits > 0),
+            "max_loss_streak": max_run(profits < 0),
+            "current_streak": int(current),
+            "current_streak_type": "gain" if last_win else "loss",
+        }
+
+    async def worst_trades(self, limit: int = 5, best: bool = False, **args) -> Dict[str, Any]:
+        limit = max(1, min(int(limit), MAX_TOOL_ROWS))
+        order = Trade.profit.desc() if best else Trade.profit.asc()
+        query = (
+            select(Trade.symbol, Trade.trade_type, Trade.volume, Trade.profit, Trade.open_time, Trade.duration_minutes)
+            .where(and_(*self._filters(args)))
+            .order_by(order)
+            .limit(limit)
+        )
+        rows = (await self.db.execute(query)).all()
+        return {
+            "trades": [
+                {
+                    "symbol": r.symbol,
+                    "type": r.trade_type,
+                    "volume": r.volume,
+                    "profit": round(r.profit or 0, 2),
+                    "open_time": r.open_time.isoformat(),
+                    "duration_minutes": r.duration_minutes,
+                }
+                for r in rows
+            ]
+        }
+
+    async def call(self, name: str, arguments: str) -> Dict[str, Any]:
+        """Executes a tool call from the model, recording its latency"""
+        handler = getattr(self, name, None) if name in {d["function"]["name"] for d in TOOL_DEFINITIONS} else None
+        if handler is None:
+            return {"error": f"Ferramenta desconhecida: {name}"}
+
+        started = time.perf_counter()
+        try:
+            args = json.loads(arguments or "{}")
+            return await handler(**args)
+        except Exception as e:
+            return {"error": str(e)}
+        finally:
+            metrics.observe(f"ai.chat.tools.{name}_seconds", time.perf_counter() - started)
@@ -1,161 +1,283 @@
 import pandas as pd
+import csv
+import hashlib
 import io
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
+ENCODINGS = ['utf-8', 'latin-1', 'cp1252']
 
-def parse_csv_trades(contents: bytes) -> List[Dict[str, Any]]:
+DATE_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%d/%m/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y',
+]
+
+# Amostra usada para descobrir o formato de data
+DATE_SAMPLE_SIZE = 200
+
+# Column mappings for different platforms
+COLUMN_MAPPINGS = {
+    # Standard format
+    'symbol': ['symbol', 'ativo', 'ticker', 'instrumento', 'asset'],
+    'type': ['type', 'tipo', 'side', 'direction', 'order_type', 'trade_type', 'lado'],
+    'volume': ['volume', 'lots', 'lotes', 'quantity', 'qty', 'quantidade'],
+    'entry_price': ['entry_price', 'preco_entrada', 'open_price', 'price_open', 'entry', 'preco'],
+    'exit_price': ['exit_price', 'preco_saida', 'close_price', 'price_close', 'exit'],
+    'profit': ['profit', 'lucro', 'resultado', 'pnl', 'result', 'gain_loss', 'pl', 'res._operação', 'res._operacao'],
+    'date': ['date', 'data', 'open_date', 'trade_date', 'datetime', 'abertura'],
+    'time': ['time', 'hora', 'open_time', 'trade_time'],
+    'close_date': ['close_date', 'data_fechamento', 'exit_date', 'fechamento'],
+    'close_time': ['close_time', 'hora_fechamento', 'exit_time'],
+    'duration': ['duration', 'duracao', 'duration_minutes', 'holding_time'],
+    'commission': ['commission', 'comissao', 'fee', 'taxa'],
+    'swap': ['swap', 'financing', 'overnight'],
+}
+
+REQUIRED_FIELDS = ['symbol', 'profit']
+
+
+def normalize_columns(columns) -> List[str]:
+    return [str(c).lower().strip().replace(' ', '_') for c in columns]
+
+
+def header_signature(contents: bytes) -> Tuple[str, List[str]]:
     """
-    Parse CSV file with trade data.
-    Supports multiple formats and tries to auto-detect columns.
+    Hash of the normalized header row, read from the first line only.
+    Same broker export layout -> same signature, whatever the data.
+    """
+    first_line = contents.split(b'\n', 1)[0].rstrip(b'\r')
+    try:
+        text = first_line.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        text = first_line.decode('latin-1')
+    headers = normalize_columns(next(csv.reader([text]), []))
+    return headers_signature(headers), headers
+
+
+def headers_signature(headers: List[str]) -> str:
+    """Hash of already normalized column names (CSV header or sheet header row)"""
+    return hashlib.sha1('\x1f'.join(headers).encode()).hexdigest()
+
+
+def read_csv_frame(contents: bytes, encoding: Optional[str] = None, nrows: Optional[int] = None) -> Tuple[pd.DataFrame, str]:
     """
-    
-    # Try different encodings
-    for encoding in ['utf-8', 'latin-1', 'cp1252']:
+    Reads the CSV (trying encodings unless one is known); returns (df, encoding).
+    With `nrows` only the start of the file is read (previews).
+    """
+    for candidate in ([encoding] if encoding else ENCODINGS):
         try:
-            df = pd.read_csv(io.BytesIO(contents), encoding=encoding)
+            df = pd.read_csv(io.BytesIO(contents), encoding=candidate, nrows=nrows)
             break
         except:
             continue
     else:
         raise ValueError("Não foi possível ler o arquivo CSV")
-    
+
     # Normalize column names
-    df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
-    
-    # Column mappings for different platforms
-    column_mappings = {
-        # Standard format
-        'symbol': ['symbol', 'ativo', 'ticker', 'instrumento', 'asset'],
-        'type': ['type', 'tipo', 'side', 'direction', 'order_type', 'trade_type'],
-        'volume': ['volume', 'lots', 'lotes', 'quantity', 'qty', 'quantidade'],
-        'entry_price': ['entry_price', 'preco_entrada', 'open_price', 'price_open', 'entry', 'preco'],
-        'exit_price': ['exit_price', 'preco_saida', 'close_price', 'price_close', 'exit'],
-        'profit': ['profit', 'lucro', 'resultado', 'pnl', 'result', 'gain_loss', 'pl'],
-        'date': ['date', 'data', 'open_date', 'trade_date', 'datetime'],
-        'time': ['time', 'hora', 'open_time', 'trade_time'],
-        'close_date': ['close_date', 'data_fechamento', 'exit_date'],
-        'close_time': ['close_time', 'hora_fechamento', 'exit_time'],
-        'duration': ['duration', 'duracao', 'duration_minutes', 'holding_time'],
-        'commission': ['commission', 'comissao', 'fee', 'taxa'],
-        'swap': ['swap', 'financing', 'overnight'],
-    }
-    
-    # Find matching columns
+    df.columns = normalize_columns(df.columns)
+    # Índice = linha no arquivo (cabeçalho é a linha 1), usado nos erros por linha
+    df.index = pd.RangeIndex(2, len(df) + 2)
+    return df, candidate
+
+
+def _combined_dates(df: pd.DataFrame, date_col: str, time_col: Optional[str]) -> pd.Series:
+    dates = df[date_col].astype(str).str.strip()
+    if time_col:
+        times = df[time_col]
+        dates = dates.where(times.isna(), dates + ' ' + times.astype(str).str.strip())
+    return dates.where(df[date_col].notna())
+
+
+def detect_date_format(values: pd.Series) -> Optional[str]:
+    """Format (from DATE_FORMATS) that parses most of a sample; earlier formats win ties"""
+    sample = values.dropna().head(DATE_SAMPLE_SIZE)
+    if sample.empty:
+        return None
+    best, best_count = None, 0
+    for fmt in DATE_FORMATS:
+        count = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if count > best_count:
+            best, best_count = fmt, count
+        if count == len(sample):
+            break
+    return best
+
+
+def detect_layout(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Column mapping and date formats for a file with unknown layout.
+    `guessed` lists fields filled by heuristics rather than by column name.
+    """
     def find_column(target_names):
         for name in target_names:
             if name in df.columns:
                 return name
         return None
-    
+
     mapped = {}
-    for key, alternatives in column_mappings.items():
+    for key, alternatives in COLUMN_MAPPINGS.items():
         col = find_column(alternatives)
         if col:
             mapped[key] = col
-    
-    # Validate required columns
-    required = ['symbol', 'profit']
-    for req in required:
+
+    guessed = []
+    if 'profit' not in mapped:
+        # Primeira coluna numérica ainda não usada por outro campo
+        used = set(mapped.values())
+        for col in df.columns:
+            if col not in used and df[col].dtype in ['float64', 'int64']:
+                mapped['profit'] = col
+                guessed.append('profit')
+                break
+
+    for req in REQUIRED_FIELDS:
         if req not in mapped:
-            # Try to find profit in any column with numbers
-            if req == 'profit':
-                for col in df.columns:
-                    if df[col].dtype in ['float64', 'int64']:
-                        mapped['profit'] = col
-                        break
-            if req not in mapped:
-                raise ValueError(f"Coluna obrigatória não encontrada: {req}")
-    
-    trades = []
-    
-    for idx, row in df.iterrows():
-        try:
-            # Parse datetime
-            open_time = datetime.now()
-            
-            if 'date' in mapped:
-                date_val = row[mapped['date']]
-                time_val = row.get(mapped.get('time', ''), '00:00:00')
-                
-                if pd.notna(date_val):
-                    # Try different date formats
-                    date_formats = [
-                        '%Y-%m-%d %H:%M:%S',
-                        '%Y-%m-%d %H:%M',
-                        '%Y-%m-%d',
-                        '%d/%m/%Y %H:%M:%S',
-                        '%d/%m/%Y %H:%M',
-                        '%d/%m/%Y',
-                        '%m/%d/%Y %H:%M:%S',
-                        '%m/%d/%Y',
-                    ]
-                    
-                    date_str = str(date_val)
-                    if pd.notna(time_val) and 'time' in mapped:
-                        date_str = f"{date_val} {time_val}"
-                    
-                    for fmt in date_formats:
-                        try:
-                            open_time = datetime.strptime(date_str.strip(), fmt)
-                            break
-                        except:
-                            continue
-            
-            # Parse close time
-            close_time = None
-            if 'close_date' in mapped:
-                close_date_val = row[mapped['close_date']]
-                if pd.notna(close_date_val):
-                    close_time_val = row.get(mapped.get('close_time', ''), '00:00:00')
-                    close_str = f"{close_date_val} {close_time_val}" if pd.notna(close_time_val) else str(close_date_val)
-                    
-                    for fmt in date_formats:
-                        try:
-                            close_time = datetime.strptime(close_str.strip(), fmt)
-                            break
-                        except:
-                            continue
-            
-            # Calculate duration
-            duration = 0
-            if 'duration' in mapped and pd.notna(row[mapped['duration']]):
-                duration = int(row[mapped['duration']])
-            elif close_time and open_time:
-                duration = int((close_time - open_time).total_seconds() / 60)
-            
-            # Parse trade type
-            trade_type = "BUY"
-            if 'type' in mapped:
-                type_val = str(row[mapped['type']]).upper()
-                if any(x in type_val for x in ['SELL', 'VENDA', 'SHORT', 'S']):
-                    trade_type = "SELL"
-            
-            trade = {
-                'symbol': str(row[mapped['symbol']]).strip().upper(),
-                'trade_type': trade_type,
-                'volume': float(row.get(mapped.get('volume', ''), 1) or 1),
-                'entry_price': float(row.get(mapped.get('entry_price', ''), 0) or 0),
-                'exit_price': float(row.get(mapped.get('exit_price', ''), 0) or 0) if 'exit_price' in mapped and pd.notna(row.get(mapped.get('exit_price', ''))) else None,
-                'profit': float(row[mapped['profit']] or 0),
-                'commission': float(row.get(mapped.get('commission', ''), 0) or 0),
-                'swap': float(row.get(mapped.get('swap', ''), 0) or 0),
-                'open_time': open_time,
-                'close_time': close_time,
-                'duration_minutes': duration,
-                'source': 'CSV'
-            }
-            
-            trades.append(trade)
-            
-        except Exception as e:
-            # Skip problematic rows but continue
-            print(f"Erro na linha {idx}: {e}")
-            continue
-    
+            raise ValueError(f"Coluna obrigatória não encontrada: {req}")
+
+    date_format = close_date_format = None
+    if 'date' in mapped:
+        date_format = detect_date_format(_combined_dates(df, mapped['date'], mapped.get('time')))
+    if 'close_date' in mapped:
+        close_date_format = detect_date_format(_combined_dates(df, mapped['close_date'], mapped.get('close_time')))
+
+    return {
+        'mapping': mapped,
+        'guessed': guessed,
+        'date_format': date_format,
+        'close_date_format': close_date_format,
+    }
+
+
+def parse_frame(df: pd.DataFrame, layout: Dict[str, Any],
+                issues: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Column-wise parse of a frame with a known layout (no per-row loop).
+
+    If `issues` is given, per-row problems are appended to it (row = frame
+    index): level "error" for rejected rows, "warning" for rows imported
+    with a default in place of a bad value. Same pass, no extra parsing.
+    """
+    mapped = layout['mapping']
+    missing = [col for col in mapped.values() if col not in df.columns]
+    if missing:
+        raise ValueError(f"Colunas do mapeamento não encontradas no arquivo: {', '.join(missing)}")
+
+    def report(mask, level, field, reason):
+        if issues is None or not mask.any():
+            return
+        column = mapped[field]
+        for row, value in df.loc[mask, column].items():
+            issues.append({
+                'row': int(row),
+                'level': level,
+                'field': field,
+                'column': column,
+                'value': None if pd.isna(value) else str(value),
+                'reason': reason,
+            })
+
+    def numeric(key, default):
+        if key not in mapped:
+            return pd.Series(default, index=df.index, dtype='float64')
+        raw = df[mapped[key]]
+        values = pd.to_numeric(raw, errors='coerce')
+        report(values.isna() & raw.notna(), 'warning', key, 'Valor não numérico; usado o padrão')
+        return values
+
+    def dates(key, time_key, format_key, reason):
+        if key not in mapped:
+            return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+        text = _combined_dates(df, mapped[key], mapped.get(time_key))
+        if layout.get(format_key):
+            parsed = pd.to_datetime(text, format=layout[format_key], errors='coerce')
+        else:
+            parsed = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+        report(parsed.isna() & text.notna(), 'warning', key, reason)
+        return parsed
+
+    # Linhas com resultado não numérico são ignoradas (como antes), assim
+    # como linhas sem ativo (totais no fim de relatórios)
+    raw_profit = df[mapped['profit']]
+    profit = pd.to_numeric(raw_profit, errors='coerce')
+    has_symbol = df[mapped['symbol']].notna()
+    bad_profit = profit.isna() & raw_profit.notna()
+    report(~has_symbol, 'error', 'symbol', 'Ativo vazio')
+    report(bad_profit & has_symbol, 'error', 'profit', 'Resultado não numérico')
+    valid = has_symbol & ~bad_profit
+    df, profit = df[valid], profit[valid].fillna(0.0)
+
+    now = datetime.now()
+    open_time = dates('date', 'time', 'date_format', 'Data não reconhecida; usado o horário do upload')
+    close_time = dates('close_date', 'close_time', 'close_date_format',
+                       'Data de fechamento não reconhecida; trade fica sem fechamento')
+
+    # Calculate duration
+    duration = ((close_time - open_time.fillna(now)).dt.total_seconds() // 60).fillna(0)
+    if 'duration' in mapped:
+        given = numeric('duration', 0.0)
+        duration = given.where(given.notna(), duration)
+
+    # Parse trade type (Profit usa C/V na coluna Lado)
+    if 'type' in mapped:
+        is_sell = df[mapped['type']].astype(str).str.upper().str.contains('SELL|VENDA|SHORT|S|^V$', regex=True)
+        trade_type = is_sell.map({True: 'SELL', False: 'BUY'})
+    else:
+        trade_type = pd.Series('BUY', index=df.index)
+
+    volume = numeric('volume', 1.0).fillna(1.0)
+    exit_price = numeric('exit_price', float('nan'))
+
+    columns = {
+        'symbol': df[mapped['symbol']].astype(str).str.strip().str.upper().tolist(),
+        'trade_type': trade_type.tolist(),
+        'volume': volume.where(volume != 0, 1.0).tolist(),
+        'entry_price': numeric('entry_price', 0.0).fillna(0.0).tolist(),
+        'exit_price': exit_price.astype(object).where(exit_price.notna(), None).tolist(),
+        'profit': profit.tolist(),
+        'commission': numeric('commission', 0.0).fillna(0.0).tolist(),
+        'swap': numeric('swap', 0.0).fillna(0.0).tolist(),
+        # Sem data reconhecida: horário do upload (como antes)
+        'open_time': [t or now for t in open_time.to_numpy().astype('datetime64[us]').tolist()],
+        'close_time': close_time.to_numpy().astype('datetime64[us]').tolist(),
+        'duration_minutes': duration.astype(int).tolist(),
+    }
+    if issues is not None:
+        issues.sort(key=lambda issue: issue['row'])
+    keys = list(columns)
+    return [dict(zip(keys, values), source='CSV') for values in zip(*columns.values())]
+
+
+def parse_csv(contents: bytes, layout: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Parses a CSV export. With a known `layout` (mapping, date formats and
+    encoding saved for this header signature) detection and format trials
+    are skipped. Returns (trades, layout used).
+    """
+    if layout is not None:
+        df, encoding = read_csv_frame(contents, layout.get('encoding'))
+        layout = {**layout, 'encoding': encoding}
+    else:
+        df, encoding = read_csv_frame(contents)
+        layout = {**detect_layout(df), 'encoding': encoding}
+
+    trades = parse_frame(df, layout)
     if not trades:
         raise ValueError("Nenhum trade válido encontrado no arquivo")
-    
+    return trades, layout
+
+
+def parse_csv_trades(contents: bytes) -> List[Dict[str, Any]]:
+    """
+    Parse CSV file with trade data.
+    Supports multiple formats and tries to auto-detect columns.
+    """
+    trades, _ = parse_csv(contents)
     return trades
 
 
@@ -168,5 +290,3 @@ def generate_sample_csv() -> str:
 2024-01-15,14:30:00,WINZ24,BUY,2,128800,128950,300.00,15
 2024-01-15,15:45:00,PETR4,BUY,100,35.50,35.80,30.00,45
 """
-
-
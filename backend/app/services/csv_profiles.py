@@ -0,0 +1,107 @@
+"""
+Saved CSV layouts per (user, header signature).
+
+The first upload of a layout runs column/date-format/encoding detection
+and stores the result; later uploads with the same header go straight to
+the column-wise parse. Users can confirm or correct a stored layout (e.g.
+a profit column that detection had to guess).
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import codecs
+import json
+
+from sqlalchemy import select
+
+from app.models.csv_profile import CsvMappingProfile
+from app.services.csv_parser import COLUMN_MAPPINGS, REQUIRED_FIELDS
+
+
+async def get_profile(db, user_id: int, header_hash: str) -> Optional[CsvMappingProfile]:
+    result = await db.execute(
+        select(CsvMappingProfile).where(
+            CsvMappingProfile.user_id == user_id,
+            CsvMappingProfile.header_hash == header_hash
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+def profile_layout(profile: CsvMappingProfile) -> Dict[str, Any]:
+    return {
+        "mapping": json.loads(profile.mapping),
+        "guessed": json.loads(profile.guessed or "[]"),
+        "date_format": profile.date_format,
+        "close_date_format": profile.close_date_format,
+        "encoding": profile.encoding,
+    }
+
+
+def save_detected(db, user_id: int, header_hash: str, headers: List[str], layout: Dict[str, Any]) -> CsvMappingProfile:
+    profile = CsvMappingProfile(
+        user_id=user_id,
+        header_hash=header_hash,
+        headers=json.dumps(headers),
+        mapping=json.dumps(layout["mapping"]),
+        guessed=json.dumps(layout.get("guessed", [])),
+        date_format=layout.get("date_format"),
+        close_date_format=layout.get("close_date_format"),
+        encoding=layout.get("encoding"),
+        confirmed=False,
+        use_count=0,
+    )
+    db.add(profile)
+    return profile
+
+
+def mark_used(profile: CsvMappingProfile):
+    profile.use_count = (profile.use_count or 0) + 1
+    profile.last_used_at = datetime.utcnow()
+
+
+def apply_override(profile: CsvMappingProfile, changes: Dict[str, Any]):
+    """Validates and applies a user correction; the profile becomes confirmed"""
+    headers = json.loads(profile.headers)
+    mapping = changes.get("mapping")
+    if mapping is not None:
+        unknown = [field for field in mapping if field not in COLUMN_MAPPINGS]
+        if unknown:
+            raise ValueError(f"Campos desconhecidos: {', '.join(unknown)}")
+        absent = [col for col in mapping.values() if col not in headers]
+        if absent:
+            raise ValueError(f"Colunas inexistentes no arquivo: {', '.join(absent)}")
+        missing = [field for field in REQUIRED_FIELDS if field not in mapping]
+        if missing:
+            raise ValueError(f"Campos obrigatórios não mapeados: {', '.join(missing)}")
+        profile.mapping = json.dumps(mapping)
+
+    for field in ("date_format", "close_date_format"):
+        value = changes.get(field)
+        if value is not None:
+            if "%" not in value:
+                raise ValueError(f"Formato de data inválido: {value}")
+            setattr(profile, field, value)
+
+    encoding = changes.get("encoding")
+    if encoding is not None:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            raise ValueError(f"Encoding desconhecido: {encoding}")
+        profile.encoding = encoding
+
+    profile.guessed = "[]"
+    profile.confirmed = True
+
+
+def profile_to_dict(profile: CsvMappingProfile) -> Dict[str, Any]:
+    return {
+        "id": profile.id,
+        "header_hash": profile.header_hash,
+        "headers": json.loads(profile.headers),
+        **profile_layout(profile),
+        "confirmed": profile.confirmed,
+        "use_count": profile.use_count,
+        "last_used_at": profile.last_used_at,
+    }
@@ -0,0 +1,41 @@
+"""
+One-time data migrations run at startup.
+
+Schema changes are handled by create_tables (new tables, columns and
+indexes); this covers the data that has to be rewritten once when a
+feature lands, like filling natural keys of old trades. Each migration is
+recorded in `data_migrations` when it commits, so later starts only do one
+small query instead of rescanning the tables.
+"""
+
+from typing import Awaitable, Callable, List, Tuple
+
+from sqlalchemy import select
+
+from app.models.data_migration import DataMigration
+from app.services.sync_scheduler import encrypt_legacy_tokens
+from app.services.trade_writer import backfill_natural_keys
+
+# Em ordem de aplicação; um nome nunca muda depois de publicado
+MIGRATIONS: List[Tuple[str, Callable[..., Awaitable[int]]]] = [
+    # Chave natural dos trades importados antes dela existir
+    ("trades_natural_key", backfill_natural_keys),
+    # Tokens MetaAPI salvos em texto puro antes da criptografia
+    ("metaapi_tokens_encrypted", encrypt_legacy_tokens),
+]
+
+
+async def run_data_migrations(db) -> List[str]:
+    """Applies the migrations not recorded yet, each in its own transaction. Returns their names."""
+    result = await db.execute(select(DataMigration.name))
+    done = set(result.scalars().all())
+    applied = []
+    for name, migrate in MIGRATIONS:
+        if name in done:
+            continue
+        changed = await migrate(db)
+        db.add(DataMigration(name=name))
+        await db.commit()
+        print(f"Data migration {name}: {changed} rows")
+        applied.append(name)
+    return applied
@@ -0,0 +1,90 @@
+"""
+Periodic SQLite planner maintenance.
+
+The query planner picks indexes from the statistics in `sqlite_stat1`,
+which only ANALYZE writes. Without them, a table that grew from a few rows
+to millions keeps the plans chosen when it was small. On startup (when the
+stats table does not exist yet) a full ANALYZE runs once, and then every
+SQLITE_OPTIMIZE_INTERVAL_MINUTES `PRAGMA optimize` refreshes only the
+tables whose stats are stale. `analysis_limit` bounds the rows sampled per
+index, so a run takes milliseconds even on large files.
+
+Runs on the write connection (ANALYZE writes to the file) and is started by
+the app lifespan only for SQLite databases.
+"""
+
+from typing import Any, Dict, Optional
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from app.config import get_settings
+from app.database import engine
+from app.utils.metrics import metrics
+
+ANALYSIS_LIMIT = 1000
+
+
+class DatabaseMaintenance:
+    def __init__(self, interval_minutes: float = None):
+        self.interval = (interval_minutes or get_settings().sqlite_optimize_interval_minutes) * 60
+        self.last_run: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self._task:
+            return
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def optimize(self) -> float:
+        """Refreshes planner statistics; returns elapsed seconds"""
+        started = time.perf_counter()
+        async with engine.begin() as conn:
+            await conn.execute(text(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}"))
+            has_stats = (await conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            )).first()
+            if has_stats is None:
+                await conn.execute(text("ANALYZE"))
+            await conn.execute(text("PRAGMA optimize"))
+        elapsed = time.perf_counter() - started
+        self.last_run = time.time()
+        metrics.inc("db.optimize.runs")
+        metrics.observe("db.optimize_seconds", elapsed)
+        return elapsed
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.optimize()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc("db.optimize.failed")
+                print(f"Database maintenance failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "interval_minutes": self.interval / 60,
+            "last_run_seconds_ago": round(time.time() - self.last_run, 1) if self.last_run else None,
+            "runs": metrics.counter("db.optimize.runs"),
+        }
+
+
+_maintenance: Optional[DatabaseMaintenance] = None
+
+
+def get_db_maintenance() -> DatabaseMaintenance:
+    global _maintenance
+    if _maintenance is None:
+        _maintenance = DatabaseMaintenance()
+    return _maintenance
@@ -0,0 +1,343 @@
+"""
+Cross-source duplicate detection.
+
+One execution can reach the database through several sources: the MetaAPI
+sync, the broker's CSV statement, the MT5 report and the TradingView alert
+that triggered it. Per-source dedupe (trade_writer) cannot link them, so
+totals are inflated.
+
+Trades of a user are streamed per symbol in open_time order and indexed in
+buckets of `time tolerance` seconds. A trade is only compared with the
+trades in its own and the previous bucket (same side, other source, price
+and volume within tolerance), so matching is linear in the number of
+trades, never pairwise. Matches form a cluster with at most one trade per
+source; the trade from the most authoritative source (SOURCE_PRIORITY) is
+canonical and the others get `duplicate_of` pointing at it. Nothing is
+deleted: analytics just skip trades with `duplicate_of` set.
+
+`mark_duplicates` runs at ingest time over the time window of the written
+batch; `rebuild_duplicates` recomputes the whole history (keyset pages, one
+pass per user and symbol).
+
+Time zones: sources store open_time in different clocks. MetaAPI rows are
+UTC; MT5 (terminal and reports) and broker CSVs are usually in the
+broker's server time; TradingView alerts use the server's local time.
+DUPLICATE_SOURCE_UTC_OFFSET_HOURS gives each source's offset from UTC
+(e.g. {"CSV": 3, "METATRADER": 3}), and times are compared in UTC. With
+offsets configured, each source is scanned in its own open_time order
+and the streams are merged by UTC time. An offset is fixed per source.
+It does not follow daylight saving changes or differ per broker account,
+so trades near a DST switch, or from accounts on other servers, may not
+match.
+"""
+
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+import heapq
+
+from sqlalchemy import select, update, func, bindparam, tuple_, distinct
+
+from app.config import get_settings
+from app.models.trade import Trade
+
+# Registro da corretora > extrato > sinal
+SOURCE_PRIORITY = {"METAAPI": 4, "METATRADER": 3, "CSV": 2, "TRADINGVIEW": 1}
+
+PAGE_SIZE = 20000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def source_offsets() -> Dict[str, float]:
+    """Seconds each source's stored times are ahead of UTC (DUPLICATE_SOURCE_UTC_OFFSET_HOURS)"""
+    hours = get_settings().duplicate_source_utc_offset_hours
+    return {source: offset * 3600 for source, offset in hours.items() if offset}
+
+_COLUMNS = (
+    Trade.id, Trade.symbol, Trade.trade_type, Trade.volume,
+    Trade.entry_price, Trade.open_time, Trade.source, Trade.duplicate_of,
+)
+
+_set_duplicate = (
+    update(Trade.__table__)
+    .where(Trade.__table__.c.id == bindparam("b_id"))
+    .values(duplicate_of=bindparam("b_duplicate_of"), updated_at=bindparam("b_updated_at"))
+)
+
+
+class _Cluster:
+    __slots__ = ("members", "canonical", "last_ts")
+
+    def __init__(self, row, ts: float):
+        self.members = {row.source: row}
+        self.canonical = row
+        self.last_ts = ts
+
+
+class DuplicateMatcher:
+    """
+    Streaming matcher. Feed the trades of one user sorted by
+    (symbol, open_time, id); `changes` collects {trade id: new duplicate_of}
+    for the rows whose current value is wrong. Only clusters that no later
+    trade can join are resolved, so memory holds one tolerance window.
+    """
+
+    def __init__(self, time_seconds: float, price_pct: float, volume_pct: float,
+                 scope: Optional[Tuple[datetime, datetime]] = None,
+                 offsets: Optional[Dict[str, float]] = None):
+        self.tolerance = time_seconds
+        self.width = max(time_seconds, 1.0)
+        self.price = price_pct / 100
+        self.volume = volume_pct / 100
+        # Só grava linhas dentro do intervalo (em UTC; as bordas da janela podem casar com trades fora dela)
+        self.scope = scope
+        self.offsets = offsets or {}
+        self.changes: Dict[int, Optional[int]] = {}
+        self.changed = 0
+        self.duplicates = 0
+        self._symbol = None
+        self._buckets: Dict[int, List[Tuple[Any, float, _Cluster]]] = {}
+        self._bucket_order: deque = deque()
+        self._open: deque = deque()
+
+    @classmethod
+    def from_settings(cls, scope: Optional[Tuple[datetime, datetime]] = None) -> "DuplicateMatcher":
+        settings = get_settings()
+        return cls(
+            settings.duplicate_time_tolerance_seconds,
+            settings.duplicate_price_tolerance_pct,
+            settings.duplicate_volume_tolerance_pct,
+            scope,
+            source_offsets(),
+        )
+
+    def utc_seconds(self, row) -> float:
+        """open_time as UTC epoch seconds (each source stores its own clock)"""
+        return (row.open_time - _EPOCH).total_seconds() - self.offsets.get(row.source, 0.0)
+
+    def _close_enough(self, a: float, b: float, tolerance: float) -> bool:
+        # Preço/volume ausente (extrato sem a coluna) não impede o casamento
+        if not a or not b:
+            return True
+        return abs(a - b) <= tolerance * max(abs(a), abs(b))
+
+    def add(self, row):
+        if row.symbol != self._symbol:
+            self.flush()
+            self._symbol = row.symbol
+
+        ts = self.utc_seconds(row)
+        bucket = int(ts // self.width)
+
+        while self._open and self._open[0].last_ts < ts - self.tolerance:
+            self._resolve(self._open.popleft())
+        while self._bucket_order and self._bucket_order[0] < bucket - 1:
+            del self._buckets[self._bucket_order.popleft()]
+
+        best = None
+        for number in (bucket - 1, bucket):
+            for other, other_ts, cluster in self._buckets.get(number, ()):
+                gap = ts - other_ts
+                if (
+                    gap > self.tolerance
+                    or row.source in cluster.members
+                    or other.trade_type != row.trade_type
+                    or not self._close_enough(row.entry_price, other.entry_price, self.price)
+                    or not self._close_enough(row.volume, other.volume, self.volume)
+                ):
+                    continue
+                if best is None or gap < best[0]:
+                    best = (gap, cluster)
+
+        if best is None:
+            cluster = _Cluster(row, ts)
+            self._open.append(cluster)
+        else:
+            cluster = best[1]
+            cluster.members[row.source] = row
+            cluster.last_ts = ts
+            if SOURCE_PRIORITY.get(row.source, 0) > SOURCE_PRIORITY.get(cluster.canonical.source, 0):
+                cluster.canonical = row
+
+        if bucket not in self._buckets:
+            self._buckets[bucket] = []
+            self._bucket_order.append(bucket)
+        self._buckets[bucket].append((row, ts, cluster))
+
+    def _resolve(self, cluster: _Cluster):
+        canonical = cluster.canonical
+        for member in cluster.members.values():
+            target = None if member is canonical else canonical.id
+            if target is not None:
+                self.duplicates += 1
+            if member.duplicate_of == target:
+                continue
+            if self.scope:
+                utc = _EPOCH + timedelta(seconds=self.utc_seconds(member))
+                if not self.scope[0] <= utc <= self.scope[1]:
+                    continue
+            self.changes[member.id] = target
+            self.changed += 1
+
+    def flush(self):
+        """Resolves every pending cluster (end of a symbol or of the stream)"""
+        while self._open:
+            self._resolve(self._open.popleft())
+        self._buckets.clear()
+        self._bucket_order.clear()
+
+    def pop_changes(self) -> Dict[int, Optional[int]]:
+        changes, self.changes = self.changes, {}
+        return changes
+
+
+async def _write_changes(db, changes: Dict[int, Optional[int]]):
+    if not changes:
+        return
+    # executemany de UPDATE com bindparam só existe no Core
+    conn = await db.connection()
+    now = datetime.utcnow()
+    await conn.execute(
+        _set_duplicate,
+        [{"b_id": trade_id, "b_duplicate_of": target, "b_updated_at": now} for trade_id, target in changes.items()]
+    )
+
+
+async def _rows(db, conditions) -> AsyncIterator[Any]:
+    """Trades matching `conditions` in (open_time, id) order, PAGE_SIZE rows per query"""
+    cursor = None
+    while True:
+        # Paginação por (open_time, id) no índice (user_id, symbol, open_time)
+        page_conditions = conditions if cursor is None else [*conditions, tuple_(Trade.open_time, Trade.id) > cursor]
+        result = await db.execute(
+            select(*_COLUMNS).where(*page_conditions).order_by(Trade.open_time, Trade.id).limit(PAGE_SIZE)
+        )
+        rows = result.all()
+        for row in rows:
+            yield row
+        if len(rows) < PAGE_SIZE:
+            return
+        cursor = tuple_(rows[-1].open_time, rows[-1].id)
+
+
+async def _merge(streams: List[AsyncIterator[Any]], key: Callable[[Any], float]) -> AsyncIterator[Any]:
+    """Merges streams already sorted by `key` (one per source)"""
+    heap = []
+    for index, stream in enumerate(streams):
+        row = await anext(stream, None)
+        if row is not None:
+            heap.append((key(row), row.id, index, row))
+    heapq.heapify(heap)
+    while heap:
+        _, _, index, row = heapq.heappop(heap)
+        yield row
+        following = await anext(streams[index], None)
+        if following is not None:
+            heapq.heappush(heap, (key(following), following.id, index, following))
+
+
+async def _scan(db, matcher: DuplicateMatcher, user_id: int, symbol: str,
+                start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+    """Feeds a user's trades of one symbol to the matcher in UTC order"""
+    conditions = [Trade.user_id == user_id, Trade.symbol == symbol]
+    if start is not None:
+        conditions.append(Trade.open_time >= start)
+    if end is not None:
+        conditions.append(Trade.open_time <= end)
+
+    if matcher.offsets:
+        # Fusos diferentes: a ordem de open_time só vale dentro de cada fonte
+        sources = (await db.execute(select(distinct(Trade.source)).where(*conditions))).scalars().all()
+        rows = _merge([_rows(db, [*conditions, Trade.source == source]) for source in sources], matcher.utc_seconds)
+    else:
+        rows = _rows(db, conditions)
+
+    scanned = 0
+    async for row in rows:
+        matcher.add(row)
+        scanned += 1
+        if scanned % PAGE_SIZE == 0:
+            await _write_changes(db, matcher.pop_changes())
+    matcher.flush()
+    return scanned
+
+
+async def mark_duplicates(db, user_id: int, rows: Iterable[Dict[str, Any]]) -> int:
+    """
+    Re-matches the trades around a just-written batch (dicts with symbol,
+    open_time and source), so new rows and their counterparts from other
+    sources get the right `duplicate_of`. Does not commit. Returns rows changed.
+    """
+    offsets = source_offsets()
+    windows: Dict[str, List[datetime]] = {}
+    for row in rows:
+        when = row["open_time"] - timedelta(seconds=offsets.get(row.get("source"), 0.0))
+        window = windows.get(row["symbol"])
+        if window is None:
+            windows[row["symbol"]] = [when, when]
+        else:
+            window[0] = min(window[0], when)
+            window[1] = max(window[1], when)
+    if not windows:
+        return 0
+
+    tolerance = timedelta(seconds=get_settings().duplicate_time_tolerance_seconds)
+    # Janela em UTC; no banco cada fonte guarda o seu relógio, então a busca cobre todos os fusos
+    earliest = timedelta(seconds=min([0.0, *offsets.values()]))
+    latest = timedelta(seconds=max([0.0, *offsets.values()]))
+    changed = 0
+    for symbol, (start, end) in windows.items():
+        matcher = DuplicateMatcher.from_settings(scope=(start - tolerance, end + tolerance))
+        await _scan(db, matcher, user_id, symbol, start - 2 * tolerance + earliest, end + 2 * tolerance + latest)
+        await _write_changes(db, matcher.pop_changes())
+        changed += matcher.changed
+    return changed
+
+
+async def rebuild_duplicates(db, user_id: Optional[int] = None,
+                             progress: Optional[Callable[[float, str], None]] = None) -> Dict[str, Any]:
+    """
+    Recomputes `duplicate_of` for the whole history (one user or all).
+    Only (user, symbol) pairs with more than one source are scanned;
+    `progress(fraction, message)` is called after each one. Does not commit.
+    """
+    started = datetime.utcnow()
+    query = (
+        select(Trade.user_id, Trade.symbol)
+        .group_by(Trade.user_id, Trade.symbol)
+        .having(func.count(distinct(Trade.source)) > 1)
+    )
+    if user_id is not None:
+        query = query.where(Trade.user_id == user_id)
+    pairs = (await db.execute(query)).all()
+
+    # Marcas antigas em pares que hoje têm uma fonte só (ex: a outra foi apagada)
+    query = select(Trade.id, Trade.user_id, Trade.symbol).where(Trade.duplicate_of.isnot(None))
+    if user_id is not None:
+        query = query.where(Trade.user_id == user_id)
+    multi_source = set(pairs)
+    stale = {
+        trade_id: None
+        for trade_id, owner, symbol in (await db.execute(query)).all()
+        if (owner, symbol) not in multi_source
+    }
+    await _write_changes(db, stale)
+
+    scanned = changed = duplicates = 0
+    for done, (owner, symbol) in enumerate(pairs, 1):
+        matcher = DuplicateMatcher.from_settings()
+        scanned += await _scan(db, matcher, owner, symbol)
+        await _write_changes(db, matcher.pop_changes())
+        changed += matcher.changed
+        duplicates += matcher.duplicates
+        if progress:
+            progress(done / len(pairs), f"{symbol}: {scanned} trades analisados")
+
+    return {
+        "pairs_scanned": len(pairs),
+        "trades_scanned": scanned,
+        "duplicates": duplicates,
+        "changed": changed + len(stale),
+        "elapsed_seconds": round((datetime.utcnow() - started).total_seconds(), 2),
+    }
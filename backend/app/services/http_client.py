@@ -0,0 +1,98 @@
+"""
+Application-wide pooled HTTP client for broker integrations.
+
+One httpx.AsyncClient is created in the FastAPI lifespan and borrowed by
+every integration service, so repeated calls to the same host reuse
+keep-alive connections instead of paying a new TCP+TLS handshake each
+time. HTTP/2 is used when enabled and the optional `h2` package is
+installed.
+"""
+
+from typing import Any, Dict, Optional
+import importlib.util
+import time
+
+import httpx
+
+from app.config import get_settings
+from app.utils.metrics import metrics
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+async def _on_request(request: httpx.Request):
+    request.extensions["tradestars_started"] = time.perf_counter()
+
+
+async def _on_response(response: httpx.Response):
+    host = response.request.url.host
+    started = response.request.extensions.get("tradestars_started")
+    metrics.inc(f"http.{host}.requests")
+    metrics.inc(f"http.{host}.status_{response.status_code // 100}xx")
+    if started is not None:
+        metrics.observe(f"http.{host}.seconds", time.perf_counter() - started)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    settings = get_settings()
+    http2 = settings.http2_enabled and importlib.util.find_spec("h2") is not None
+    if settings.http2_enabled and not http2:
+        print("HTTP/2 habilitado mas o pacote 'h2' não está instalado; usando HTTP/1.1")
+
+    return httpx.AsyncClient(
+        timeout=settings.http_timeout_seconds,
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry_seconds,
+        ),
+        event_hooks={"request": [_on_request], "response": [_on_response]},
+    )
+
+
+async def start_http_client():
+    global _client
+    if _client is None:
+        _client = create_http_client()
+
+
+async def close_http_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_http_client() -> Optional[httpx.AsyncClient]:
+    """Shared client, or None outside the app lifespan (callers then create their own)"""
+    return _client
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Open/idle connections per host in the shared pool"""
+    if _client is None:
+        return {"running": False}
+
+    hosts: Dict[str, Dict[str, int]] = {}
+    # httpcore não expõe API pública para o pool; leitura defensiva
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    for connection in getattr(pool, "connections", []) or []:
+        try:
+            origin = connection._origin
+            host = origin.host.decode() if isinstance(origin.host, bytes) else str(origin.host)
+        except AttributeError:
+            host = "unknown"
+        stats = hosts.setdefault(host, {"open": 0, "idle": 0})
+        stats["open"] += 1
+        if connection.is_idle():
+            stats["idle"] += 1
+
+    settings = get_settings()
+    return {
+        "running": True,
+        "http2": bool(getattr(pool, "_http2", False)),
+        "max_connections": settings.http_max_connections,
+        "max_keepalive_connections": settings.http_max_keepalive_connections,
+        "hosts": hosts,
+    }
@@ -0,0 +1,109 @@
+"""
+Dry-run of CSV/Excel uploads: what an import would do, without writing.
+
+Preview reads only the first `rows` rows (and, for CSV, only the bytes
+holding them), so it answers in milliseconds whatever the file size. It
+returns the layout that would be used, a sample of normalized trades and
+the per-row issues in those rows. Full validation runs the same checks
+over the whole file and lists every rejected row with its reason.
+"""
+
+from typing import Any, Dict, IO, Optional
+import time
+
+from app.services.csv_parser import read_csv_frame, detect_layout, parse_frame
+from app.services.xlsx_parser import TradeSheet, BATCH_SIZE
+
+PREVIEW_ROWS = 200
+SAMPLE_SIZE = 10
+
+# Avisos (linhas importadas com valor padrão) podem ser muitos; erros vão todos
+MAX_WARNINGS = 1000
+
+READ_SIZE = 64 * 1024
+
+
+def read_head(stream: IO[bytes], lines: int) -> bytes:
+    """The first `lines` complete lines of a file (header included)"""
+    head = b""
+    while head.count(b"\n") < lines:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            return head
+        head += chunk
+    cut = -1
+    for _ in range(lines):
+        cut = head.index(b"\n", cut + 1)
+    return head[:cut + 1]
+
+
+class _Report:
+    def __init__(self):
+        self.rows_read = 0
+        self.valid_rows = 0
+        self.sample = []
+        self.errors = []
+        self.warnings = []
+        self.warning_count = 0
+
+    def add(self, df, layout: Dict[str, Any]):
+        issues = []
+        trades = parse_frame(df, layout, issues)
+        self.rows_read += len(df)
+        self.valid_rows += len(trades)
+        self.sample.extend(trades[:SAMPLE_SIZE - len(self.sample)])
+        for issue in issues:
+            if issue["level"] == "error":
+                self.errors.append(issue)
+            else:
+                self.warning_count += 1
+                if len(self.warnings) < MAX_WARNINGS:
+                    self.warnings.append(issue)
+
+    def result(self, layout: Dict[str, Any], complete: bool, started: float) -> Dict[str, Any]:
+        return {
+            "layout": layout,
+            "complete": complete,
+            "rows_read": self.rows_read,
+            "valid_rows": self.valid_rows,
+            "rejected_rows": len({e["row"] for e in self.errors}),
+            "sample": self.sample,
+            "errors": self.errors,
+            "warnings": self.warnings,
+            "warning_count": self.warning_count,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+
+def preview_csv(contents: bytes, layout: Optional[Dict[str, Any]] = None,
+                rows: Optional[int] = PREVIEW_ROWS) -> Dict[str, Any]:
+    """
+    Dry-run of a CSV. `rows=None` validates the whole file; otherwise
+    `contents` may be just the head of the file (see read_head).
+    """
+    started = time.perf_counter()
+    df, encoding = read_csv_frame(contents, layout.get("encoding") if layout else None, rows)
+    layout = {**(layout or detect_layout(df)), "encoding": encoding}
+
+    report = _Report()
+    report.add(df, layout)
+    return report.result(layout, rows is None or len(df) < rows, started)
+
+
+def preview_xlsx(sheet: TradeSheet, layout: Optional[Dict[str, Any]] = None,
+                 rows: Optional[int] = PREVIEW_ROWS) -> Dict[str, Any]:
+    """Dry-run of a workbook's trade sheet; `rows=None` validates all rows"""
+    started = time.perf_counter()
+    report = _Report()
+    complete = True
+    for df in sheet.frames(rows or BATCH_SIZE):
+        if layout is None:
+            layout = detect_layout(df)
+        report.add(df, layout)
+        if rows is not None:
+            # Só o primeiro lote; o arquivo pode ter mais linhas
+            complete = len(df) < rows
+            break
+    if layout is None:
+        raise ValueError("Nenhum trade encontrado na planilha")
+    return report.result(layout, complete, started)
@@ -0,0 +1,429 @@
+"""
+Rule engine for rule-based trading insights.
+
+Each rule declares the aggregate features it needs plus a condition and a
+message template. `extract_features` computes the union of the required
+features in a single vectorized pass over the trades (NumPy/pandas), and
+`RuleEngine` feeds that dict to every registered rule. Both
+/api/ai/quick-analysis and the AIService fallback use the same engine.
+
+Adding a rule:
+
+    register(Rule(
+        name="low_profit_factor",
+        requires=("profit_factor",),
+        condition=lambda f: f["profit_factor"] < 1,
+        type="danger", category="risk",
+        title="...", description="... {profit_factor} ...", action="...",
+    ))
+"""
+
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from app.utils.metrics import metrics
+
+# Thresholds shared by every code path
+MIN_WIN_RATE = 50
+HIGH_WIN_RATE = 60
+LOSS_STREAK_THRESHOLD = 3
+RISK_REWARD_THRESHOLD = 1.5
+SYMBOL_MIN_TRADES = 5
+SYMBOL_LOW_WIN_RATE = 40
+SYMBOL_HIGH_WIN_RATE = 70
+SUGGESTED_LOSS_MULTIPLIER = 2
+SUGGESTED_GAIN_MULTIPLIER = 3
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+
+# ==================== FEATURES ====================
+
+def trades_to_frame(trades: Iterable) -> pd.DataFrame:
+    """Builds the columnar frame used by feature extraction from ORM objects or rows"""
+    trades = list(trades)
+    return pd.DataFrame({
+        "symbol": [t.symbol for t in trades],
+        "profit": np.fromiter((t.profit or 0.0 for t in trades), dtype=float, count=len(trades)),
+        "open_time": pd.to_datetime([t.open_time for t in trades]),
+    })
+
+
+def max_run(mask: np.ndarray) -> int:
+    """Longest run of True values"""
+    if not mask.any():
+        return 0
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    return int((np.flatnonzero(edges == -1) - np.flatnonzero(edges == 1)).max())
+
+
+class FeatureFrame:
+    """Arrays shared by the feature functions, computed once per extraction"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+
+    @cached_property
+    def profits(self) -> np.ndarray:
+        return self.df["profit"].to_numpy(dtype=float)
+
+    @cached_property
+    def wins(self) -> np.ndarray:
+        return self.profits > 0
+
+    @cached_property
+    def losses(self) -> np.ndarray:
+        return self.profits < 0
+
+    @cached_property
+    def chronological_profits(self) -> np.ndarray:
+        order = np.argsort(self.df["open_time"].to_numpy(), kind="stable")
+        return self.profits[order]
+
+    def grouped(self, key: pd.Series) -> pd.DataFrame:
+        return pd.DataFrame({
+            "key": key.to_numpy(),
+            "profit": self.profits,
+            "wins": self.wins,
+            "losses": self.losses,
+        }).groupby("key", sort=True).agg(
+            trades=("profit", "size"),
+            profit=("profit", "sum"),
+            wins=("wins", "sum"),
+            losses=("losses", "sum"),
+        )
+
+
+FEATURES: Dict[str, Callable[[FeatureFrame], Any]] = {}
+
+
+def feature(name: str):
+    def decorator(fn):
+        FEATURES[name] = fn
+        return fn
+    return decorator
+
+
+@feature("total_trades")
+def _total_trades(ff: FeatureFrame) -> int:
+    return int(len(ff.profits))
+
+
+@feature("winning_trades")
+def _winning_trades(ff: FeatureFrame) -> int:
+    return int(ff.wins.sum())
+
+
+@feature("losing_trades")
+def _losing_trades(ff: FeatureFrame) -> int:
+    return int(ff.losses.sum())
+
+
+@feature("win_rate")
+def _win_rate(ff: FeatureFrame) -> float:
+    return round(float(ff.wins.mean()) * 100, 2) if len(ff.profits) else 0.0
+
+
+@feature("total_profit")
+def _total_profit(ff: FeatureFrame) -> float:
+    return round(float(ff.profits.sum()), 2)
+
+
+@feature("average_win")
+def _average_win(ff: FeatureFrame) -> float:
+    return round(float(ff.profits[ff.wins].mean()), 2) if ff.wins.any() else 0.0
+
+
+@feature("average_loss")
+def _average_loss(ff: FeatureFrame) -> float:
+    return round(abs(float(ff.profits[ff.losses].mean())), 2) if ff.losses.any() else 0.0
+
+
+@feature("best_trade")
+def _best_trade(ff: FeatureFrame) -> float:
+    return round(float(ff.profits.max()), 2) if len(ff.profits) else 0.0
+
+
+@feature("worst_trade")
+def _worst_trade(ff: FeatureFrame) -> float:
+    return round(float(ff.profits.min()), 2) if len(ff.profits) else 0.0
+
+
+@feature("profit_factor")
+def _profit_factor(ff: FeatureFrame) -> float:
+    gross_loss = abs(float(ff.profits[ff.losses].sum()))
+    return round(float(ff.profits[ff.wins].sum()) / gross_loss, 2) if gross_loss else 0.0
+
+
+@feature("max_win_streak")
+def _max_win_streak(ff: FeatureFrame) -> int:
+    return max_run(ff.chronological_profits > 0)
+
+
+@feature("max_loss_streak")
+def _max_loss_streak(ff: FeatureFrame) -> int:
+    return max_run(ff.chronological_profits < 0)
+
+
+@feature("hourly_performance")
+def _hourly_performance(ff: FeatureFrame) -> Dict[int, Dict[str, Any]]:
+    grouped = ff.grouped(ff.df["open_time"].dt.hour)
+    return {
+        int(hour): {"wins": int(row.wins), "losses": int(row.losses), "profit": round(float(row.profit), 2)}
+        for hour, row in zip(grouped.index, grouped.itertuples())
+    }
+
+
+@feature("symbol_performance")
+def _symbol_performance(ff: FeatureFrame) -> Dict[str, Dict[str, Any]]:
+    grouped = ff.grouped(ff.df["symbol"])
+    return {
+        str(symbol): {
+            "wins": int(row.wins),
+            "losses": int(row.losses),
+            "profit": round(float(row.profit), 2),
+            "trades": int(row.trades),
+        }
+        for symbol, row in zip(grouped.index, grouped.itertuples())
+    }
+
+
+@feature("weekday_performance")
+def _weekday_performance(ff: FeatureFrame) -> Dict[str, Dict[str, Any]]:
+    grouped = ff.grouped(ff.df["open_time"].dt.weekday)
+    return {
+        WEEKDAYS[int(day)]: {"trades": int(row.trades), "profit": round(float(row.profit), 2)}
+        for day, row in zip(grouped.index, grouped.itertuples())
+    }
+
+
+def extract_features(df: pd.DataFrame, names: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Computes the requested features (all of them by default) in one pass"""
+    ff = FeatureFrame(df)
+    with metrics.timer("insights.features_seconds"):
+        return {name: FEATURES[name](ff) for name in (names or FEATURES)}
+
+
+# ==================== RULES ====================
+
+class Rule:
+    """
+    Declarative insight rule.
+
+    `context` derives the template variables from the features (return None
+    to skip), `each` yields one context per item (e.g. per symbol), and the
+    insight is emitted when `condition(context)` is true. Templates use
+    str.format with the context.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requires: Sequence[str],
+        condition: Callable[[Dict[str, Any]], bool],
+        type: str,
+        category: str,
+        title: str,
+        description: str,
+        action: str,
+        context: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]] = None,
+        each: Callable[[Dict[str, Any]], Iterable[Dict[str, Any]]] = None,
+    ):
+        self.name = name
+        self.requires = tuple(requires)
+        self.condition = condition
+        self.type = type
+        self.category = category
+        self.title = title
+        self.description = description
+        self.action = action
+        self.context = context
+        self.each = each
+
+    def evaluate(self, features: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if self.each:
+            contexts = list(self.each(features))
+        else:
+            contexts = [self.context(features) if self.context else features]
+
+        insights = []
+        for ctx in contexts:
+            if ctx is None or not self.condition(ctx):
+                continue
+            insights.append({
+                "type": self.type,
+                "category": self.category,
+                "title": self.title.format(**ctx),
+                "description": self.description.format(**ctx),
+                "action": self.action.format(**ctx),
+            })
+        return insights
+
+
+RULES: List[Rule] = []
+
+
+def register(rule: Rule) -> Rule:
+    RULES.append(rule)
+    return rule
+
+
+def _extreme_hour(features: Dict[str, Any], pick) -> Optional[Dict[str, Any]]:
+    hourly = features["hourly_performance"]
+    if not hourly:
+        return None
+    hour, data = pick(hourly.items(), key=lambda x: x[1]["profit"])
+    return {"hour": hour, "next_hour": (hour + 1) % 24, "profit": data["profit"], "loss": abs(data["profit"])}
+
+
+def _symbols(features: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    for symbol, data in features["symbol_performance"].items():
+        yield {**data, "symbol": symbol, "win_rate": data["wins"] / data["trades"] * 100}
+
+
+register(Rule(
+    name="low_win_rate",
+    requires=("win_rate",),
+    condition=lambda f: f["win_rate"] < MIN_WIN_RATE,
+    type="warning", category="general",
+    title="📉 Win Rate Abaixo de 50%",
+    description="Seu win rate geral é de {win_rate:.1f}%. Isso significa que você perde mais trades do que ganha.",
+    action="Revise seus critérios de entrada e seja mais seletivo nas operações.",
+))
+
+register(Rule(
+    name="high_win_rate",
+    requires=("win_rate",),
+    condition=lambda f: f["win_rate"] > HIGH_WIN_RATE,
+    type="success", category="general",
+    title="🎯 Excelente Win Rate!",
+    description="Seu win rate de {win_rate:.1f}% está acima de 60%. Você está no caminho certo!",
+    action="Mantenha a consistência e não mude uma estratégia que está funcionando.",
+))
+
+register(Rule(
+    name="high_average_loss",
+    requires=("average_win", "average_loss"),
+    condition=lambda f: f["average_loss"] > f["average_win"] * RISK_REWARD_THRESHOLD,
+    type="danger", category="risk",
+    title="⚠️ Loss Médio Muito Alto",
+    description="Seu loss médio (R$ {average_loss:.2f}) é muito maior que seu gain médio (R$ {average_win:.2f}).",
+    action="Reduza seu stop loss ou aumente seu take profit para melhorar a relação risco/retorno.",
+))
+
+register(Rule(
+    name="negative_profit_factor",
+    requires=("profit_factor",),
+    condition=lambda f: f["profit_factor"] < 1,
+    type="danger", category="risk",
+    title="📊 Profit Factor Negativo",
+    description="Seu profit factor de {profit_factor} indica que você está perdendo dinheiro no longo prazo.",
+    action="Revise completamente sua estratégia antes de continuar operando.",
+))
+
+register(Rule(
+    name="excellent_profit_factor",
+    requires=("profit_factor",),
+    condition=lambda f: f["profit_factor"] > 2,
+    type="success", category="risk",
+    title="💪 Profit Factor Excelente!",
+    description="Profit factor de {profit_factor} é muito bom. Você ganha mais do que perde.",
+    action="Considere aumentar gradualmente seu tamanho de posição.",
+))
+
+register(Rule(
+    name="revenge_trading",
+    requires=("max_loss_streak",),
+    condition=lambda f: f["max_loss_streak"] >= LOSS_STREAK_THRESHOLD,
+    type="warning", category="psychology",
+    title="🧠 Possível Revenge Trading",
+    description="Você teve uma sequência de {max_loss_streak} losses seguidos. Isso pode indicar revenge trading.",
+    action="Após 2 losses seguidos, faça uma pausa de pelo menos 15 minutos.",
+))
+
+register(Rule(
+    name="best_hour",
+    requires=("hourly_performance",),
+    context=lambda f: _extreme_hour(f, max),
+    condition=lambda c: c["profit"] > 0,
+    type="success", category="timing",
+    title="⏰ Melhor Horário: {hour:02d}:00",
+    description="Seu melhor horário para operar é às {hour:02d}:00. Você lucrou R$ {profit:.2f} nesse horário.",
+    action="Considere concentrar suas operações próximo das {hour:02d}:00.",
+))
+
+register(Rule(
+    name="worst_hour",
+    requires=("hourly_performance",),
+    context=lambda f: _extreme_hour(f, min),
+    condition=lambda c: c["profit"] < 0,
+    type="warning", category="timing",
+    title="⚠️ Horário Problemático: {hour:02d}:00",
+    description="Evite operar às {hour:02d}:00. Você perdeu R$ {loss:.2f} nesse horário.",
+    action="Considere não operar entre {hour:02d}:00 e {next_hour:02d}:00.",
+))
+
+register(Rule(
+    name="symbol_low_win_rate",
+    requires=("symbol_performance",),
+    each=_symbols,
+    condition=lambda c: c["trades"] >= SYMBOL_MIN_TRADES and c["win_rate"] < SYMBOL_LOW_WIN_RATE,
+    type="danger", category="symbol",
+    title="🚨 Baixo Win Rate em {symbol}",
+    description="Seu win rate em {symbol} é de apenas {win_rate:.1f}% ({wins}/{trades} trades).",
+    action="Revise sua estratégia para {symbol} ou considere não operar esse ativo.",
+))
+
+register(Rule(
+    name="symbol_high_win_rate",
+    requires=("symbol_performance",),
+    each=_symbols,
+    condition=lambda c: c["trades"] >= SYMBOL_MIN_TRADES and c["win_rate"] > SYMBOL_HIGH_WIN_RATE,
+    type="success", category="symbol",
+    title="🌟 Excelente em {symbol}",
+    description="Seu win rate em {symbol} é de {win_rate:.1f}%! Lucro total: R$ {profit:.2f}",
+    action="Continue focando em {symbol}, você tem vantagem nesse ativo.",
+))
+
+register(Rule(
+    name="suggested_limits",
+    requires=("average_win", "average_loss"),
+    context=lambda f: {
+        "loss_limit": f["average_loss"] * SUGGESTED_LOSS_MULTIPLIER,
+        "gain_target": f["average_win"] * SUGGESTED_GAIN_MULTIPLIER,
+    },
+    condition=lambda c: True,
+    type="info", category="risk",
+    title="💰 Limites Sugeridos",
+    description="Com base no seu histórico, sugerimos: Loss diário máximo de R$ {loss_limit:.2f} e meta de gain de R$ {gain_target:.2f}",
+    action="Configure esses limites no seu operacional e respeite-os rigorosamente.",
+))
+
+
+class RuleEngine:
+    def __init__(self, rules: Sequence[Rule] = None):
+        self.rules = list(rules) if rules is not None else RULES
+
+    @property
+    def required_features(self) -> List[str]:
+        names = []
+        for rule in self.rules:
+            names.extend(n for n in rule.requires if n not in names)
+        return names
+
+    def evaluate(self, features: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Runs every rule over already-extracted features"""
+        insights = []
+        for rule in self.rules:
+            if any(name not in features for name in rule.requires):
+                continue
+            with metrics.timer(f"insights.rules.{rule.name}_seconds"):
+                insights.extend(rule.evaluate(features))
+        return insights
+
+    def run(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
+        """Extracts the features needed by the rules and evaluates them"""
+        return self.evaluate(extract_features(df, self.required_features))
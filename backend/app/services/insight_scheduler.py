@@ -0,0 +1,209 @@
+"""
+Scheduled batch insight generation.
+
+Opt-in background scheduler (INSIGHTS_SCHEDULER_ENABLED=true) that, once a
+day after market close, finds users whose trades changed since their last
+generated snapshot and pre-generates their insights. Users are pushed onto
+a queue drained by a fixed number of async workers sharing a
+tokens-per-minute rate limiter, so a batch never bursts past the OpenAI
+quota. Results are stored in `insight_snapshots` and served instantly by
+/api/ai/insights.
+
+Point OPENAI_BASE_URL to a local fake endpoint to exercise it offline.
+"""
+
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+import asyncio
+import json
+import time
+
+from sqlalchemy import select, func
+
+from app.config import get_settings
+from app.database import async_session, read_session
+from app.models.trade import Trade
+from app.models.insight import InsightSnapshot
+from app.services.ai_service import AIService
+from app.utils.metrics import metrics
+from app.utils.rate_limit import TokenBucket
+
+MIN_TRADES_FOR_INSIGHTS = 10
+
+
+async def get_data_version(db, user_id: int) -> Tuple[str, int]:
+    """Returns ("<count>:<max updated_at>", count) for the user's trades"""
+    result = await db.execute(
+        select(func.count(Trade.id), func.max(Trade.updated_at)).where(Trade.user_id == user_id)
+    )
+    count, last_update = result.one()
+    return f"{count}:{last_update.isoformat() if last_update else ''}", count
+
+
+async def get_fresh_snapshot(db, user_id: int) -> Optional[InsightSnapshot]:
+    """Returns the stored snapshot if it was generated from the current data"""
+    result = await db.execute(select(InsightSnapshot).where(InsightSnapshot.user_id == user_id))
+    snapshot = result.scalar_one_or_none()
+    if snapshot is None:
+        return None
+    version, _ = await get_data_version(db, user_id)
+    return snapshot if snapshot.data_version == version else None
+
+
+async def save_snapshot(db, user_id: int, insights: list, trades_analyzed: int,
+                        data_version: str, source: str = "ON_DEMAND") -> InsightSnapshot:
+    result = await db.execute(select(InsightSnapshot).where(InsightSnapshot.user_id == user_id))
+    snapshot = result.scalar_one_or_none()
+    if snapshot is None:
+        snapshot = InsightSnapshot(user_id=user_id)
+        db.add(snapshot)
+    snapshot.insights = json.dumps(insights, ensure_ascii=False)
+    snapshot.trades_analyzed = trades_analyzed
+    snapshot.data_version = data_version
+    snapshot.source = source
+    snapshot.generated_at = datetime.utcnow()
+    await db.commit()
+    return snapshot
+
+
+def _seconds_until(schedule_time: str, now: datetime = None) -> float:
+    """Seconds until the next occurrence of HH:MM (local time)"""
+    now = now or datetime.now()
+    hour, minute = (int(x) for x in schedule_time.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+class InsightScheduler:
+    def __init__(self, workers: int = None, tokens_per_minute: int = None,
+                 schedule_time: str = None, session_factory=async_session,
+                 read_session_factory=read_session):
+        settings = get_settings()
+        self.workers = workers or settings.insights_workers
+        self.schedule_time = schedule_time or settings.insights_schedule_time
+        self.rate_limiter = TokenBucket(tokens_per_minute or settings.insights_tokens_per_minute)
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._queued = set()
+        self._tasks = []
+        self._last_run: Optional[datetime] = None
+        self._batch_started: Optional[float] = None
+        self._batch_base = 0.0
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._schedule_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _schedule_loop(self):
+        while True:
+            await asyncio.sleep(_seconds_until(self.schedule_time))
+            try:
+                await self.enqueue_changed_users()
+            except Exception as e:
+                print(f"Insight scheduler error: {e}")
+
+    async def enqueue_changed_users(self) -> int:
+        """Enqueue every user whose trades changed since their last snapshot"""
+        # Agregação sobre todos os trades: pool de leitura, não a conexão de escrita
+        async with self.read_session_factory() as db:
+            versions = await db.execute(
+                select(Trade.user_id, func.count(Trade.id), func.max(Trade.updated_at))
+                .group_by(Trade.user_id)
+            )
+            snapshots = await db.execute(select(InsightSnapshot.user_id, InsightSnapshot.data_version))
+            stored = dict(snapshots.all())
+
+        enqueued = 0
+        for user_id, count, last_update in versions.all():
+            version = f"{count}:{last_update.isoformat() if last_update else ''}"
+            if count < MIN_TRADES_FOR_INSIGHTS or stored.get(user_id) == version:
+                continue
+            if user_id in self._queued:
+                continue
+            self._queued.add(user_id)
+            self.queue.put_nowait(user_id)
+            enqueued += 1
+
+        self._last_run = datetime.now()
+        self._batch_started = time.monotonic()
+        self._batch_base = metrics.counter("insights.scheduler.generated")
+        metrics.inc("insights.scheduler.enqueued", enqueued)
+        metrics.set_gauge("insights.scheduler.queue_depth", self.queue.qsize())
+        return enqueued
+
+    async def _worker(self, worker_id: int):
+        while True:
+            user_id = await self.queue.get()
+            try:
+                with metrics.timer("insights.scheduler.generation_seconds"):
+                    generated = await self.generate_for_user(user_id)
+                if generated:
+                    metrics.inc("insights.scheduler.generated")
+                else:
+                    # IA indisponível: sem snapshot, o usuário volta na próxima rodada
+                    metrics.inc("insights.scheduler.fallback")
+            except Exception as e:
+                metrics.inc("insights.scheduler.failed")
+                print(f"Insight generation failed for user {user_id}: {e}")
+            finally:
+                self._queued.discard(user_id)
+                self.queue.task_done()
+                metrics.set_gauge("insights.scheduler.queue_depth", self.queue.qsize())
+
+    async def generate_for_user(self, user_id: int) -> bool:
+        """Generates and stores the user's snapshot; False if only the rule-based fallback was available"""
+        # Lê pelo pool de leitura: a conexão de escrita não fica presa durante a chamada à IA
+        async with self.read_session_factory() as db:
+            version, _ = await get_data_version(db, user_id)
+            result = await db.execute(select(Trade).where(Trade.user_id == user_id, Trade.duplicate_of.is_(None)))
+            trades = result.scalars().all()
+
+        ai_service = AIService()
+        insights, from_llm = await ai_service.generate_insights(trades, rate_limiter=self.rate_limiter)
+        metrics.inc("insights.scheduler.tokens", ai_service.last_usage)
+        if not from_llm:
+            return False
+
+        async with self.session_factory() as db:
+            await save_snapshot(db, user_id, insights, len(trades), version, source="SCHEDULER")
+        return True
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self._batch_started if self._batch_started else 0
+        generated = metrics.counter("insights.scheduler.generated")
+        batch_generated = generated - self._batch_base
+        return {
+            "running": bool(self._tasks),
+            "workers": self.workers,
+            "schedule_time": self.schedule_time,
+            "next_run_in_seconds": round(_seconds_until(self.schedule_time)),
+            "last_run": self._last_run.isoformat() if self._last_run else None,
+            "queue_depth": self.queue.qsize(),
+            "generated": generated,
+            "failed": metrics.counter("insights.scheduler.failed"),
+            "fallback": metrics.counter("insights.scheduler.fallback"),
+            "tokens_used": metrics.counter("insights.scheduler.tokens"),
+            "tokens_available": round(self.rate_limiter.available),
+            "throughput_per_minute": round(batch_generated / elapsed * 60, 2) if elapsed else 0.0,
+        }
+
+
+_scheduler: Optional[InsightScheduler] = None
+
+
+def get_insight_scheduler() -> InsightScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = InsightScheduler()
+    return _scheduler
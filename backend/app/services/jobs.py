@@ -0,0 +1,379 @@
+"""
+Durable in-process job queue.
+
+Long operations (file imports, broker syncs, insight generation, duplicate
+rebuilds) can run as jobs instead of inside the HTTP request: the endpoint
+stores a row in `jobs` and answers 202 with its id right away, and workers
+started by the app lifespan pick it up. The row outlives the request, so a
+client disconnect does not abort the work, and jobs left `running` by a
+restart go back to the queue on startup.
+
+- kinds are registered with `@job_handler(kind, concurrency)`; each kind
+  has its own workers (JOB_WORKERS overrides the concurrency per kind), so
+  throughput is set by worker counts and a slow kind cannot starve others;
+- the next job of a kind (highest priority, then oldest) is claimed with a
+  single UPDATE ... RETURNING. Idle workers wait for an enqueue or for the
+  earliest `run_after` of the kind, read on the read pool, and only take
+  the writer when a job is due;
+- failures are retried with exponential backoff up to `max_attempts`;
+  bad input (ValueError, 4xx HTTPException) fails right away and
+  `RetryLater` sets the wait (rate limits);
+- credentials go in `secrets`, stored encrypted and apart from the payload
+  (so `unique` still matches) and merged into it only for the handler;
+- handlers report progress on their `JobContext`. It is kept in memory while
+  the job runs (no writes competing with the job's own transaction) and
+  stored when the job ends.
+
+Uploaded files wait in JOB_SPOOL_DIR and are deleted, with the payload
+and secrets, when the job finishes.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, IO, Optional, Tuple
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+
+from sqlalchemy import select, update, delete, func
+
+from app.config import get_settings
+from app.database import async_session, read_session
+from app.models.job import Job
+from app.utils.crypto import encrypt_secret, decrypt_secret
+from app.utils.metrics import metrics
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+ACTIVE = (QUEUED, RUNNING)
+
+RETRY_BASE_SECONDS = 5
+
+# Chave do payload com o arquivo enviado (apagado quando o job termina)
+SPOOL_FILE = "spool_file"
+
+
+class RetryLater(Exception):
+    """Temporary failure with a known wait (rate limit, open circuit breaker)"""
+
+    def __init__(self, message: str, delay: Optional[float] = None):
+        super().__init__(message)
+        self.delay = delay
+
+
+class JobContext:
+    """Passed to handlers: job identity and progress reporting"""
+
+    def __init__(self, job_id: int, user_id: Optional[int], attempt: int):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.attempt = attempt
+        self.progress = 0.0
+        self.message: Optional[str] = None
+
+    def report(self, progress: float, message: Optional[str] = None):
+        self.progress = max(0.0, min(1.0, progress))
+        if message is not None:
+            self.message = message
+
+
+Handler = Callable[[JobContext, Dict[str, Any]], Awaitable[Any]]
+
+_handlers: Dict[str, Tuple[Handler, int]] = {}
+
+
+def job_handler(kind: str, concurrency: int = 1):
+    """Registers the coroutine that runs jobs of `kind` (default worker count)"""
+    def register(handler: Handler) -> Handler:
+        _handlers[kind] = (handler, concurrency)
+        return handler
+    return register
+
+
+def spool_upload(stream: IO[bytes]) -> str:
+    """Copies an uploaded file to the spool dir; returns its path. Blocking."""
+    directory = get_settings().job_spool_dir
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, uuid.uuid4().hex)
+    with open(path, "wb") as target:
+        shutil.copyfileobj(stream, target, 1024 * 1024)
+    return path
+
+
+def _remove_spool(payload: Dict[str, Any]):
+    path = payload.get(SPOOL_FILE)
+    if path:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def enqueue_job(db, kind: str, payload: Dict[str, Any], user_id: Optional[int] = None,
+                      priority: int = 0, unique: bool = False,
+                      secrets: Optional[Dict[str, Any]] = None, delay: float = 0) -> Job:
+    """
+    Adds a job and wakes the kind's workers (commits). With `unique`, a
+    queued or running job with the same kind, user and payload is returned
+    instead of a new one. `secrets` (credentials) are stored encrypted and
+    handed to the handler merged into the payload. `delay` (seconds) holds
+    the job back before it can be claimed.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Tipo de job desconhecido: {kind}")
+    encoded = json.dumps(payload, sort_keys=True, default=str)
+
+    if unique:
+        result = await db.execute(
+            select(Job).where(
+                Job.kind == kind,
+                Job.user_id == user_id,
+                Job.status.in_(ACTIVE),
+                Job.payload == encoded
+            ).limit(1)
+        )
+        job = result.scalar_one_or_none()
+        if job is not None:
+            return job
+
+    job = Job(
+        kind=kind,
+        user_id=user_id,
+        priority=priority,
+        payload=encoded,
+        secrets=encrypt_secret(json.dumps(secrets)) if secrets else None,
+        status=QUEUED,
+        max_attempts=get_settings().job_max_attempts,
+        run_after=datetime.utcnow() + timedelta(seconds=delay),
+    )
+    db.add(job)
+    await db.commit()
+    metrics.inc(f"jobs.{kind}.enqueued")
+    get_job_runner().wake(kind)
+    return job
+
+
+def job_ref(job: Job) -> Dict[str, Any]:
+    """Body of the 202 answer of endpoints that run as a job"""
+    return {"job_id": job.id, "kind": job.kind, "status": job.status, "status_url": f"/api/jobs/{job.id}"}
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value else None
+
+
+def job_to_dict(job: Job) -> Dict[str, Any]:
+    progress, message = job.progress, job.progress_message
+    live = get_job_runner().running.get(job.id)
+    if live is not None and job.status == RUNNING:
+        progress, message = live.progress, live.message
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "priority": job.priority,
+        "progress": round(progress or 0.0, 4),
+        "progress_message": message,
+        "attempts": job.attempts,
+        "max_attempts": job.max_attempts,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": _iso(job.created_at),
+        "started_at": _iso(job.started_at),
+        "finished_at": _iso(job.finished_at),
+        "retry_at": _iso(job.run_after) if job.status == QUEUED and job.attempts else None,
+    }
+
+
+def _error_message(error: Exception) -> str:
+    detail = getattr(error, "detail", None)
+    if detail is None:
+        return str(error) or type(error).__name__
+    return detail if isinstance(detail, str) else json.dumps(detail, ensure_ascii=False, default=str)
+
+
+def _is_permanent(error: Exception) -> bool:
+    # Entrada inválida não melhora tentando de novo
+    status_code = getattr(error, "status_code", None)
+    return isinstance(error, ValueError) or (status_code is not None and status_code < 500)
+
+
+class JobRunner:
+    def __init__(self, session_factory=async_session, poll_seconds: float = None,
+                 read_session_factory=read_session):
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.poll_seconds = poll_seconds or get_settings().job_poll_seconds
+        self.running: Dict[int, JobContext] = {}
+        self._wakeups: Dict[str, asyncio.Event] = {}
+        self._tasks = []
+
+    def concurrency(self, kind: str) -> int:
+        return max(1, get_settings().job_workers.get(kind, _handlers[kind][1]))
+
+    async def start(self):
+        if self._tasks:
+            return
+        await self.recover()
+        for kind in _handlers:
+            self._wakeups[kind] = asyncio.Event()
+            for _ in range(self.concurrency(kind)):
+                self._tasks.append(asyncio.create_task(self._worker(kind)))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self, kind: str):
+        event = self._wakeups.get(kind)
+        if event is not None:
+            event.set()
+
+    async def recover(self):
+        """Requeues jobs interrupted by a restart and purges old finished ones"""
+        now = datetime.utcnow()
+        retention = timedelta(days=get_settings().job_retention_days)
+        async with self.session_factory() as db:
+            await db.execute(
+                update(Job).where(Job.status == RUNNING).values(status=QUEUED, run_after=now, updated_at=now)
+            )
+            await db.execute(
+                delete(Job).where(Job.status.in_((SUCCEEDED, FAILED)), Job.finished_at < now - retention)
+            )
+            await db.commit()
+
+    async def next_due(self, kind: str) -> Optional[datetime]:
+        """Earliest run_after of the queued jobs of `kind` (read pool, no writer)"""
+        async with self.read_session_factory() as db:
+            result = await db.execute(
+                select(func.min(Job.run_after)).where(Job.kind == kind, Job.status == QUEUED)
+            )
+            return result.scalar()
+
+    async def claim_next(self, kind: str):
+        """Marks the next due job of `kind` as running; returns its row or None"""
+        now = datetime.utcnow()
+        next_id = (
+            select(Job.id)
+            .where(Job.kind == kind, Job.status == QUEUED, Job.run_after <= now)
+            .order_by(Job.priority.desc(), Job.id)
+            .limit(1)
+            .scalar_subquery()
+        )
+        async with self.session_factory() as db:
+            result = await db.execute(
+                update(Job)
+                .where(Job.id == next_id, Job.status == QUEUED)
+                .values(status=RUNNING, attempts=Job.attempts + 1, started_at=now, updated_at=now)
+                .returning(Job.id, Job.user_id, Job.payload, Job.secrets, Job.attempts, Job.max_attempts)
+                .execution_options(synchronize_session=False)
+            )
+            row = result.first()
+            await db.commit()
+        return row
+
+    async def _worker(self, kind: str):
+        handler, _ = _handlers[kind]
+        wakeup = self._wakeups[kind]
+        while True:
+            wait = self.poll_seconds
+            try:
+                due = await self.next_due(kind)
+                if due is not None:
+                    wait = min(wait, (due - datetime.utcnow()).total_seconds())
+                # Conexão de escrita só quando há job vencido; o poll ocioso fica no pool de leitura
+                row = await self.claim_next(kind) if wait <= 0 else None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job worker ({kind}) failed to claim: {e}")
+                row, wait = None, self.poll_seconds
+            if row is not None:
+                await self._run(kind, handler, row)
+                continue
+            if wait <= 0:
+                # Outro worker levou o job: relê a fila
+                continue
+            # Espera um enqueue, o próximo retry agendado ou o poll (jobs de outro processo)
+            try:
+                await asyncio.wait_for(wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+    async def _run(self, kind: str, handler: Handler, row):
+        context = JobContext(row.id, row.user_id, row.attempts)
+        payload = json.loads(row.payload or "{}")
+        self.running[row.id] = context
+        metrics.set_gauge("jobs.running", len(self.running))
+        started = time.perf_counter()
+        try:
+            secrets = json.loads(decrypt_secret(row.secrets)) if row.secrets else {}
+            result = await handler(context, {**payload, **secrets})
+        except asyncio.CancelledError:
+            # Desligamento: volta para a fila sem gastar a tentativa
+            await self._finish(row.id, context, QUEUED, attempts=row.attempts - 1)
+            raise
+        except Exception as e:
+            message = _error_message(e)
+            if _is_permanent(e) or row.attempts >= row.max_attempts:
+                metrics.inc(f"jobs.{kind}.failed")
+                await self._finish(row.id, context, FAILED, error=message, payload=payload)
+            else:
+                delay = getattr(e, "delay", None) or RETRY_BASE_SECONDS * 2 ** (row.attempts - 1)
+                metrics.inc(f"jobs.{kind}.retried")
+                await self._finish(row.id, context, QUEUED, error=message, retry_in=delay)
+        else:
+            context.report(1.0)
+            metrics.inc(f"jobs.{kind}.succeeded")
+            await self._finish(row.id, context, SUCCEEDED, result=result, payload=payload)
+        finally:
+            self.running.pop(row.id, None)
+            metrics.set_gauge("jobs.running", len(self.running))
+            metrics.observe(f"jobs.{kind}.seconds", time.perf_counter() - started)
+
+    async def _finish(self, job_id: int, context: JobContext, status: str, result: Any = None,
+                      error: Optional[str] = None, retry_in: float = 0, attempts: Optional[int] = None,
+                      payload: Optional[Dict[str, Any]] = None):
+        now = datetime.utcnow()
+        values = {
+            "status": status,
+            "progress": context.progress,
+            "progress_message": context.message,
+            "error": error,
+            "updated_at": now,
+        }
+        if status == QUEUED:
+            values["run_after"] = now + timedelta(seconds=retry_in)
+            if attempts is not None:
+                values["attempts"] = attempts
+        else:
+            # Fim do job: entrada, credenciais e arquivo não são mais necessários
+            values.update(finished_at=now, payload="{}", secrets=None)
+            if result is not None:
+                values["result"] = json.dumps(result, ensure_ascii=False, default=str)
+        async with self.session_factory() as db:
+            await db.execute(update(Job).where(Job.id == job_id).values(**values))
+            await db.commit()
+        if payload is not None:
+            _remove_spool(payload)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._tasks),
+            "workers": {kind: self.concurrency(kind) for kind in _handlers},
+            "jobs_running": len(self.running),
+        }
+
+
+_runner: Optional[JobRunner] = None
+
+
+def get_job_runner() -> JobRunner:
+    global _runner
+    if _runner is None:
+        _runner = JobRunner()
+    return _runner
@@ -16,8 +16,95 @@ Para usar:
 
 import httpx
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import AsyncIterator, Iterable, List, Dict, Any, Optional
 import asyncio
+import json
+
+from app.config import get_settings
+from app.services.http_client import get_http_client
+from app.services.positions import PositionBook
+from app.utils.cache import SingleFlight, TTLCache
+from app.utils.metrics import metrics
+from app.utils.resilience import get_breaker, CircuitOpenError
+
+# Últimos dados bons de cada conta, servidos enquanto o MetaAPI está fora do ar
+_account_cache: Dict[str, Dict[str, Any]] = {}
+
+# Chamadas simultâneas da mesma conta (duplo clique, várias abas) viram uma só
+_flights = SingleFlight("metaapi")
+_account_info_cache = TTLCache(get_settings().metaapi_account_info_ttl_seconds)
+
+
+# Deals bufferizados por janela enquanto as anteriores são consumidas
+WINDOW_QUEUE_SIZE = 1000
+TRADE_BATCH_SIZE = 500
+_END_OF_WINDOW = object()
+
+
+class MetaAPIError(Exception):
+    pass
+
+
+class MetaAPIRateLimited(MetaAPIError):
+    """HTTP 429 do MetaAPI; `retry_after` vem do header Retry-After quando presente"""
+
+    def __init__(self, retry_after: float = None):
+        super().__init__("Limite de requisições do MetaAPI atingido")
+        self.retry_after = retry_after
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(response: httpx.Response) -> bool:
+    return response.status_code >= 500 or response.status_code == 429
+
+
+def history_error(e: Exception) -> Dict[str, Any]:
+    """Resultado de falha padrão para buscas de histórico"""
+    if isinstance(e, MetaAPIRateLimited):
+        return {"success": False, "message": str(e), "rate_limited": True, "retry_after": e.retry_after, "trades": []}
+    if isinstance(e, CircuitOpenError):
+        return {"success": False, "message": str(e), "retry_after": e.retry_in, "trades": []}
+    return {"success": False, "message": str(e), "trades": []}
+
+
+async def iter_json_array(chunks: AsyncIterator[str]) -> AsyncIterator[Any]:
+    """
+    Decodifica um array JSON de objetos incrementalmente, emitindo cada
+    elemento assim que ele chega completo (sem montar a lista inteira)
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+    async for text in chunks:
+        buffer += text
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise MetaAPIError("Resposta de histórico inválida: esperado um array JSON")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # elemento incompleto: espera o próximo pedaço
+            yield item
+        buffer = buffer[pos:]
+    if buffer.strip():
+        raise MetaAPIError("Resposta de histórico truncada")
 
 
 class MetaAPIService:
@@ -29,9 +116,16 @@ class MetaAPIService:
     BASE_URL = "https://mt-client-api-v1.agiliumtrade.agiliumtrade.ai"
     
     def __init__(self, api_token: str = None, account_id: str = None):
+        settings = get_settings()
         self.api_token = api_token
         self.account_id = account_id
+        self.base_url = settings.metaapi_base_url or self.BASE_URL
+        self._timeout = settings.metaapi_timeout_seconds
+        self._window_days = settings.metaapi_history_window_days
+        self._concurrency = settings.metaapi_history_concurrency
+        self._breaker = get_breaker("metaapi", max_timeout=settings.metaapi_timeout_seconds)
         self._client = None
+        self._owns_client = False
     
     def _get_headers(self) -> Dict[str, str]:
         return {
@@ -40,12 +134,37 @@ class MetaAPIService:
         }
     
     async def _get_client(self) -> httpx.AsyncClient:
+        """Usa o cliente compartilhado da aplicação; cria um próprio só fora do lifespan"""
         if self._client is None:
-            self._client = httpx.AsyncClient(timeout=30.0)
+            self._client = get_http_client()
+            if self._client is None:
+                self._client = httpx.AsyncClient(timeout=self._timeout)
+                self._owns_client = True
         return self._client
     
+    async def _get(self, url: str) -> httpx.Response:
+        """GET via circuit breaker (timeout adaptativo, retry com backoff)"""
+        client = await self._get_client()
+        return await self._breaker.call(
+            lambda: client.get(url, headers=self._get_headers(), timeout=self._timeout),
+            is_failure=_is_retryable,
+            operation="get"
+        )
+    
+    def _cached(self, key: str) -> Optional[Dict[str, Any]]:
+        return _account_cache.get(self.account_id, {}).get(key)
+    
+    def _store(self, key: str, value: Dict[str, Any]):
+        _account_cache.setdefault(self.account_id, {})[key] = value
+    
+    def _flight_key(self, operation: str) -> tuple:
+        return (operation, self.account_id, self.api_token)
+    
     async def test_connection(self) -> Dict[str, Any]:
         """Testa a conexão com MetaAPI"""
+        return await _flights.do(self._flight_key("test_connection"), self._test_connection)
+    
+    async def _test_connection(self) -> Dict[str, Any]:
         if not self.api_token or not self.account_id:
             return {
                 "success": False,
@@ -53,15 +172,13 @@ class MetaAPIService:
             }
         
         try:
-            client = await self._get_client()
-            
             # Buscar informações da conta
-            url = f"{self.BASE_URL}/users/current/accounts/{self.account_id}"
-            response = await client.get(url, headers=self._get_headers())
+            url = f"{self.base_url}/users/current/accounts/{self.account_id}"
+            response = await self._get(url)
             
             if response.status_code == 200:
                 data = response.json()
-                return {
+                result = {
                     "success": True,
                     "message": "✅ Conectado ao MetaAPI com sucesso!",
                     "account": {
@@ -72,6 +189,8 @@ class MetaAPIService:
                         "state": data.get("state")
                     }
                 }
+                self._store("account", result["account"])
+                return result
             elif response.status_code == 401:
                 return {
                     "success": False,
@@ -88,7 +207,20 @@ class MetaAPIService:
                     "message": f"❌ Erro na API: {response.status_code}"
                 }
                 
-        except httpx.TimeoutException:
+        except CircuitOpenError as e:
+            cached = self._cached("account")
+            if cached:
+                return {
+                    "success": True,
+                    "stale": True,
+                    "message": "⚠️ MetaAPI instável, exibindo os últimos dados conhecidos da conta",
+                    "account": cached
+                }
+            return {
+                "success": False,
+                "message": f"❌ MetaAPI temporariamente indisponível. Tente novamente em {e.retry_in:.0f}s."
+            }
+        except (httpx.TimeoutException, asyncio.TimeoutError):
             return {
                 "success": False,
                 "message": "❌ Timeout na conexão. Tente novamente."
@@ -100,16 +232,26 @@ class MetaAPIService:
             }
     
     async def get_account_info(self) -> Dict[str, Any]:
-        """Busca informações da conta MT5"""
+        """Busca informações da conta MT5 (cache curto + chamadas coalescidas)"""
+        key = self._flight_key("account_info")
+        cached = _account_info_cache.get(key)
+        if cached is not None:
+            metrics.inc("metaapi.account_info.cache_hit")
+            return cached
+        
+        result = await _flights.do(key, self._get_account_info)
+        if result.get("success") and not result.get("stale"):
+            _account_info_cache.set(key, result)
+        return result
+    
+    async def _get_account_info(self) -> Dict[str, Any]:
         try:
-            client = await self._get_client()
-            
-            url = f"{self.BASE_URL}/users/current/accounts/{self.account_id}/account-information"
-            response = await client.get(url, headers=self._get_headers())
+            url = f"{self.base_url}/users/current/accounts/{self.account_id}/account-information"
+            response = await self._get(url)
             
             if response.status_code == 200:
                 data = response.json()
-                return {
+                result = {
                     "success": True,
                     "balance": data.get("balance"),
                     "equity": data.get("equity"),
@@ -119,106 +261,196 @@ class MetaAPIService:
                     "currency": data.get("currency"),
                     "leverage": data.get("leverage")
                 }
+                self._store("account_information", result)
+                return result
             else:
                 return {"success": False, "message": f"Erro: {response.status_code}"}
                 
+        except CircuitOpenError as e:
+            cached = self._cached("account_information")
+            if cached:
+                return {**cached, "stale": True}
+            return {"success": False, "message": str(e)}
         except Exception as e:
             return {"success": False, "message": str(e)}
     
+    def _history_windows(self, start_time: datetime, end_time: datetime) -> List[tuple]:
+        """Divide o período em janelas de `metaapi_history_window_days`"""
+        step = timedelta(days=self._window_days)
+        windows = []
+        window_start = start_time
+        while window_start < end_time:
+            window_end = min(window_start + step, end_time)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        return windows
+    
+    def _window_url(self, start_time: datetime, end_time: datetime) -> str:
+        return f"{self.base_url}/users/current/accounts/{self.account_id}/history-deals/time/{start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')}/{end_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')}"
+    
+    async def _open_stream(self, url: str) -> httpx.Response:
+        """Abre a resposta em modo streaming via circuit breaker (só status/headers)"""
+        client = await self._get_client()
+        
+        async def send():
+            request = client.build_request("GET", url, headers=self._get_headers(), timeout=self._timeout)
+            response = await client.send(request, stream=True)
+            if _is_retryable(response):
+                # Resposta descartada pelo retry: devolve a conexão ao pool
+                await response.aclose()
+            return response
+        
+        return await self._breaker.call(send, is_failure=_is_retryable, operation="history")
+    
+    async def _stream_window(self, start_time: datetime, end_time: datetime,
+                             semaphore: asyncio.Semaphore, queue: asyncio.Queue):
+        """Produz os deals de uma janela na fila, à medida que chegam da rede"""
+        try:
+            async with semaphore:
+                with metrics.timer("metaapi.history_window_seconds"):
+                    response = await self._open_stream(self._window_url(start_time, end_time))
+                    try:
+                        if response.status_code == 429:
+                            raise MetaAPIRateLimited(_retry_after(response))
+                        if response.status_code != 200:
+                            raise MetaAPIError(f"Erro ao buscar histórico: {response.status_code}")
+                        
+                        async for deal in iter_json_array(response.aiter_text()):
+                            await queue.put(deal)
+                    finally:
+                        await response.aclose()
+            await queue.put(_END_OF_WINDOW)
+        except Exception as e:
+            await queue.put(e)
+    
+    async def iter_deals(self, start_time: datetime, end_time: datetime) -> AsyncIterator[Dict]:
+        """
+        Deals do período em ordem, sem carregar a resposta inteira.
+        
+        As janelas são baixadas em paralelo, cada uma numa fila limitada,
+        e consumidas em sequência. Deals na fronteira entre duas janelas
+        (que a API devolve nas duas) são emitidos uma vez só.
+        """
+        semaphore = asyncio.Semaphore(self._concurrency)
+        windows = self._history_windows(start_time, end_time)
+        queues = [asyncio.Queue(maxsize=WINDOW_QUEUE_SIZE) for _ in windows]
+        # Criadas em ordem: o semáforo (FIFO) atende primeiro as janelas iniciais
+        tasks = [
+            asyncio.create_task(self._stream_window(ws, we, semaphore, queue))
+            for (ws, we), queue in zip(windows, queues)
+        ]
+        
+        try:
+            previous_boundary_ids = set()
+            for (_, window_end), queue in zip(windows, queues):
+                boundary = window_end.strftime("%Y-%m-%dT%H:%M:%S")
+                boundary_ids = set()
+                while True:
+                    item = await queue.get()
+                    if item is _END_OF_WINDOW:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    
+                    deal_id = item.get("id")
+                    if deal_id is not None:
+                        if deal_id in previous_boundary_ids:
+                            continue
+                        if (item.get("time") or "")[:19] >= boundary:
+                            boundary_ids.add(deal_id)
+                    yield item
+                previous_boundary_ids = boundary_ids
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def stream_trades(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        book: Optional[PositionBook] = None,
+        batch_size: int = TRADE_BATCH_SIZE,
+        stats: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[List[Dict]]:
+        """
+        Pareia os deals conforme chegam e emite os trades fechados em lotes.
+        
+        A memória fica proporcional às posições abertas, não ao total de
+        deals. `book` (posições abertas carregadas de syncs anteriores) e
+        `stats` (total_deals, last_deal_id) são atualizados in-place.
+        """
+        book = book or PositionBook()
+        stats = {} if stats is None else stats
+        stats.setdefault("total_deals", 0)
+        batch = []
+        
+        async for deal in self.iter_deals(start_time, end_time):
+            stats["total_deals"] += 1
+            stats["last_deal_id"] = deal.get("id", stats.get("last_deal_id"))
+            batch.extend(book.apply_metaapi(deal))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        
+        stats["unmatched_exits"] = book.unmatched_exits
+        if batch:
+            yield batch
+    
     async def get_history(self, days: int = 30) -> Dict[str, Any]:
         """
         Busca histórico de trades dos últimos X dias
         """
+        end_time = datetime.utcnow()
+        return await self.get_history_range(end_time - timedelta(days=days), end_time)
+    
+    async def get_history_range(
+        self,
+        start_time: datetime,
+        end_time: datetime,
+        open_positions: Optional[Dict[str, Dict]] = None
+    ) -> Dict[str, Any]:
+        """
+        Busca os trades fechados no período (lista completa em memória;
+        para históricos grandes use stream_trades).
+        
+        `open_positions` (entradas ainda sem saída de syncs anteriores) é
+        atualizado in-place, permitindo parear saídas de posições abertas
+        antes do início do período.
+        """
+        stats = {}
+        trades = []
         try:
-            client = await self._get_client()
-            
-            # Calcular período
-            end_time = datetime.utcnow()
-            start_time = end_time - timedelta(days=days)
-            
-            # Endpoint de histórico
-            url = f"{self.BASE_URL}/users/current/accounts/{self.account_id}/history-deals/time/{start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')}/{end_time.strftime('%Y-%m-%dT%H:%M:%S.000Z')}"
-            
-            response = await client.get(url, headers=self._get_headers())
-            
-            if response.status_code == 200:
-                deals = response.json()
-                
-                # Processar deals em trades
-                trades = self._process_deals_to_trades(deals)
-                
-                return {
-                    "success": True,
-                    "trades": trades,
-                    "total_deals": len(deals),
-                    "total_trades": len(trades)
-                }
-            else:
-                return {
-                    "success": False,
-                    "message": f"Erro ao buscar histórico: {response.status_code}",
-                    "trades": []
-                }
-                
+            async for batch in self.stream_trades(start_time, end_time, PositionBook(open_positions), stats=stats):
+                trades.extend(batch)
         except Exception as e:
-            return {
-                "success": False,
-                "message": str(e),
-                "trades": []
-            }
+            return history_error(e)
+        
+        return {
+            "success": True,
+            "trades": trades,
+            "total_deals": stats["total_deals"],
+            "total_trades": len(trades),
+            "last_deal_id": stats.get("last_deal_id")
+        }
     
-    def _process_deals_to_trades(self, deals: List[Dict]) -> List[Dict]:
+    def _process_deals_to_trades(self, deals: Iterable[Dict], positions: Optional[Dict[str, Dict]] = None) -> List[Dict]:
         """
         Processa deals da MetaAPI em trades completos
-        Agrupa entrada e saída de cada posição
+        (pareamento FIFO compartilhado em app.services.positions)
         """
-        positions = {}
+        book = PositionBook(positions)
         trades = []
-        
         for deal in deals:
-            # Pular deals que não são trade (depósito, saque, etc)
-            if deal.get("type") not in ["DEAL_TYPE_BUY", "DEAL_TYPE_SELL"]:
-                continue
-            
-            position_id = deal.get("positionId")
-            entry_type = deal.get("entryType")  # DEAL_ENTRY_IN, DEAL_ENTRY_OUT
-            
-            if entry_type == "DEAL_ENTRY_IN":
-                # Abertura de posição
-                positions[position_id] = {
-                    "symbol": deal.get("symbol"),
-                    "type": "BUY" if deal.get("type") == "DEAL_TYPE_BUY" else "SELL",
-                    "volume": deal.get("volume"),
-                    "entry_price": deal.get("price"),
-                    "open_time": deal.get("time"),
-                    "commission": deal.get("commission", 0),
-                }
-            elif entry_type == "DEAL_ENTRY_OUT" and position_id in positions:
-                # Fechamento de posição
-                pos = positions.pop(position_id)
-                pos["exit_price"] = deal.get("price")
-                pos["close_time"] = deal.get("time")
-                pos["profit"] = deal.get("profit", 0)
-                pos["swap"] = deal.get("swap", 0)
-                pos["commission"] = pos.get("commission", 0) + deal.get("commission", 0)
-                
-                # Calcular duração
-                try:
-                    open_dt = datetime.fromisoformat(pos["open_time"].replace("Z", "+00:00"))
-                    close_dt = datetime.fromisoformat(pos["close_time"].replace("Z", "+00:00"))
-                    pos["duration_minutes"] = int((close_dt - open_dt).total_seconds() / 60)
-                except:
-                    pos["duration_minutes"] = 0
-                
-                trades.append(pos)
-        
+            trades.extend(book.apply_metaapi(deal))
         return trades
     
     async def close(self):
-        """Fecha a conexão HTTP"""
-        if self._client:
+        """Fecha a conexão HTTP (o cliente compartilhado só é devolvido)"""
+        if self._client and self._owns_client:
             await self._client.aclose()
-            self._client = None
+        self._client = None
+        self._owns_client = False
 
 
 def get_setup_instructions() -> Dict[str, Any]:
@@ -2,18 +2,61 @@
 MetaTrader 5 Integration Service
 
 Requires MetaTrader 5 terminal installed on Windows.
-For Mac/Linux, you can use Wine or a Windows VM.
+For Mac/Linux, you can use Wine or a Windows VM, or set MT5_USE_STUB=true
+to run against the synthetic terminal in app.services.mt5_stub.
+
+The MetaTrader5 package is blocking and not thread-safe, so every call runs
+on one dedicated worker thread (never on the event loop), with a timeout.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict, Any
 import asyncio
+import functools
+
+from app.config import get_settings
+from app.services.positions import PositionBook, parse_time
+from app.utils.metrics import metrics
+
+# Uma única thread: a API do MT5 é global por processo e não é thread-safe
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mt5")
+
+
+class MetaTraderTimeout(Exception):
+    pass
+
+
+def _load_mt5():
+    settings = get_settings()
+    if settings.mt5_use_stub:
+        from app.services import mt5_stub
+        mt5_stub.configure(
+            deals_per_day=settings.mt5_stub_deals_per_day,
+            latency_seconds=settings.mt5_stub_latency_ms / 1000
+        )
+        return mt5_stub
+    import MetaTrader5
+    return MetaTrader5
 
 
 class MetaTraderService:
     def __init__(self):
         self._connected = False
         self._mt5 = None
+        self._timeout = get_settings().mt5_timeout_seconds
+    
+    async def _call(self, name: str, *args, **kwargs):
+        """Runs mt5.<name>(...) on the MT5 thread, failing after mt5_timeout_seconds"""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(getattr(self._mt5, name), *args, **kwargs)
+        try:
+            with metrics.timer(f"mt5.{name}_seconds"):
+                return await asyncio.wait_for(loop.run_in_executor(_executor, call), timeout=self._timeout)
+        except asyncio.TimeoutError:
+            # A chamada continua presa na thread do MT5; só o chamador é liberado
+            metrics.inc("mt5.timeouts")
+            raise MetaTraderTimeout(f"MetaTrader 5 não respondeu em {self._timeout:g}s ({name})")
     
     async def connect(self, login: int, password: str, server: str) -> dict:
         """
@@ -25,7 +68,7 @@ class MetaTraderService:
         import platform
         
         # Check if running on Windows
-        if platform.system() != "Windows":
+        if platform.system() != "Windows" and not get_settings().mt5_use_stub:
             return {
                 "success": False,
                 "is_mock": True,
@@ -39,19 +82,19 @@ class MetaTraderService:
         
         try:
             # Try to import MT5 (only works on Windows)
-            import MetaTrader5 as mt5
-            self._mt5 = mt5
+            self._mt5 = _load_mt5()
             
             # Initialize
-            if not mt5.initialize():
+            if not await self._call("initialize"):
                 return {
                     "success": False,
                     "is_mock": False,
-                    "message": f"❌ Falha ao inicializar MT5: {mt5.last_error()}"
+                    "message": f"❌ Falha ao inicializar MT5: {await self._call('last_error')}"
                 }
             
             # Login
-            authorized = mt5.login(
+            authorized = await self._call(
+                "login",
                 login=login,
                 password=password,
                 server=server
@@ -59,7 +102,7 @@ class MetaTraderService:
             
             if authorized:
                 self._connected = True
-                account = mt5.account_info()
+                account = await self._call("account_info")
                 return {
                     "success": True,
                     "is_mock": False,
@@ -74,7 +117,7 @@ class MetaTraderService:
                 return {
                     "success": False,
                     "is_mock": False,
-                    "message": f"❌ Falha no login: {mt5.last_error()}"
+                    "message": f"❌ Falha no login: {await self._call('last_error')}"
                 }
                 
         except ImportError:
@@ -83,6 +126,9 @@ class MetaTraderService:
                 "is_mock": True,
                 "message": "❌ Biblioteca MetaTrader5 não instalada. Instale com: pip install MetaTrader5"
             }
+        except MetaTraderTimeout:
+            # Terminal travado: o chamador responde 504, como nas demais chamadas
+            raise
         except Exception as e:
             return {
                 "success": False,
@@ -93,7 +139,7 @@ class MetaTraderService:
     async def disconnect(self):
         """Disconnect from MT5"""
         if self._mt5:
-            self._mt5.shutdown()
+            await self._call("shutdown")
         self._connected = False
     
     async def is_connected(self) -> bool:
@@ -107,7 +153,7 @@ class MetaTraderService:
         
         try:
             if self._mt5:
-                info = self._mt5.account_info()
+                info = await self._call("account_info")
                 if info:
                     return {
                         "login": info.login,
@@ -136,11 +182,19 @@ class MetaTraderService:
             "currency": "USD"
         }
     
-    async def get_history(self, from_date: datetime, to_date: datetime = None) -> List[Dict[str, Any]]:
+    async def get_history(
+        self,
+        from_date: datetime,
+        to_date: datetime = None,
+        open_positions: Optional[Dict[str, Dict[str, Any]]] = None,
+        book: Optional[PositionBook] = None
+    ) -> List[Dict[str, Any]]:
         """
         Get trading history from MT5.
         
-        Returns list of closed trades.
+        Returns list of closed trades. `open_positions` (or a PositionBook
+        built from it) carries entries still open from a previous sync and
+        is updated in place.
         """
         if to_date is None:
             to_date = datetime.now()
@@ -148,40 +202,38 @@ class MetaTraderService:
         try:
             if self._mt5:
                 # Get deals from history
-                deals = self._mt5.history_deals_get(from_date, to_date)
+                deals = await self._call("history_deals_get", from_date, to_date)
                 
                 if deals is None:
-                    print(f"No deals found: {self._mt5.last_error()}")
+                    print(f"No deals found: {await self._call('last_error')}")
                     return []
                 
+                book = book or PositionBook(open_positions)
                 trades = []
-                positions = {}
                 
                 for deal in deals:
-                    if deal.type in [0, 1]:  # BUY or SELL
-                        pos_id = deal.position_id
-                        
-                        if deal.entry == 0:  # Entry
-                            positions[pos_id] = {
-                                "ticket": deal.ticket,
-                                "symbol": deal.symbol,
-                                "type": "BUY" if deal.type == 0 else "SELL",
-                                "volume": deal.volume,
-                                "price_open": deal.price,
-                                "time_open": datetime.fromtimestamp(deal.time),
-                                "commission": deal.commission,
-                            }
-                        elif deal.entry == 1:  # Exit
-                            if pos_id in positions:
-                                pos = positions[pos_id]
-                                pos["price_close"] = deal.price
-                                pos["time_close"] = datetime.fromtimestamp(deal.time)
-                                pos["profit"] = deal.profit
-                                pos["swap"] = deal.swap
-                                trades.append(pos)
+                    for trade in book.apply_mt5(deal):
+                        trades.append({
+                            "ticket": trade["entry_deal_id"],
+                            "exit_ticket": trade["exit_deal_id"],
+                            "partial": trade["partial"],
+                            "symbol": trade["symbol"],
+                            "type": trade["type"],
+                            "volume": trade["volume"],
+                            "price_open": trade["entry_price"],
+                            "price_close": trade["exit_price"],
+                            "time_open": parse_time(trade["open_time"]),
+                            "time_close": parse_time(trade["close_time"]),
+                            "profit": trade["profit"],
+                            "swap": trade["swap"],
+                            "commission": trade["commission"],
+                        })
                 
                 return trades
-                
+        
+        except MetaTraderTimeout:
+            # Não cair nos dados de exemplo: o sync importaria trades falsos
+            raise
         except Exception as e:
             print(f"Error getting MT5 history: {e}")
         
@@ -251,7 +303,7 @@ class MetaTraderService:
         
         try:
             if self._mt5:
-                positions = self._mt5.positions_get()
+                positions = await self._call("positions_get")
                 if positions:
                     return [
                         {
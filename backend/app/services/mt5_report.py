@@ -0,0 +1,317 @@
+"""
+Import of MetaTrader 5 history reports (Toolbox > History > Report).
+
+Supports the XML (Excel 2003 SpreadsheetML) and HTML report formats.
+Both are read incrementally in fixed-size chunks and each row is dropped
+once handed over (XML through an expat target, HTML through a rolling
+buffer cut at </tr>), so memory stays flat regardless of report size
+(multi-year reports can be hundreds of MB). No DOM is ever built.
+
+Only the "Deals" section is used. Its rows go through the shared
+PositionBook; the report has no position ids, so deals are matched FIFO
+per symbol (exact for netting accounts, FIFO approximation for hedging).
+"""
+
+from datetime import datetime
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+import codecs
+import html
+import re
+import xml.etree.ElementTree as ET
+
+from app.services.positions import PositionBook, IN, OUT, INOUT, parse_time
+
+READ_SIZE = 256 * 1024
+
+_SS = "{urn:schemas-microsoft-com:office:spreadsheet}"
+_ROW, _CELL = f"{_SS}Row", f"{_SS}Cell"
+_INDEX, _MERGE_ACROSS = f"{_SS}Index", f"{_SS}MergeAcross"
+
+_HTML_ROW_END = re.compile(r"</tr\s*>", re.I)
+_HTML_CELL = re.compile(r"<t[dh]\b([^>]*)>(.*?)</t[dh]\s*>", re.I | re.S)
+_HTML_TAG = re.compile(r"<[^>]+>")
+_HTML_COLSPAN = re.compile(r"colspan\s*=\s*[\"']?(\d+)", re.I)
+
+# Cabeçalho da seção Deals (terminal em inglês ou português)
+_DEAL_COLUMNS = {
+    "time": {"time", "horário", "horario", "hora", "data"},
+    "deal": {"deal", "negócio", "negocio", "ticket", "oferta"},
+    "symbol": {"symbol", "ativo", "símbolo", "simbolo"},
+    "type": {"type", "tipo"},
+    "direction": {"direction", "direção", "direcao"},
+    "volume": {"volume"},
+    "price": {"price", "preço", "preco"},
+    "commission": {"commission", "comissão", "comissao"},
+    "fee": {"fee", "taxa"},
+    "swap": {"swap"},
+    "profit": {"profit", "lucro", "resultado"},
+    "position": {"position", "posição", "posicao"},
+}
+_ALIASES = {alias: key for key, aliases in _DEAL_COLUMNS.items() for alias in aliases}
+_REQUIRED = ("time", "deal", "symbol", "type", "direction", "volume", "price")
+
+_SIDES = {"buy": "BUY", "sell": "SELL", "compra": "BUY", "venda": "SELL"}
+_DIRECTIONS = {
+    "in": IN, "entrada": IN,
+    "out": OUT, "saída": OUT, "saida": OUT, "out by": OUT,
+    "in/out": INOUT, "in out": INOUT,
+}
+_TIME_FORMATS = ("%Y.%m.%d %H:%M:%S", "%Y.%m.%d %H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S")
+
+
+class ReportFormatError(ValueError):
+    pass
+
+
+class _XmlRowTarget:
+    """Parser target collecting SpreadsheetML <Row> cell texts (no tree is built)"""
+
+    def __init__(self):
+        self.rows: List[List[str]] = []
+        self._row: Optional[List[str]] = None
+        self._text: Optional[List[str]] = None
+        self._merge = 0
+
+    def start(self, tag, attrib):
+        if tag == _ROW:
+            self._row = []
+        elif tag == _CELL and self._row is not None:
+            index = attrib.get(_INDEX)
+            if index:
+                # Células vazias omitidas: ss:Index é a posição (1-based)
+                self._row.extend([""] * (int(index) - 1 - len(self._row)))
+            self._merge = int(attrib.get(_MERGE_ACROSS) or 0)
+            self._text = []
+
+    def data(self, text):
+        if self._text is not None:
+            self._text.append(text)
+
+    def end(self, tag):
+        if tag == _CELL and self._text is not None:
+            self._row.append("".join(self._text).strip())
+            self._row.extend([""] * self._merge)
+            self._text = None
+        elif tag == _ROW and self._row is not None:
+            self.rows.append(self._row)
+            self._row = None
+
+    def close(self):
+        return None
+
+
+def iter_xml_rows(stream: IO[bytes]) -> Iterator[List[str]]:
+    """
+    Cell texts of each SpreadsheetML <Row>.
+
+    Incremental parse (like iterparse, but with a target instead of a tree):
+    each chunk's completed rows are yielded and dropped, so memory stays
+    flat and no per-element objects are created.
+    """
+    target = _XmlRowTarget()
+    parser = ET.XMLParser(target=target)
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from target.rows
+        target.rows.clear()
+    parser.close()
+    yield from target.rows
+
+
+def _html_cells(fragment: str) -> List[str]:
+    cells: List[str] = []
+    for attrs, inner in _HTML_CELL.findall(fragment):
+        cells.append(" ".join(html.unescape(_HTML_TAG.sub("", inner)).split()))
+        colspan = _HTML_COLSPAN.search(attrs)
+        if colspan:
+            cells.extend([""] * (int(colspan.group(1)) - 1))
+    return cells
+
+
+def iter_html_rows(stream: IO[bytes]) -> Iterator[List[str]]:
+    """
+    Table rows of an HTML report (cell texts, colspan expanded).
+
+    The report is machine-generated and regular, so rows are cut at each
+    </tr> from a rolling text buffer and their cells extracted with regexes;
+    only the unfinished tail of the current chunk is kept in memory.
+    """
+    head = stream.read(READ_SIZE)
+    # O MT5 grava relatórios HTML em UTF-16 (com BOM)
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        encoding = "utf-16"
+    else:
+        encoding = "utf-8-sig"
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    buffer = ""
+    chunk = head
+    while chunk:
+        buffer += decoder.decode(chunk)
+        rows = _HTML_ROW_END.split(buffer)
+        buffer = rows.pop()
+        for row in rows:
+            yield _html_cells(row)
+        chunk = stream.read(READ_SIZE)
+    buffer += decoder.decode(b"", final=True)
+    if _HTML_CELL.search(buffer):
+        yield _html_cells(buffer)
+
+
+def _header_map(cells: List[str]) -> Optional[Dict[str, int]]:
+    mapping: Dict[str, int] = {}
+    for i, cell in enumerate(cells):
+        key = _ALIASES.get(cell.strip().lower().rstrip(":"))
+        if key is not None and key not in mapping:
+            mapping[key] = i
+    return mapping if all(key in mapping for key in _REQUIRED) else None
+
+
+def _number(value: str) -> float:
+    value = value.replace("\xa0", "").replace(" ", "")
+    if "," in value and "." not in value:
+        value = value.replace(",", ".")
+    return float(value) if value else 0.0
+
+
+def _time(value: str) -> Optional[datetime]:
+    value = value.strip()
+    if len(value) == 19 and value[4] == "." and value[13] == ":":
+        # Formato do MT5 (2024.01.15 09:30:00) sem passar pelo strptime
+        try:
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                            int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        except ValueError:
+            return None
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def iter_deals(rows: Iterator[List[str]]) -> Iterator[Dict[str, Any]]:
+    """Deal rows of the "Deals" section (other sections and balance rows are skipped)"""
+    columns = None
+    for cells in rows:
+        # Linhas de negócio começam pela data; só as demais podem ser cabeçalho
+        if not (cells and cells[0][:1].isdigit()):
+            header = _header_map(cells)
+            if header is not None:
+                columns = header
+            continue
+        if columns is None or len(cells) <= max(columns[key] for key in _REQUIRED):
+            continue
+
+        get = lambda key: cells[columns[key]] if key in columns and columns[key] < len(cells) else ""
+        side = _SIDES.get(get("type").lower())
+        entry = _DIRECTIONS.get(get("direction").lower())
+        time = _time(get("time"))
+        if side is None or entry is None or time is None:
+            # Depósitos, totais e linhas de resumo
+            continue
+        try:
+            yield {
+                "deal": get("deal"),
+                "time": time,
+                "symbol": get("symbol").upper(),
+                "side": side,
+                "entry": entry,
+                "volume": _number(get("volume")),
+                "price": _number(get("price")),
+                "commission": _number(get("commission")) + _number(get("fee")),
+                "swap": _number(get("swap")),
+                "profit": _number(get("profit")),
+                "position": get("position"),
+            }
+        except ValueError:
+            continue
+
+
+def report_format(filename: str, head: bytes) -> str:
+    name = (filename or "").lower()
+    if name.endswith(".xml"):
+        return "xml"
+    if name.endswith((".html", ".htm")):
+        return "html"
+    sample = head.lstrip(codecs.BOM_UTF8)[:200]
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)) or b"<html" in sample.lower():
+        return "html"
+    if sample.startswith(b"<?xml"):
+        return "xml"
+    raise ReportFormatError("Formato não reconhecido: envie o relatório do MT5 em XML ou HTML")
+
+
+def iter_report_trades(
+    stream: IO[bytes],
+    filename: str = "",
+    stats: Optional[Dict[str, Any]] = None,
+    batch_size: int = 5000
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Reads a report and yields the closed trades rebuilt from its deals, in
+    batches (MetaTraderService.get_history format).
+
+    `stats` (if given) is filled with format, deal count, positions left
+    open and unmatched exits. Blocking: drive it from a worker thread.
+    """
+    stats = {} if stats is None else stats
+    head = stream.read(512)
+    stream.seek(0)
+    stats["format"] = fmt = report_format(filename, head)
+    rows = iter_xml_rows(stream) if fmt == "xml" else iter_html_rows(stream)
+
+    book = PositionBook()
+    batch: List[Dict[str, Any]] = []
+    deals = 0
+    try:
+        for deal in iter_deals(rows):
+            deals += 1
+            closed = book.apply(
+                deal["position"] or deal["symbol"],
+                deal["symbol"],
+                deal["side"],
+                deal["entry"],
+                deal["volume"],
+                deal["price"],
+                deal["time"].isoformat(),
+                deal_id=deal["deal"],
+                commission=deal["commission"],
+                swap=deal["swap"],
+                profit=deal["profit"],
+            )
+            for trade in closed:
+                batch.append({
+                    "ticket": trade["entry_deal_id"],
+                    "exit_ticket": trade["exit_deal_id"],
+                    "partial": trade["partial"],
+                    "symbol": trade["symbol"],
+                    "type": trade["type"],
+                    "volume": trade["volume"],
+                    "price_open": trade["entry_price"],
+                    "price_close": trade["exit_price"],
+                    "time_open": parse_time(trade["open_time"]),
+                    "time_close": parse_time(trade["close_time"]),
+                    "profit": trade["profit"],
+                    "swap": trade["swap"],
+                    "commission": trade["commission"],
+                })
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    except ET.ParseError as e:
+        raise ReportFormatError(f"XML inválido: {e}")
+
+    if deals == 0:
+        raise ReportFormatError("Seção de negócios (Deals) não encontrada no relatório")
+    if batch:
+        yield batch
+
+    stats.update(
+        deals=deals,
+        open_positions=len(book.positions),
+        unmatched_exits=book.unmatched_exits,
+    )
@@ -0,0 +1,160 @@
+"""
+Pure-Python stand-in for the `MetaTrader5` package.
+
+Implements the subset of the terminal API used by MetaTraderService
+(initialize, login, shutdown, last_error, account_info, history_deals_get,
+positions_get) on top of a deterministic synthetic deal store, so the MT5
+sync path can run and be benchmarked on Linux. Enabled with MT5_USE_STUB=true.
+
+Deals are generated per day from a seeded RNG, so repeated or overlapping
+queries return the same deals (like a real account history). Positions
+open and close within the day; some close in two partial exits.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+import random
+import time
+
+DEAL_TYPE_BUY = 0
+DEAL_TYPE_SELL = 1
+DEAL_ENTRY_IN = 0
+DEAL_ENTRY_OUT = 1
+DEAL_ENTRY_INOUT = 2
+DEAL_ENTRY_OUT_BY = 3
+
+TradeDeal = namedtuple(
+    "TradeDeal",
+    "ticket order time time_msc type entry magic position_id reason volume price commission swap profit fee symbol comment external_id",
+)
+AccountInfo = namedtuple(
+    "AccountInfo",
+    "login name server balance equity profit margin margin_free currency leverage",
+)
+TradePosition = namedtuple(
+    "TradePosition",
+    "ticket time type volume price_open price_current profit swap symbol",
+)
+
+SYMBOLS = {"EURUSD": 1.10, "GBPUSD": 1.27, "WINZ24": 130000.0, "PETR4": 38.0}
+
+
+class DealStore:
+    def __init__(self, deals_per_day: int = 20, seed: int = 42, latency_seconds: float = 0.0):
+        self.deals_per_day = deals_per_day
+        self.seed = seed
+        self.latency_seconds = latency_seconds
+
+    def _day(self, day: datetime) -> List[TradeDeal]:
+        if day.weekday() >= 5:
+            return []
+        ordinal = day.toordinal()
+        rnd = random.Random(self.seed * 1_000_003 + ordinal)
+        deals = []
+        for i in range(max(1, self.deals_per_day // 2)):
+            position_id = ordinal * 10_000 + i
+            symbol = rnd.choice(list(SYMBOLS))
+            side = rnd.choice((DEAL_TYPE_BUY, DEAL_TYPE_SELL))
+            exit_side = DEAL_TYPE_SELL if side == DEAL_TYPE_BUY else DEAL_TYPE_BUY
+            volume = rnd.choice((1.0, 2.0, 4.0))
+            price = SYMBOLS[symbol] * rnd.uniform(0.98, 1.02)
+            opened = day + timedelta(hours=9, seconds=rnd.randint(0, 8 * 3600))
+            closed = opened + timedelta(minutes=rnd.randint(1, 90))
+
+            deals.append(self._deal(position_id, 0, opened, side, DEAL_ENTRY_IN, volume, price, symbol, 0.0))
+            exits = [volume / 2, volume / 2] if rnd.random() < 0.2 else [volume]
+            for k, exit_volume in enumerate(exits, start=1):
+                exit_price = price * rnd.uniform(0.995, 1.005)
+                direction = 1 if side == DEAL_TYPE_BUY else -1
+                profit = round((exit_price - price) * direction * exit_volume * 100, 2)
+                deals.append(self._deal(
+                    position_id, k, closed + timedelta(minutes=k - 1), exit_side,
+                    DEAL_ENTRY_OUT, exit_volume, exit_price, symbol, profit
+                ))
+        deals.sort(key=lambda d: d.time)
+        return deals
+
+    def _deal(self, position_id, k, when, side, entry, volume, price, symbol, profit) -> TradeDeal:
+        ts = int(when.timestamp())
+        return TradeDeal(
+            ticket=position_id * 10 + k, order=position_id * 10 + k, time=ts, time_msc=ts * 1000,
+            type=side, entry=entry, magic=0, position_id=position_id, reason=0, volume=volume,
+            price=round(price, 5), commission=-0.5 * volume, swap=0.0, profit=profit, fee=0.0,
+            symbol=symbol, comment="", external_id="",
+        )
+
+    def deals_between(self, date_from: datetime, date_to: datetime) -> Tuple[TradeDeal, ...]:
+        start_ts, end_ts = date_from.timestamp(), date_to.timestamp()
+        day = datetime(date_from.year, date_from.month, date_from.day)
+        deals = []
+        while day <= date_to:
+            deals.extend(d for d in self._day(day) if start_ts <= d.time <= end_ts)
+            day += timedelta(days=1)
+        return tuple(deals)
+
+
+store = DealStore()
+_state = {"initialized": False, "login": None, "server": None, "error": (1, "Success")}
+
+
+def configure(deals_per_day: int = None, seed: int = None, latency_seconds: float = None):
+    """Adjusts the synthetic store (deals per day, RNG seed, simulated terminal latency)"""
+    if deals_per_day is not None:
+        store.deals_per_day = deals_per_day
+    if seed is not None:
+        store.seed = seed
+    if latency_seconds is not None:
+        store.latency_seconds = latency_seconds
+
+
+def _blocking_call():
+    # O terminal real bloqueia a thread chamadora; simula isso
+    if store.latency_seconds:
+        time.sleep(store.latency_seconds)
+
+
+def initialize(*args, **kwargs) -> bool:
+    _blocking_call()
+    _state["initialized"] = True
+    return True
+
+
+def login(login: int, password: str = "", server: str = "", timeout: int = 60000) -> bool:
+    _blocking_call()
+    if not _state["initialized"]:
+        _state["error"] = (-10004, "No IPC connection")
+        return False
+    _state["login"], _state["server"] = login, server
+    return True
+
+
+def shutdown():
+    _state.update(initialized=False, login=None, server=None)
+
+
+def last_error() -> Tuple[int, str]:
+    return _state["error"]
+
+
+def account_info() -> Optional[AccountInfo]:
+    _blocking_call()
+    if not _state["login"]:
+        return None
+    return AccountInfo(
+        login=_state["login"], name="Stub Account", server=_state["server"], balance=10000.0,
+        equity=10000.0, profit=0.0, margin=0.0, margin_free=10000.0, currency="USD", leverage=100,
+    )
+
+
+def history_deals_get(date_from: datetime, date_to: datetime, group: str = None) -> Optional[Tuple[TradeDeal, ...]]:
+    _blocking_call()
+    if not _state["login"]:
+        _state["error"] = (-10004, "No IPC connection")
+        return None
+    return store.deals_between(date_from, date_to)
+
+
+def positions_get(*args, **kwargs) -> Tuple[TradePosition, ...]:
+    _blocking_call()
+    return ()
@@ -0,0 +1,239 @@
+"""
+Deal-to-trade reconstruction shared by the broker integrations.
+
+Deals are applied in time order in a single pass. Each open position keeps
+its entry lots in FIFO order, so:
+
+- scale-ins (several IN deals) add lots;
+- every exit deal (OUT / OUT_BY, full or partial) consumes lots FIFO and
+  produces one trade with the volume-weighted entry price of what it closed;
+- an INOUT reversal closes the open volume and opens the excess on the
+  opposite side under the same position id.
+
+State is O(open positions) and lives in a plain JSON-serializable dict, so
+entries still open at the end of a sync are carried over to the next one.
+An optional `applied_deals` dict (deal id -> time) makes re-applying the
+deals of an overlapping fetch a no-op.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+IN = "IN"
+OUT = "OUT"
+INOUT = "INOUT"
+
+VOLUME_EPSILON = 1e-9
+
+# Lot: [volume, price, time, commission, deal_id]
+_VOLUME, _PRICE, _TIME, _COMMISSION, _DEAL_ID = range(5)
+
+_METAAPI_ENTRIES = {
+    "DEAL_ENTRY_IN": IN,
+    "DEAL_ENTRY_OUT": OUT,
+    "DEAL_ENTRY_OUT_BY": OUT,
+    "DEAL_ENTRY_INOUT": INOUT,
+}
+_METAAPI_SIDES = {"DEAL_TYPE_BUY": "BUY", "DEAL_TYPE_SELL": "SELL"}
+
+# MetaTrader5: deal.type 0/1 = BUY/SELL; deal.entry 0 IN, 1 OUT, 2 INOUT, 3 OUT_BY
+_MT5_ENTRIES = {0: IN, 1: OUT, 2: INOUT, 3: OUT}
+_MT5_SIDES = {0: "BUY", 1: "SELL"}
+
+
+def parse_time(value) -> Optional[datetime]:
+    """ISO string (with or without 'Z') or datetime -> naive datetime"""
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).replace(tzinfo=None)
+
+
+def _from_legacy(pos: Dict[str, Any]) -> Dict[str, Any]:
+    """Converts single-entry state saved before lots existed"""
+    time = pos.get("open_time", pos.get("time_open"))
+    if isinstance(time, datetime):
+        time = time.isoformat()
+    return {
+        "symbol": pos.get("symbol"),
+        "side": pos.get("type"),
+        "lots": [[
+            pos.get("volume") or 0.0,
+            pos.get("entry_price", pos.get("price_open")),
+            time,
+            pos.get("commission") or 0.0,
+            pos.get("ticket"),
+        ]],
+        "exits": 0,
+    }
+
+
+class PositionBook:
+    """
+    Open positions keyed by position id (as string).
+
+    `positions` is used and updated in place, so callers can persist it
+    between calls.
+    """
+
+    def __init__(self, positions: Optional[Dict[str, Dict[str, Any]]] = None,
+                 applied_deals: Optional[Dict[str, str]] = None,
+                 remember_after: Optional[datetime] = None):
+        self.positions = {} if positions is None else positions
+        for key, pos in list(self.positions.items()):
+            if "lots" not in pos:
+                self.positions[key] = _from_legacy(pos)
+        self.applied_deals = applied_deals
+        # Só deals a partir daqui podem voltar numa busca sobreposta
+        self.remember_after = remember_after
+        self.unmatched_exits = 0
+        self.repeated_deals = 0
+
+    def apply(
+        self,
+        position_id,
+        symbol: str,
+        side: str,
+        entry: str,
+        volume: float,
+        price: float,
+        time: str,
+        deal_id=None,
+        commission: float = 0.0,
+        swap: float = 0.0,
+        profit: float = 0.0,
+    ) -> List[Dict[str, Any]]:
+        """Applies one deal; returns the trades it closed (usually zero or one)"""
+        if self.applied_deals is not None and deal_id is not None:
+            if str(deal_id) in self.applied_deals:
+                self.repeated_deals += 1
+                return []
+            if self.remember_after is None or parse_time(time) >= self.remember_after:
+                self.applied_deals[str(deal_id)] = time
+
+        key = str(position_id)
+        volume = float(volume or 0.0)
+
+        if entry == IN:
+            pos = self.positions.get(key)
+            if pos is None:
+                pos = self.positions[key] = {"symbol": symbol, "side": side, "lots": [], "exits": 0}
+            pos["lots"].append([volume, price, time, commission or 0.0, deal_id])
+            return []
+
+        pos = self.positions.get(key)
+        if pos is None or not pos["lots"]:
+            if entry == INOUT:
+                # Nada aberto para reverter: o deal inteiro abre a posição no seu lado
+                self.positions[key] = {
+                    "symbol": symbol,
+                    "side": side,
+                    "lots": [[volume, price, time, commission or 0.0, deal_id]],
+                    "exits": 0,
+                }
+                return []
+            # Entrada anterior ao período buscado e sem estado salvo
+            self.unmatched_exits += 1
+            return []
+
+        trade = self._close(key, pos, volume, price, time, deal_id, commission or 0.0, swap or 0.0, profit or 0.0)
+
+        if entry == INOUT and volume - trade["volume"] > VOLUME_EPSILON:
+            # Reversão: o excedente abre uma posição no lado do deal
+            self.positions[key] = {
+                "symbol": symbol,
+                "side": side,
+                "lots": [[volume - trade["volume"], price, time, 0.0, deal_id]],
+                "exits": 0,
+            }
+        return [trade]
+
+    def _close(self, key, pos, volume, price, time, deal_id, commission, swap, profit) -> Dict[str, Any]:
+        lots = pos["lots"]
+        remaining = volume
+        closed = cost = entry_commission = 0.0
+        first = lots[0]
+        open_time, entry_deal_id = first[_TIME], first[_DEAL_ID]
+
+        while lots and remaining > VOLUME_EPSILON:
+            lot = lots[0]
+            take = min(lot[_VOLUME], remaining)
+            share = take / lot[_VOLUME] if lot[_VOLUME] else 1.0
+            lot_commission = lot[_COMMISSION] * share
+            cost += take * lot[_PRICE]
+            entry_commission += lot_commission
+            lot[_COMMISSION] -= lot_commission
+            lot[_VOLUME] -= take
+            if lot[_VOLUME] <= VOLUME_EPSILON:
+                lots.pop(0)
+            remaining -= take
+            closed += take
+
+        pos["exits"] += 1
+        flat = not lots
+        if flat:
+            del self.positions[key]
+
+        open_dt, close_dt = parse_time(open_time), parse_time(time)
+        return {
+            "position_id": key,
+            "symbol": pos["symbol"],
+            "type": pos["side"],
+            "volume": closed,
+            "entry_price": cost / closed if closed else first[_PRICE],
+            "exit_price": price,
+            "open_time": open_time,
+            "close_time": time,
+            "profit": profit,
+            "swap": swap,
+            "commission": entry_commission + commission,
+            "duration_minutes": int((close_dt - open_dt).total_seconds() / 60) if open_dt and close_dt else 0,
+            "entry_deal_id": entry_deal_id,
+            "exit_deal_id": deal_id,
+            # Fechamento parcial (ou o último de vários): o ID externo precisa do deal de saída
+            "partial": not (flat and pos["exits"] == 1),
+        }
+
+    def forget_applied_before(self, cutoff: datetime):
+        """Drops deal ids older than `cutoff` (they can no longer be fetched again)"""
+        if self.applied_deals:
+            for deal_id in [d for d, t in self.applied_deals.items() if parse_time(t) < cutoff]:
+                del self.applied_deals[deal_id]
+
+    def apply_metaapi(self, deal: Dict[str, Any]) -> List[Dict[str, Any]]:
+        side = _METAAPI_SIDES.get(deal.get("type"))
+        entry = _METAAPI_ENTRIES.get(deal.get("entryType"))
+        if side is None or entry is None:
+            # Depósito, saque, crédito etc.
+            return []
+        return self.apply(
+            deal.get("positionId"),
+            deal.get("symbol"),
+            side,
+            entry,
+            deal.get("volume"),
+            deal.get("price"),
+            deal.get("time"),
+            deal_id=deal.get("id"),
+            commission=deal.get("commission", 0),
+            swap=deal.get("swap", 0),
+            profit=deal.get("profit", 0),
+        )
+
+    def apply_mt5(self, deal) -> List[Dict[str, Any]]:
+        side = _MT5_SIDES.get(deal.type)
+        entry = _MT5_ENTRIES.get(deal.entry)
+        if side is None or entry is None:
+            return []
+        return self.apply(
+            deal.position_id,
+            deal.symbol,
+            side,
+            entry,
+            deal.volume,
+            deal.price,
+            datetime.fromtimestamp(deal.time).isoformat(),
+            deal_id=deal.ticket,
+            commission=deal.commission,
+            swap=deal.swap,
+            profit=deal.profit,
+        )
@@ -0,0 +1,245 @@
+"""
+Background sync of registered MetaAPI accounts.
+
+Opt-in scheduler (METAAPI_SYNC_SCHEDULER_ENABLED=true) that keeps every
+account in `metaapi_accounts` fresh without request-time latency:
+
+- each account has its own due time, `interval + random jitter` after its
+  last sync, so thousands of accounts spread out instead of firing at once;
+- due accounts are dispatched round-robin across users, so one user with
+  many accounts cannot starve the others;
+- a fixed pool of async workers drains a bounded queue (the dispatcher
+  waits when it is full instead of piling up jobs);
+- jobs draw from a shared jobs-per-minute bucket, and a 429 from MetaAPI
+  (or its open circuit breaker) pauses the whole pool for Retry-After.
+
+Point METAAPI_BASE_URL to a local stub to exercise it offline.
+"""
+
+from datetime import datetime
+from itertools import chain, zip_longest
+from typing import Any, Dict, List, Optional
+import asyncio
+import random
+import time
+
+from sqlalchemy import select
+
+from app.config import get_settings
+from app.database import async_session, read_session
+from app.models.broker_account import MetaAPIAccount
+from app.services.sync_service import sync_metaapi_account
+from app.utils.metrics import metrics
+from app.utils.rate_limit import TokenBucket
+from app.utils.crypto import decrypt_secret, encrypt_secret, is_encrypted, SecretUnavailable
+from app.utils.resilience import get_breaker
+
+TICK_SECONDS = 5
+DEFAULT_RATE_LIMIT_PAUSE = 30.0
+
+
+def round_robin(accounts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Interleaves accounts user by user, keeping each user's own order"""
+    per_user: Dict[int, List[Dict[str, Any]]] = {}
+    for account in accounts:
+        per_user.setdefault(account["user_id"], []).append(account)
+    rounds = zip_longest(*per_user.values())
+    return [account for account in chain.from_iterable(rounds) if account is not None]
+
+
+class SyncScheduler:
+    def __init__(self, workers: int = None, interval_minutes: float = None,
+                 jitter_seconds: float = None, jobs_per_minute: int = None,
+                 session_factory=async_session, read_session_factory=read_session):
+        settings = get_settings()
+        self.workers = workers or settings.metaapi_sync_workers
+        self.interval = (interval_minutes or settings.metaapi_sync_interval_minutes) * 60
+        self.jitter = settings.metaapi_sync_jitter_seconds if jitter_seconds is None else jitter_seconds
+        self.backfill_days = settings.metaapi_sync_backfill_days
+        self.rate_limiter = TokenBucket(jobs_per_minute or settings.metaapi_sync_jobs_per_minute)
+        self.session_factory = session_factory
+        self.read_session_factory = read_session_factory
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 2)
+        self._accounts: Dict[int, Dict[str, Any]] = {}
+        self._next_due: Dict[int, float] = {}
+        self._in_flight = set()
+        self._tasks = []
+
+    async def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._dispatch_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _schedule(self, account_id: int, base: float, delay: float):
+        self._next_due[account_id] = base + delay + random.uniform(0, self.jitter)
+
+    async def refresh_accounts(self):
+        """Reloads enabled accounts, scheduling new ones from their last sync"""
+        async with self.read_session_factory() as db:
+            result = await db.execute(
+                select(
+                    MetaAPIAccount.id,
+                    MetaAPIAccount.user_id,
+                    MetaAPIAccount.account_id,
+                    MetaAPIAccount.api_token_encrypted,
+                    MetaAPIAccount.last_synced_at
+                ).where(MetaAPIAccount.enabled == True)
+            )
+            rows = result.all()
+
+        now = time.time()
+        accounts = {}
+        for row in rows:
+            accounts[row.id] = {
+                "id": row.id,
+                "user_id": row.user_id,
+                "account_id": row.account_id,
+                # Descriptografado só na hora do sync
+                "api_token_encrypted": row.api_token_encrypted,
+            }
+            if row.id not in self._next_due:
+                if row.last_synced_at:
+                    # last_synced_at é UTC naive; converte para epoch
+                    last = (row.last_synced_at - datetime(1970, 1, 1)).total_seconds()
+                    self._schedule(row.id, max(last + self.interval, now), 0)
+                else:
+                    self._schedule(row.id, now, 0)
+
+        for removed in self._next_due.keys() - accounts.keys():
+            del self._next_due[removed]
+        self._accounts = accounts
+        metrics.set_gauge("metaapi.sync.accounts", len(accounts))
+
+    def due_accounts(self, now: float = None) -> List[Dict[str, Any]]:
+        now = now or time.time()
+        due = [
+            self._accounts[account_id]
+            for account_id, due_at in sorted(self._next_due.items(), key=lambda item: item[1])
+            if due_at <= now and account_id not in self._in_flight
+        ]
+        return round_robin(due)
+
+    async def _dispatch_loop(self):
+        while True:
+            try:
+                await self.refresh_accounts()
+                for account in self.due_accounts():
+                    self._in_flight.add(account["id"])
+                    # Fila limitada: espera os workers quando estiver cheia
+                    await self.queue.put(account)
+                    metrics.set_gauge("metaapi.sync.queue_depth", self.queue.qsize())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"MetaAPI sync scheduler error: {e}")
+            await asyncio.sleep(TICK_SECONDS)
+
+    async def _wait_for_capacity(self):
+        breaker = get_breaker("metaapi")
+        if breaker.is_open:
+            await asyncio.sleep(breaker.retry_in())
+        await self.rate_limiter.acquire()
+
+    async def _worker(self, worker_id: int):
+        while True:
+            account = await self.queue.get()
+            delay = self.interval
+            try:
+                await self._wait_for_capacity()
+                with metrics.timer("metaapi.sync.job_seconds"):
+                    result = await self.sync_account(account)
+
+                metrics.inc("metaapi.sync.jobs")
+                metrics.inc("metaapi.sync.deals", result.get("deals_fetched", 0))
+                metrics.inc("metaapi.sync.trades_imported", result.get("trades_imported", 0))
+                if result.get("rate_limited"):
+                    pause = result.get("retry_after") or DEFAULT_RATE_LIMIT_PAUSE
+                    self.rate_limiter.pause(pause)
+                    metrics.inc("metaapi.sync.rate_limited")
+                    delay = pause
+                elif not result.get("success"):
+                    metrics.inc("metaapi.sync.failed")
+                    if result.get("retry_after") is not None:
+                        # Circuit breaker aberto: tenta de novo quando ele reabrir
+                        delay = result["retry_after"]
+            except Exception as e:
+                metrics.inc("metaapi.sync.failed")
+                print(f"MetaAPI sync failed for account {account['account_id']}: {e}")
+            finally:
+                self._in_flight.discard(account["id"])
+                if account["id"] in self._next_due:
+                    self._schedule(account["id"], time.time(), delay)
+                self.queue.task_done()
+                metrics.set_gauge("metaapi.sync.queue_depth", self.queue.qsize())
+
+    async def sync_account(self, account: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.session_factory() as db:
+            try:
+                result = await sync_metaapi_account(
+                    db,
+                    account["user_id"],
+                    decrypt_secret(account["api_token_encrypted"]),
+                    account["account_id"],
+                    days=self.backfill_days,
+                    check_connection=False
+                )
+            except SecretUnavailable as e:
+                result = {"success": False, "message": str(e)}
+
+            row = await db.get(MetaAPIAccount, account["id"])
+            if row is not None:
+                if result.get("success"):
+                    row.last_synced_at = datetime.utcnow()
+                    row.last_error = None
+                else:
+                    row.last_error = result.get("message")
+                await db.commit()
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        now = time.time()
+        upcoming = min(self._next_due.values(), default=None)
+        return {
+            "running": bool(self._tasks),
+            "workers": self.workers,
+            "interval_minutes": self.interval / 60,
+            "accounts": len(self._accounts),
+            "due": sum(1 for due_at in self._next_due.values() if due_at <= now),
+            "in_flight": len(self._in_flight),
+            "queue_depth": self.queue.qsize(),
+            "next_due_in_seconds": round(max(0.0, upcoming - now), 1) if upcoming is not None else None,
+            "jobs": metrics.counter("metaapi.sync.jobs"),
+            "failed": metrics.counter("metaapi.sync.failed"),
+            "rate_limited": metrics.counter("metaapi.sync.rate_limited"),
+            "deals": metrics.counter("metaapi.sync.deals"),
+            "trades_imported": metrics.counter("metaapi.sync.trades_imported"),
+            "jobs_available": round(self.rate_limiter.available, 1),
+        }
+
+
+async def encrypt_legacy_tokens(db) -> int:
+    """Encrypts tokens stored in plaintext before encryption existed. Does not commit."""
+    result = await db.execute(select(MetaAPIAccount))
+    migrated = 0
+    for account in result.scalars().all():
+        if not is_encrypted(account.api_token_encrypted):
+            account.api_token_encrypted = encrypt_secret(account.api_token_encrypted)
+            migrated += 1
+    return migrated
+
+
+_scheduler: Optional[SyncScheduler] = None
+
+
+def get_sync_scheduler() -> SyncScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = SyncScheduler()
+    return _scheduler
@@ -0,0 +1,293 @@
+"""
+Incremental broker sync (MetaAPI / MT5) with persisted watermarks.
+
+Each account has a SyncState row holding the time up to which deals were
+already imported and the entries still open at that point. A sync fetches
+only the delta since the watermark (minus a small overlap to catch late
+deals) and carries the open entries over so their exits still pair.
+
+First-time backfills are processed in chunks, advancing the watermark
+after each one, so a crash resumes from the last committed chunk instead
+of starting over.
+
+The session is only in a transaction while it writes: the state is read
+and released before any deal is fetched, and every batch of trades is
+committed before the next network read. A slow broker never keeps the
+single write connection checked out. Trades of an unfinished chunk may
+already be stored; the retry skips them by external_id, and the state
+(watermark, open entries) only moves when the chunk completes.
+"""
+
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+import json
+
+from sqlalchemy import select
+
+from app.config import get_settings
+from app.models.sync_state import SyncState
+from app.services.metaapi_service import MetaAPIService, history_error
+from app.services.metatrader_service import MetaTraderService
+from app.services.positions import PositionBook, parse_time
+from app.services.trade_writer import insert_trades
+from app.utils.cache import KeyedLocks
+from app.utils.metrics import metrics
+
+SYNC_OVERLAP = timedelta(minutes=15)
+
+# Um sync por conta por vez: evita que dois syncs simultâneos passem pela
+# checagem de duplicatas antes de qualquer um gravar
+_account_locks = KeyedLocks()
+
+
+def _dump_book(book: PositionBook) -> str:
+    return json.dumps(
+        {"positions": book.positions, "applied_deals": book.applied_deals},
+        default=lambda o: o.isoformat() if isinstance(o, datetime) else str(o)
+    )
+
+
+def _load_book(raw: Optional[str]) -> PositionBook:
+    data = json.loads(raw or "{}")
+    if "positions" not in data:
+        # Formato antigo: só o dict de posições abertas
+        data = {"positions": data}
+    return PositionBook(data["positions"], data.get("applied_deals") or {})
+
+
+def metaapi_external_id(trade: Dict[str, Any]) -> str:
+    # Mesmo formato de ID usado desde a primeira versão do sync; fechamentos
+    # parciais da mesma posição se distinguem pelo deal de saída
+    external_id = f"metaapi_{trade.get('symbol')}_{trade.get('open_time')}"
+    if trade.get("partial"):
+        external_id += f"_{trade.get('exit_deal_id')}"
+    return external_id
+
+
+def metaapi_trade_to_row(trade: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "symbol": trade["symbol"],
+        "trade_type": trade["type"],
+        "volume": trade.get("volume", 1),
+        "entry_price": trade.get("entry_price", 0),
+        "exit_price": trade.get("exit_price"),
+        "profit": trade.get("profit", 0),
+        "commission": trade.get("commission", 0),
+        "swap": trade.get("swap", 0),
+        # Trades são gravados em UTC "naive", como o resto do banco
+        "open_time": parse_time(trade["open_time"]),
+        "close_time": parse_time(trade.get("close_time")),
+        "duration_minutes": trade.get("duration_minutes", 0),
+        "external_id": metaapi_external_id(trade),
+    }
+
+
+def mt5_trade_to_row(trade: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "symbol": trade["symbol"],
+        "trade_type": trade["type"],
+        "volume": trade["volume"],
+        "entry_price": trade["price_open"],
+        "exit_price": trade["price_close"],
+        "profit": trade["profit"],
+        "commission": trade.get("commission", 0),
+        "swap": trade.get("swap", 0),
+        "open_time": trade["time_open"],
+        "close_time": trade["time_close"],
+        "duration_minutes": int((trade["time_close"] - trade["time_open"]).total_seconds() / 60),
+        "external_id": f"{trade['ticket']}_{trade['exit_ticket']}" if trade.get("partial") else str(trade["ticket"]),
+    }
+
+
+async def get_sync_state(db, user_id: int, source: str, account_id: str) -> SyncState:
+    result = await db.execute(
+        select(SyncState).where(
+            SyncState.user_id == user_id,
+            SyncState.source == source,
+            SyncState.account_id == account_id
+        )
+    )
+    state = result.scalar_one_or_none()
+    if state is None:
+        state = SyncState(user_id=user_id, source=source, account_id=account_id, open_positions="{}")
+        db.add(state)
+    return state
+
+
+def _account_lock(user_id: int, source: str, account_id: str):
+    lock = _account_locks((user_id, source, account_id))
+    if lock.locked():
+        metrics.inc("sync.lock_waits")
+    return lock
+
+
+async def _read_state(db, user_id: int, source: str, account_id: str) -> SyncState:
+    """Loads (or creates) the state and ends the transaction before the broker is called"""
+    state = await get_sync_state(db, user_id, source, account_id)
+    await db.commit()
+    return state
+
+
+def _sync_start(state: SyncState, days: int, full: bool, now: datetime) -> Tuple[datetime, bool, PositionBook]:
+    """Fetch start, whether it is a (re)backfill and the book to continue from; the state is untouched"""
+    if full or state.last_deal_time is None:
+        return now - timedelta(days=days), True, PositionBook()
+    return state.last_deal_time - SYNC_OVERLAP, False, _load_book(state.open_positions)
+
+
+async def sync_metaapi_account(
+    db,
+    user_id: int,
+    api_token: str,
+    account_id: str,
+    days: int = 30,
+    full: bool = False,
+    check_connection: bool = True,
+    progress: Optional[Callable[[float, str], None]] = None
+) -> Dict[str, Any]:
+    """
+    Sincroniza uma conta MetaAPI a partir da marca d'água salva.
+
+    O scheduler passa check_connection=False para não gastar uma requisição
+    extra por conta a cada ciclo. `progress(fração, mensagem)` é chamado a
+    cada chunk gravado (jobs).
+    """
+    settings = get_settings()
+    service = MetaAPIService(api_token=api_token, account_id=account_id)
+
+    try:
+        connection = {"success": True}
+        if check_connection:
+            connection = await service.test_connection()
+        if not connection.get("success"):
+            return {
+                "success": False,
+                "message": connection.get("message"),
+                "trades_imported": 0
+            }
+
+        # Checagem de conexão fica fora do lock para ser coalescida entre chamadas
+        async with _account_lock(user_id, "METAAPI", account_id):
+            state = await _read_state(db, user_id, "METAAPI", account_id)
+            incremental = state.last_deal_time is not None and not full
+            now = datetime.utcnow()
+            start, backfill, book = _sync_start(state, days, full, now)
+
+            imported = skipped = found = deals = 0
+            chunk = timedelta(days=settings.metaapi_backfill_chunk_days)
+            chunk_start = start
+
+            while chunk_start < now:
+                chunk_end = min(chunk_start + chunk, now)
+                book.remember_after = chunk_end - SYNC_OVERLAP
+                resume_from = state.last_deal_time
+                stats = {}
+                chunk_imported = chunk_skipped = chunk_found = 0
+                try:
+                    # Trades chegam em lotes conforme os deals são lidos da rede; cada lote
+                    # é gravado e commitado antes da próxima leitura (libera a conexão de escrita)
+                    async for batch in service.stream_trades(chunk_start, chunk_end, book, stats=stats):
+                        batch_imported, batch_skipped = await insert_trades(
+                            db, user_id, (metaapi_trade_to_row(t) for t in batch), "METAAPI"
+                        )
+                        await db.commit()
+                        chunk_imported += batch_imported
+                        chunk_skipped += batch_skipped
+                        chunk_found += len(batch)
+                except Exception as e:
+                    # Marca d'água e posições ficam no último chunk completo; os trades já
+                    # gravados deste chunk são reconhecidos pelo external_id no próximo sync
+                    await db.rollback()
+                    failure = history_error(e)
+                    return {
+                        "success": False,
+                        "message": failure["message"],
+                        "trades_imported": imported,
+                        "trades_skipped": skipped,
+                        "deals_fetched": deals,
+                        "rate_limited": failure.get("rate_limited", False),
+                        "retry_after": failure.get("retry_after"),
+                        "resume_from": resume_from.isoformat() if resume_from else None
+                    }
+
+                if backfill:
+                    state.backfill_start = start
+                state.last_deal_time = chunk_end
+                state.last_deal_id = stats.get("last_deal_id") or state.last_deal_id
+                book.forget_applied_before(book.remember_after)
+                state.open_positions = _dump_book(book)
+                await db.commit()
+
+                imported += chunk_imported
+                skipped += chunk_skipped
+                found += chunk_found
+                deals += stats["total_deals"]
+
+                chunk_start = chunk_end
+                if progress:
+                    progress((chunk_end - start) / (now - start), f"Deals até {chunk_end:%Y-%m-%d %H:%M}")
+
+            if not found:
+                message = "✅ Conexão OK, mas nenhum trade novo encontrado no período"
+            else:
+                message = "✅ Sincronização concluída!"
+
+            return {
+                "success": True,
+                "message": message,
+                "trades_imported": imported,
+                "trades_skipped": skipped,
+                "total_found": found,
+                "deals_fetched": deals,
+                "incremental": incremental,
+                "since": start.isoformat(),
+                "open_positions": len(book.positions),
+                "account": connection.get("account")
+            }
+    finally:
+        await service.close()
+
+
+async def sync_mt5_account(
+    db,
+    user_id: int,
+    mt5_service: MetaTraderService,
+    login: int,
+    days: int = 30,
+    full: bool = False
+) -> Dict[str, Any]:
+    """Sincroniza a conta MT5 já conectada a partir da marca d'água salva"""
+    async with _account_lock(user_id, "METATRADER", str(login)):
+        return await _sync_mt5_account(db, user_id, mt5_service, login, days, full)
+
+
+async def _sync_mt5_account(db, user_id, mt5_service, login, days, full) -> Dict[str, Any]:
+    state = await _read_state(db, user_id, "METATRADER", str(login))
+    incremental = state.last_deal_time is not None and not full
+    now = datetime.now()
+    start, backfill, book = _sync_start(state, days, full, now)
+    book.remember_after = now - SYNC_OVERLAP
+
+    # Terminal consultado sem transação aberta; a gravação vem depois, numa só
+    trades_data = await mt5_service.get_history(start, now, book=book)
+
+    imported, skipped = await insert_trades(
+        db, user_id, (mt5_trade_to_row(t) for t in trades_data), "METATRADER"
+    )
+
+    if backfill:
+        state.backfill_start = start
+    state.last_deal_time = now
+    book.forget_applied_before(book.remember_after)
+    state.open_positions = _dump_book(book)
+    await db.commit()
+
+    return {
+        "success": True,
+        "message": "✅ Sincronização concluída!" if trades_data else "Nenhum trade novo encontrado no período",
+        "trades_imported": imported,
+        "trades_skipped": skipped,
+        "incremental": incremental,
+        "since": start.isoformat(),
+        "open_positions": len(book.positions)
+    }
@@ -0,0 +1,183 @@
+"""
+Bulk trade writer shared by syncs and imports.
+
+Rows with an external_id (MT5, MetaAPI, TradingView) are deduplicated by
+(user_id, source, external_id) with one IN query per chunk. Rows without
+one (CSV/Excel statements) get a natural key, a hash of symbol, open time,
+side, volume, entry price and profit; they are staged in a temp table and
+copied with a single INSERT ... SELECT anti-joined on the indexed
+(user_id, natural_key), so overlapping statements only add their new rows.
+New rows are inserted with executemany, never one round trip per trade.
+The same execution arriving from another source is then marked by the
+duplicate matcher (see duplicate_matcher).
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Tuple
+import hashlib
+
+from sqlalchemy import Column, MetaData, Table, select, insert, delete, update, exists, bindparam
+from sqlalchemy.schema import CreateTable
+
+from app.models.trade import Trade
+from app.services.duplicate_matcher import mark_duplicates
+
+CHUNK_SIZE = 500
+
+TRADE_COLUMNS = {c.name for c in Trade.__table__.columns} - {"id", "user_id", "created_at", "updated_at", "duplicate_of"}
+
+# executemany exige as mesmas chaves em todas as linhas
+_SCALAR_DEFAULTS = {
+    c.name: c.default.arg
+    for c in Trade.__table__.columns
+    if c.default is not None and c.default.is_scalar
+}
+
+# Tabela temporária (por conexão) para o anti-join das linhas sem external_id
+_staging = Table(
+    "trade_import_staging",
+    MetaData(),
+    *[Column(c.name, c.type) for c in Trade.__table__.columns if c.name != "id"],
+    prefixes=["TEMPORARY"],
+)
+_STAGED_COLUMNS = [c.name for c in _staging.columns]
+
+
+def natural_key(row: Dict[str, Any]) -> str:
+    """Identity of a trade that has no external id (same trade in two statements -> same key)"""
+    open_time = row["open_time"]
+    if isinstance(open_time, datetime):
+        open_time = open_time.replace(microsecond=0).isoformat()
+    raw = "|".join([
+        str(row["symbol"]).strip().upper(),
+        str(open_time),
+        str(row["trade_type"]),
+        f"{float(row['volume'] or 0):.10g}",
+        f"{float(row['entry_price'] or 0):.10g}",
+        f"{float(row.get('profit') or 0):.2f}",
+    ])
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+async def _insert_by_external_id(db, user_id: int, source: str, rows: List[Dict[str, Any]]) -> int:
+    external_ids = [r["external_id"] for r in rows]
+    existing = set()
+    for i in range(0, len(external_ids), CHUNK_SIZE):
+        chunk = external_ids[i:i + CHUNK_SIZE]
+        result = await db.execute(
+            select(Trade.external_id).where(
+                Trade.user_id == user_id,
+                Trade.source == source,
+                Trade.external_id.in_(chunk)
+            )
+        )
+        existing.update(result.scalars().all())
+
+    new_rows = []
+    for row in rows:
+        if row["external_id"] in existing:
+            continue
+        existing.add(row["external_id"])
+        new_rows.append(row)
+
+    # executemany direto no Core: o bulk insert do ORM é ~1.5x mais lento aqui
+    conn = await db.connection()
+    for i in range(0, len(new_rows), CHUNK_SIZE):
+        await conn.execute(insert(Trade.__table__), new_rows[i:i + CHUNK_SIZE])
+    return len(new_rows)
+
+
+async def _insert_by_natural_key(db, user_id: int, rows: List[Dict[str, Any]]) -> int:
+    for row in rows:
+        row["natural_key"] = natural_key(row)
+
+    conn = await db.connection()
+    await conn.execute(CreateTable(_staging, if_not_exists=True))
+    await conn.execute(delete(_staging))
+    for i in range(0, len(rows), CHUNK_SIZE):
+        await conn.execute(insert(_staging), rows[i:i + CHUNK_SIZE])
+
+    # Repetições dentro do mesmo arquivo são mantidas (trades idênticos legítimos);
+    # só o que já está no banco é descartado
+    result = await conn.execute(
+        insert(Trade.__table__).from_select(
+            _STAGED_COLUMNS,
+            select(*[_staging.c[name] for name in _STAGED_COLUMNS]).where(
+                ~exists().where(
+                    Trade.user_id == user_id,
+                    Trade.natural_key == _staging.c.natural_key
+                )
+            )
+        )
+    )
+    await conn.execute(delete(_staging))
+    return result.rowcount
+
+
+async def insert_trades(db, user_id: int, trades: Iterable[Dict[str, Any]], source: str) -> Tuple[int, int]:
+    """
+    Inserts trades (dicts with Trade column names) for a user.
+
+    Rows whose external_id (or, without one, natural key) already exists
+    for this user are skipped, as are external_id repeats within the batch.
+    New rows are matched against other sources' trades (duplicate_of).
+    Does not commit. Returns (imported, skipped).
+    """
+    rows: List[Dict[str, Any]] = []
+    for trade in trades:
+        row = {k: v for k, v in trade.items() if k in TRADE_COLUMNS}
+        row["user_id"] = user_id
+        row["source"] = source
+        rows.append(row)
+
+    if not rows:
+        return 0, 0
+
+    now = datetime.utcnow()
+    # Todas as colunas com default: o INSERT ... SELECT da tabela temporária não os aplica
+    keys = set().union(*rows) | _SCALAR_DEFAULTS.keys() | {"external_id", "natural_key"}
+    for row in rows:
+        for key in keys - row.keys():
+            row[key] = _SCALAR_DEFAULTS.get(key)
+        # INSERT ... SELECT não aplica os defaults Python dos timestamps
+        row["created_at"] = row["updated_at"] = now
+
+    with_id = [r for r in rows if r["external_id"]]
+    without_id = [r for r in rows if not r["external_id"]]
+
+    imported = 0
+    if with_id:
+        imported += await _insert_by_external_id(db, user_id, source, with_id)
+    if without_id:
+        imported += await _insert_by_natural_key(db, user_id, without_id)
+
+    if imported:
+        await mark_duplicates(db, user_id, rows)
+
+    return imported, len(rows) - imported
+
+
+async def backfill_natural_keys(db) -> int:
+    """Fills natural_key for trades imported before it existed (no commit)"""
+    conn = await db.connection()
+    statement = (
+        update(Trade.__table__)
+        .where(Trade.__table__.c.id == bindparam("b_id"))
+        .values(natural_key=bindparam("b_natural_key"))
+    )
+    filled = last_id = 0
+    while True:
+        # Paginação pelo id: cada lote continua de onde o anterior parou
+        result = await db.execute(
+            select(Trade.id, Trade.symbol, Trade.open_time, Trade.trade_type,
+                   Trade.volume, Trade.entry_price, Trade.profit)
+            .where(Trade.id > last_id, Trade.external_id.is_(None), Trade.natural_key.is_(None))
+            .order_by(Trade.id)
+            .limit(5000)
+        )
+        batch = result.mappings().all()
+        if not batch:
+            return filled
+        await conn.execute(statement, [{"b_id": row["id"], "b_natural_key": natural_key(row)} for row in batch])
+        filled += len(batch)
+        last_id = batch[-1]["id"]
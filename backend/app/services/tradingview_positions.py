@@ -0,0 +1,223 @@
+"""
+Open-position index for TradingView alerts.
+
+Entry alerts open a trade; exit alerts (CLOSE_LONG / CLOSE_SHORT) close the
+trade opened for the same (user_id, symbol, strategy) and fill in its exit
+price, close time, duration and profit. The index is a dict in memory (one
+lookup per alert, no table scan) mirrored in `tradingview_positions` so it
+survives restarts.
+
+Alerts are applied per batch on an overlay (`PositionBatch`); the index is
+only updated after the batch's transaction commits, so a failed flush leaves
+it consistent with the database. The webhook writer is its only user, so no
+locking is needed.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, insert, update, delete, bindparam
+
+from app.models.trade import Trade
+from app.models.tradingview_position import TradingViewPosition
+from app.utils.metrics import metrics
+
+CLOSE_TYPES = {"CLOSE_LONG": "BUY", "CLOSE_SHORT": "SELL"}
+DEFAULT_STRATEGY = "default"
+
+Key = Tuple[int, str, str]
+
+_update_trade = (
+    update(Trade)
+    .where(Trade.id == bindparam("b_id"))
+    .values(
+        entry_price=bindparam("b_entry_price"),
+        volume=bindparam("b_volume"),
+        exit_price=bindparam("b_exit_price"),
+        close_time=bindparam("b_close_time"),
+        duration_minutes=bindparam("b_duration_minutes"),
+        profit=bindparam("b_profit"),
+        updated_at=bindparam("b_updated_at"),
+    )
+)
+_delete_position = delete(TradingViewPosition).where(
+    TradingViewPosition.user_id == bindparam("b_user_id"),
+    TradingViewPosition.symbol == bindparam("b_symbol"),
+    TradingViewPosition.strategy == bindparam("b_strategy"),
+)
+
+
+class OpenPositionIndex:
+    def __init__(self):
+        self.positions: Dict[Key, Dict[str, Any]] = {}
+        self.loaded = False
+
+    async def load(self, db):
+        """Reads persisted open positions (once per process)"""
+        if self.loaded:
+            return
+        result = await db.execute(select(TradingViewPosition))
+        for row in result.scalars():
+            self.positions[(row.user_id, row.symbol, row.strategy)] = {
+                "trade_id": row.trade_id,
+                "trade_type": row.trade_type,
+                "entry_price": row.entry_price,
+                "volume": row.volume,
+                "open_time": row.open_time,
+                "row": None,
+            }
+        self.loaded = True
+        metrics.set_gauge("tradingview.open_positions", len(self.positions))
+
+    def batch(self) -> "PositionBatch":
+        return PositionBatch(self)
+
+
+class PositionBatch:
+    """Alerts of one flush: trades to insert/update and index changes to persist"""
+
+    def __init__(self, index: OpenPositionIndex):
+        self.index = index
+        self.touched: Dict[Key, Optional[Dict[str, Any]]] = {}
+        self.inserts: List[Dict[str, Any]] = []
+        self.updates: Dict[int, Dict[str, Any]] = {}
+        self.unmatched_exits = 0
+
+    def _get(self, key: Key) -> Optional[Dict[str, Any]]:
+        if key in self.touched:
+            return self.touched[key]
+        pos = self.index.positions.get(key)
+        # Cópia: o índice só muda depois do commit
+        return dict(pos) if pos is not None else None
+
+    def apply(self, alert: Dict[str, Any]):
+        """
+        Applies one queued alert (user_id, symbol, type, price, volume, time,
+        strategy, external_id, notes) in arrival order.
+        """
+        key = (alert["user_id"], alert["symbol"], alert.get("strategy") or DEFAULT_STRATEGY)
+        pos = self._get(key)
+        alert_type = alert["type"]
+
+        if alert_type in CLOSE_TYPES:
+            if pos is None or pos["trade_type"] != CLOSE_TYPES[alert_type]:
+                self.unmatched_exits += 1
+                return
+            self._close(key, pos, alert["price"], alert["time"])
+            return
+
+        if pos is not None:
+            if pos["trade_type"] == alert_type:
+                # Pirâmide: aumenta a posição com preço médio
+                volume = pos["volume"] + alert["volume"]
+                pos["entry_price"] = (pos["entry_price"] * pos["volume"] + alert["price"] * alert["volume"]) / volume
+                pos["volume"] = volume
+                self._save(pos)
+                self.touched[key] = pos
+                return
+            # Entrada no lado oposto reverte a posição (como strategy.entry)
+            self._close(key, pos, alert["price"], alert["time"])
+
+        row = {
+            "user_id": alert["user_id"],
+            "symbol": alert["symbol"],
+            "trade_type": alert_type,
+            "volume": alert["volume"],
+            "entry_price": alert["price"],
+            "exit_price": None,
+            "close_time": None,
+            "duration_minutes": 0,
+            "profit": alert.get("profit", 0),
+            "open_time": alert["time"],
+            "source": "TRADINGVIEW",
+            "external_id": alert["external_id"],
+            "notes": alert.get("notes"),
+        }
+        self.inserts.append(row)
+        self.touched[key] = {
+            "trade_id": None,
+            "trade_type": alert_type,
+            "entry_price": alert["price"],
+            "volume": alert["volume"],
+            "open_time": alert["time"],
+            "row": row,
+        }
+
+    def _close(self, key: Key, pos: Dict[str, Any], price: float, time: datetime):
+        direction = 1 if pos["trade_type"] == "BUY" else -1
+        pos["exit_price"] = price
+        pos["close_time"] = time
+        pos["duration_minutes"] = int((time - pos["open_time"]).total_seconds() / 60)
+        pos["profit"] = round((price - pos["entry_price"]) * pos["volume"] * direction, 2)
+        self._save(pos)
+        self.touched[key] = None
+
+    def _save(self, pos: Dict[str, Any]):
+        fields = {
+            "entry_price": pos["entry_price"],
+            "volume": pos["volume"],
+            "exit_price": pos.get("exit_price"),
+            "close_time": pos.get("close_time"),
+            "duration_minutes": pos.get("duration_minutes", 0),
+            "profit": pos.get("profit", 0),
+        }
+        if pos["row"] is not None:
+            # Aberta neste mesmo lote: grava já com os valores finais
+            pos["row"].update(fields)
+        else:
+            self.updates[pos["trade_id"]] = {f"b_{k}": v for k, v in fields.items()}
+
+    async def write(self, db):
+        """Inserts/updates trades and persists the touched index keys (no commit)"""
+        if self.inserts:
+            result = await db.execute(
+                insert(Trade).returning(Trade.id, sort_by_parameter_order=True),
+                self.inserts
+            )
+            ids = {id(row): trade_id for row, trade_id in zip(self.inserts, result.scalars().all())}
+            for pos in self.touched.values():
+                if pos is not None and pos["row"] is not None:
+                    pos["trade_id"] = ids[id(pos["row"])]
+
+        # executemany de UPDATE/DELETE com bindparam só existe no Core
+        conn = await db.connection()
+        if self.updates:
+            now = datetime.utcnow()
+            await conn.execute(
+                _update_trade,
+                [{"b_id": trade_id, "b_updated_at": now, **fields} for trade_id, fields in self.updates.items()]
+            )
+
+        if self.touched:
+            await conn.execute(
+                _delete_position,
+                [{"b_user_id": u, "b_symbol": s, "b_strategy": st} for u, s, st in self.touched]
+            )
+            still_open = [
+                {
+                    "user_id": user_id,
+                    "symbol": symbol,
+                    "strategy": strategy,
+                    "trade_id": pos["trade_id"],
+                    "trade_type": pos["trade_type"],
+                    "entry_price": pos["entry_price"],
+                    "volume": pos["volume"],
+                    "open_time": pos["open_time"],
+                }
+                for (user_id, symbol, strategy), pos in self.touched.items()
+                if pos is not None
+            ]
+            if still_open:
+                await db.execute(insert(TradingViewPosition), still_open)
+
+    def commit(self):
+        """Publishes the batch's positions to the index (after the DB commit)"""
+        for key, pos in self.touched.items():
+            if pos is None:
+                self.index.positions.pop(key, None)
+            else:
+                pos["row"] = None
+                self.index.positions[key] = pos
+        if self.unmatched_exits:
+            metrics.inc("tradingview.unmatched_exits", self.unmatched_exits)
+        metrics.set_gauge("tradingview.open_positions", len(self.index.positions))
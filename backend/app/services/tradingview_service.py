@@ -46,8 +46,13 @@ class TradingViewService:
             "price": 128500,
             "volume": 1,
             "message": "Entry signal",
-            "id": "unique_id"
+            "id": "unique_id",
+            "strategy": "TradeStars Strategy",  # optional
+            "position": "flat"                  # optional ({{strategy.market_position}})
         }
+        
+        "type" may also be CLOSE_LONG / CLOSE_SHORT, which closes the position
+        opened for the same symbol and strategy.
         """
         # Normalize trade type
         trade_type = str(data.get("type", "BUY")).upper()
@@ -55,6 +60,18 @@ class TradingViewService:
             trade_type = "BUY"
         elif trade_type in ["SHORT", "SELL", "VENDA"]:
             trade_type = "SELL"
+        elif trade_type in ["EXIT_LONG", "CLOSE_BUY"]:
+            trade_type = "CLOSE_LONG"
+        elif trade_type in ["EXIT_SHORT", "CLOSE_SELL"]:
+            trade_type = "CLOSE_SHORT"
+        
+        # Ordem que zera a posição ({{strategy.market_position}} == "flat"):
+        # uma venda fecha a compra e vice-versa
+        if str(data.get("position") or "").lower() == "flat":
+            if trade_type == "SELL":
+                trade_type = "CLOSE_LONG"
+            elif trade_type == "BUY":
+                trade_type = "CLOSE_SHORT"
         
         # Extract symbol (remove exchange prefix if present)
         symbol = str(data.get("symbol", "UNKNOWN"))
@@ -67,7 +84,8 @@ class TradingViewService:
             "price": float(data.get("price", 0)),
             "volume": float(data.get("volume", 1)),
             "message": data.get("message", ""),
-            "id": data.get("id", f"tv_{datetime.now().timestamp()}")
+            "id": data.get("id") or f"tv_{datetime.now().timestamp()}",
+            "strategy": data.get("strategy") or "default"
         }
     
     def generate_alert_template(self, include_strategy: bool = True) -> Dict[str, Any]:
@@ -85,7 +103,9 @@ class TradingViewService:
     "price": {{close}},
     "volume": {{strategy.order.contracts}},
     "message": "{{strategy.order.comment}}",
-    "id": "{{strategy.order.id}}"
+    "id": "{{strategy.order.id}}",
+    "strategy": "TradeStars Strategy",
+    "position": "{{strategy.market_position}}"
 }""",
                 "description": "Use este template no campo 'Message' do alerta do TradingView"
             }
@@ -102,60 +122,106 @@ class TradingViewService:
                 "description": "Template para alertas simples. Mude 'type' manualmente para BUY ou SELL."
             }
     
-    def parse_strategy_report_csv(self, csv_content: str) -> list:
+    def parse_strategy_report_csv(self, csv_content, symbol: str = "UNKNOWN") -> list:
         """
-        Parse TradingView Strategy Tester CSV export.
+        Parse TradingView Strategy Tester CSV export ("List of trades").
         
         TradingView Strategy Tester exports include:
         - Trade # 
         - Type (Entry Long, Exit Long, Entry Short, Exit Short)
         - Signal
         - Date/Time
-        - Price
-        - Contracts
+        - Price (newer exports: "Price USD" etc.)
+        - Contracts (or Quantity / Position size (qty))
         - Profit
         - Cumulative Profit
         - Run-up
         - Drawdown
+        
+        Entry and exit rows are paired by trade number in one vectorized
+        pass (no per-row loop), so 100k-trade backtests parse in well under
+        a second. Trades still open at the end of the backtest (exit signal
+        "Open") are skipped. Returns dicts with Trade column names.
         """
         import pandas as pd
         import io
         
-        df = pd.read_csv(io.StringIO(csv_content))
+        if isinstance(csv_content, str):
+            csv_content = csv_content.encode()
+        df = pd.read_csv(io.BytesIO(csv_content), encoding="utf-8-sig")
         
         # Normalize columns
         df.columns = df.columns.str.lower().str.strip().str.replace(' ', '_')
         
-        trades = []
-        open_trades = {}
-        
-        for idx, row in df.iterrows():
-            trade_type = str(row.get('type', '')).lower()
-            
-            if 'entry' in trade_type:
-                # Opening a position
-                direction = 'BUY' if 'long' in trade_type else 'SELL'
-                trade_id = row.get('trade_#', idx)
-                
-                open_trades[trade_id] = {
-                    "trade_type": direction,
-                    "entry_price": float(row.get('price', 0)),
-                    "volume": float(row.get('contracts', 1)),
-                    "open_time": row.get('date/time', datetime.now())
-                }
-                
-            elif 'exit' in trade_type:
-                # Closing a position
-                trade_id = row.get('trade_#', idx)
-                
-                if trade_id in open_trades:
-                    trade = open_trades.pop(trade_id)
-                    trade["exit_price"] = float(row.get('price', 0))
-                    trade["close_time"] = row.get('date/time', datetime.now())
-                    trade["profit"] = float(row.get('profit', 0))
-                    trades.append(trade)
-        
-        return trades
+        def find_column(*prefixes, exclude=("%",)):
+            # Exportações novas trazem a moeda no nome ("price_usd", "profit_brl")
+            for prefix in prefixes:
+                for col in df.columns:
+                    if col.startswith(prefix) and not any(x in col for x in exclude):
+                        return col
+            return None
+        
+        trade_col = find_column("trade_#", "trade")
+        type_col = find_column("type")
+        time_col = find_column("date/time", "date", "time")
+        price_col = find_column("price")
+        volume_col = find_column("contracts", "quantity", "position_size", "qty")
+        profit_col = find_column("profit", "net_p&l", "p&l")
+        signal_col = find_column("signal")
+        
+        missing = [name for name, col in [("Trade #", trade_col), ("Type", type_col), ("Date/Time", time_col), ("Price", price_col)] if col is None]
+        if missing:
+            raise ValueError(f"Colunas do Strategy Tester não encontradas: {', '.join(missing)}")
+        
+        kind = df[type_col].astype(str).str.lower()
+        report = pd.DataFrame({
+            "trade_no": df[trade_col],
+            "is_entry": kind.str.contains("entry"),
+            "side": kind.str.contains("short").map({True: "SELL", False: "BUY"}),
+            "time": pd.to_datetime(df[time_col], errors="coerce"),
+            "price": pd.to_numeric(df[price_col], errors="coerce"),
+            "volume": pd.to_numeric(df[volume_col], errors="coerce") if volume_col else 1.0,
+            "profit": pd.to_numeric(df[profit_col], errors="coerce") if profit_col else 0.0,
+            "signal": df[signal_col].astype(str) if signal_col else "",
+        })
+        
+        entries = report[report["is_entry"]].drop_duplicates("trade_no").set_index("trade_no")
+        exits = report[~report["is_entry"]].drop_duplicates("trade_no").set_index("trade_no")
+        exits = exits[exits["signal"].str.strip().str.lower() != "open"]
+        
+        # Pivô por trade #: uma linha por trade com entrada e saída lado a lado
+        paired = entries.join(exits, how="inner", lsuffix="_in", rsuffix="_out")
+        paired = paired[paired["time_in"].notna() & paired["price_in"].notna()]
+        if paired.empty:
+            return []
+        
+        profit = paired["profit_out"].fillna(paired["profit_in"]).fillna(0.0)
+        duration = ((paired["time_out"] - paired["time_in"]).dt.total_seconds() // 60).fillna(0).astype(int)
+        # ID estável entre reimportações: símbolo + trade # + minuto da entrada
+        entry_minute = (paired["time_in"].astype("int64") // 60_000_000_000).astype(str)
+        external_id = f"tvst:{symbol}:" + paired.index.to_series().astype(str) + ":" + entry_minute
+        signal = paired["signal_in"]
+        
+        def values(series):
+            # NaN/NaT -> None e timestamps -> datetime, sem passar por to_dict (lento)
+            if pd.api.types.is_datetime64_any_dtype(series):
+                return series.to_numpy().astype("datetime64[us]").tolist()
+            return series.astype(object).where(series.notna(), None).tolist()
+        
+        columns = {
+            "trade_type": values(paired["side_in"]),
+            "volume": values(paired["volume_in"].fillna(paired["volume_out"]).fillna(1.0)),
+            "entry_price": values(paired["price_in"]),
+            "exit_price": values(paired["price_out"]),
+            "profit": values(profit),
+            "open_time": values(paired["time_in"]),
+            "close_time": values(paired["time_out"]),
+            "duration_minutes": values(duration),
+            "external_id": values(external_id),
+            "notes": values(signal.where(~signal.isin(["", "nan"]))),
+        }
+        keys = ["symbol", *columns]
+        return [dict(zip(keys, row)) for row in zip([symbol] * len(paired), *columns.values())]
 
 
 class TradingViewPineScript:
@@ -170,21 +236,24 @@ class TradingViewPineScript:
 //@version=5
 strategy("TradeStars Strategy", overlay=true)
 
+// Identifica a estratégia: entradas e saídas do mesmo símbolo/estratégia são casadas
+strategyId = "TradeStars Strategy"
+
 // Your strategy logic here
 longCondition = ta.crossover(ta.sma(close, 14), ta.sma(close, 28))
 shortCondition = ta.crossunder(ta.sma(close, 14), ta.sma(close, 28))
 
 if (longCondition)
-    strategy.entry("Long", strategy.long, alert_message='{"symbol":"' + syminfo.ticker + '","type":"BUY","price":' + str.tostring(close) + ',"volume":1}')
+    strategy.entry("Long", strategy.long, alert_message='{"symbol":"' + syminfo.ticker + '","strategy":"' + strategyId + '","type":"BUY","price":' + str.tostring(close) + ',"volume":1}')
 
 if (shortCondition)
-    strategy.entry("Short", strategy.short, alert_message='{"symbol":"' + syminfo.ticker + '","type":"SELL","price":' + str.tostring(close) + ',"volume":1}')
+    strategy.entry("Short", strategy.short, alert_message='{"symbol":"' + syminfo.ticker + '","strategy":"' + strategyId + '","type":"SELL","price":' + str.tostring(close) + ',"volume":1}')
 
 // Stop Loss and Take Profit
 strategy.exit("Exit Long", "Long", stop=close * 0.99, limit=close * 1.02, 
-    alert_message='{"symbol":"' + syminfo.ticker + '","type":"CLOSE_LONG","price":' + str.tostring(close) + '}')
+    alert_message='{"symbol":"' + syminfo.ticker + '","strategy":"' + strategyId + '","type":"CLOSE_LONG","price":' + str.tostring(close) + '}')
 strategy.exit("Exit Short", "Short", stop=close * 1.01, limit=close * 0.98,
-    alert_message='{"symbol":"' + syminfo.ticker + '","type":"CLOSE_SHORT","price":' + str.tostring(close) + '}')
+    alert_message='{"symbol":"' + syminfo.ticker + '","strategy":"' + strategyId + '","type":"CLOSE_SHORT","price":' + str.tostring(close) + '}')
 '''
 
 
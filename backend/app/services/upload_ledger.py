@@ -0,0 +1,78 @@
+"""
+Ledger of imported files, keyed by a sha256 of the file content.
+
+An identical re-upload is recognised before any parsing (hashing runs at
+disk speed) and rejected with what the first import did; `force` imports
+it again, still deduplicated row by row by the trade writer.
+"""
+
+from typing import Any, Dict, IO, Optional
+import hashlib
+
+from sqlalchemy import select
+
+from app.models.uploaded_file import UploadedFile
+
+READ_SIZE = 1024 * 1024
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def stream_hash(stream: IO[bytes]) -> str:
+    """Hash of a seekable file object, which is rewound afterwards. Blocking."""
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while chunk := stream.read(READ_SIZE):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+async def find_upload(db, user_id: int, file_hash: str) -> Optional[UploadedFile]:
+    result = await db.execute(
+        select(UploadedFile).where(
+            UploadedFile.user_id == user_id,
+            UploadedFile.content_hash == file_hash
+        )
+    )
+    return result.scalar_one_or_none()
+
+
+def record_upload(db, user_id: int, file_hash: str, filename: str, size: int, kind: str,
+                  imported: int, skipped: int, existing: Optional[UploadedFile] = None) -> UploadedFile:
+    """Adds the file to the ledger (or updates the entry of a forced re-import); no commit"""
+    if existing is None:
+        existing = UploadedFile(user_id=user_id, content_hash=file_hash, import_count=0)
+        db.add(existing)
+    existing.filename = filename
+    existing.size = size
+    existing.kind = kind
+    existing.trades_imported = imported
+    existing.trades_skipped = skipped
+    existing.import_count = (existing.import_count or 0) + 1
+    return existing
+
+
+def upload_to_dict(upload: UploadedFile) -> Dict[str, Any]:
+    imported_at = upload.updated_at or upload.created_at
+    return {
+        "id": upload.id,
+        "filename": upload.filename,
+        "size": upload.size,
+        "kind": upload.kind,
+        "trades_imported": upload.trades_imported,
+        "trades_skipped": upload.trades_skipped,
+        "import_count": upload.import_count,
+        # Texto: o dict também vai no corpo do 409 (HTTPException não serializa datetime)
+        "imported_at": imported_at.isoformat() if imported_at else None,
+    }
+
+
+def duplicate_upload_detail(upload: UploadedFile) -> Dict[str, Any]:
+    """Body of the 409 answered to an identical re-upload"""
+    return {
+        "message": "Este arquivo já foi importado (use force=true para importar de novo)",
+        "upload": upload_to_dict(upload),
+    }
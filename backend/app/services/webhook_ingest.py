@@ -0,0 +1,270 @@
+"""
+Asynchronous ingestion of TradingView webhooks.
+
+The endpoint only validates the alert and puts it on a bounded in-memory
+queue, answering 202 right away. A single writer task drains the queue in
+group commits: it flushes once `batch_size` alerts are waiting or
+`flush_ms` after the first one arrived, so a burst of alerts costs one
+SQLite transaction instead of one per request. Entry and exit alerts are
+matched to open positions in the same transaction (see tradingview_positions),
+and new trades are matched against the same execution from other sources
+(see duplicate_matcher).
+
+When the queue is full the endpoint answers 503 (back-pressure) instead of
+growing memory. `stop()` flushes everything still queued (app shutdown).
+
+Alerts were already acknowledged, so none is dropped:
+- a transient database error (writer pool timeout, locked database) retries
+  the whole batch with capped exponential backoff; the queue keeps filling
+  and applies back-pressure meanwhile;
+- a data error isolates the bad alerts one by one and stores them in
+  `webhook_dead_letters` with the error;
+- on shutdown, a batch the database still refuses is appended to
+  WEBHOOK_SPOOL_FILE and queued again by the next `start()`.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import os
+import time
+import uuid
+
+from sqlalchemy import exc as sa_exc
+
+from app.config import get_settings
+from app.database import async_session
+from app.models.webhook_dead_letter import WebhookDeadLetter
+from app.services.duplicate_matcher import mark_duplicates
+from app.services.tradingview_positions import OpenPositionIndex
+from app.utils.metrics import metrics
+
+
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30.0
+# No desligamento não dá para esperar indefinidamente: depois disso vai para o spool
+SHUTDOWN_ATTEMPTS = 3
+
+# Falhas do banco, não do alerta: o mesmo lote tende a passar mais tarde
+TRANSIENT_ERRORS = (sa_exc.TimeoutError, sa_exc.OperationalError, asyncio.TimeoutError, OSError)
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+def _encode(alert: Dict[str, Any]) -> str:
+    return json.dumps({**alert, "time": alert["time"].isoformat()}, ensure_ascii=False, default=str)
+
+
+def _decode(line: str) -> Dict[str, Any]:
+    alert = json.loads(line)
+    alert["time"] = datetime.fromisoformat(alert["time"])
+    return alert
+
+
+class WebhookIngestor:
+    def __init__(self, queue_size: int = None, batch_size: int = None, flush_ms: float = None,
+                 session_factory=async_session):
+        settings = get_settings()
+        self.batch_size = batch_size or settings.webhook_batch_size
+        self.flush_interval = (settings.webhook_flush_ms if flush_ms is None else flush_ms) / 1000
+        self.session_factory = session_factory
+        self.spool_file = settings.webhook_spool_file
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or settings.webhook_queue_size)
+        self.retrying = False
+        self.positions = OpenPositionIndex()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    async def start(self):
+        if self._task is None:
+            self._closing = False
+            self._replay_spool()
+            self._task = asyncio.create_task(self._writer())
+
+    def _replay_spool(self):
+        """Queues again the alerts spooled by the last shutdown"""
+        if not self.spool_file or not os.path.exists(self.spool_file):
+            return
+        with open(self.spool_file, encoding="utf-8") as spool:
+            alerts = [_decode(line) for line in spool if line.strip()]
+        for alert in alerts:
+            # Fila maior que o spool por construção; se não couber, espera o writer no próximo lote
+            self.queue.put_nowait(alert)
+        os.remove(self.spool_file)
+        metrics.inc("webhook.replayed", len(alerts))
+
+    async def stop(self):
+        """Stops accepting alerts and flushes what is already queued"""
+        if self._task is None:
+            return
+        self._closing = True
+        await self.queue.join()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def submit(self, user_id: int, trade_data: Dict[str, Any]) -> str:
+        """Queues a parsed alert; returns its ingest id (also the trade's external_id)"""
+        if self._closing:
+            raise IngestQueueFull("Servidor encerrando; reenvie o alerta")
+        if self._task is None:
+            await self.start()
+
+        ingest_id = trade_data.get("id") or f"tv_{uuid.uuid4().hex[:16]}"
+        alert = {
+            "user_id": user_id,
+            "symbol": trade_data["symbol"],
+            "type": trade_data["type"],
+            "price": trade_data["price"],
+            "volume": trade_data.get("volume", 1.0),
+            "profit": trade_data.get("profit", 0),
+            "time": datetime.now(),
+            "strategy": trade_data.get("strategy"),
+            "external_id": ingest_id,
+            "notes": trade_data.get("message"),
+        }
+        try:
+            self.queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            metrics.inc("webhook.rejected")
+            raise IngestQueueFull("Fila de webhooks cheia; tente novamente em instantes")
+        metrics.inc("webhook.accepted")
+        metrics.set_gauge("webhook.queue_depth", self.queue.qsize())
+        return ingest_id
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        batch = [await self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _writer(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+                metrics.set_gauge("webhook.queue_depth", self.queue.qsize())
+
+    async def _write(self, alerts: List[Dict[str, Any]]):
+        async with self.session_factory() as db:
+            await self.positions.load(db)
+            batch = self.positions.batch()
+            for alert in alerts:
+                batch.apply(alert)
+            await batch.write(db)
+            by_user: Dict[int, List[Dict[str, Any]]] = {}
+            for row in batch.inserts:
+                by_user.setdefault(row["user_id"], []).append(row)
+            for user_id, rows in by_user.items():
+                await mark_duplicates(db, user_id, rows)
+            await db.commit()
+        batch.commit()
+
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        with metrics.timer("webhook.flush_seconds"):
+            pending, attempt = batch, 0
+            while pending:
+                pending, error = await self._try_write(pending)
+                if not pending:
+                    break
+                attempt += 1
+                metrics.inc("webhook.retried")
+                if self._closing and attempt >= SHUTDOWN_ATTEMPTS:
+                    self._spool(pending, error)
+                    break
+                # Banco indisponível: o lote inteiro espera e tenta de novo (sem N retries em série)
+                self.retrying = True
+                delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+                print(f"Webhook batch of {len(pending)} not written ({error}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            self.retrying = False
+
+    async def _try_write(self, alerts: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[Exception]]:
+        """
+        Writes the alerts, isolating the ones with bad data into dead letters.
+        Returns the alerts still to write and the transient error that stopped them.
+        """
+        try:
+            await self._write(alerts)
+            metrics.inc("webhook.written", len(alerts))
+            metrics.observe("webhook.batch_size", len(alerts))
+            return [], None
+        except asyncio.CancelledError:
+            raise
+        except TRANSIENT_ERRORS as e:
+            return alerts, e
+        except Exception as e:
+            if len(alerts) == 1:
+                await self._dead_letter(alerts[0], e)
+                return [], None
+            print(f"Webhook batch of {len(alerts)} failed, isolating the bad alerts: {e}")
+
+        # Um alerta inválido não pode derrubar o lote inteiro
+        for position, alert in enumerate(alerts):
+            _, error = await self._try_write([alert])
+            if error is not None:
+                return alerts[position:], error
+        return [], None
+
+    async def _dead_letter(self, alert: Dict[str, Any], error: Exception):
+        metrics.inc("webhook.dead_letters")
+        print(f"Webhook alert {alert.get('external_id')} moved to dead letters: {error}")
+        try:
+            async with self.session_factory() as db:
+                db.add(WebhookDeadLetter(
+                    user_id=alert.get("user_id"),
+                    external_id=alert.get("external_id"),
+                    payload=_encode(alert),
+                    error=str(error) or type(error).__name__,
+                ))
+                await db.commit()
+        except Exception as e:
+            self._spool([alert], e)
+
+    def _spool(self, alerts: List[Dict[str, Any]], error: Optional[Exception]):
+        """Last resort when the database is unavailable: append to the spool file"""
+        metrics.inc("webhook.spooled", len(alerts))
+        print(f"Webhook: {len(alerts)} alerts spooled to {self.spool_file} ({error})")
+        with open(self.spool_file, "a", encoding="utf-8") as spool:
+            for alert in alerts:
+                spool.write(_encode(alert) + "\n")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_ms": self.flush_interval * 1000,
+            "retrying": self.retrying,
+            "dead_letters": metrics.counter("webhook.dead_letters"),
+            "open_positions": len(self.positions.positions),
+        }
+
+
+_ingestor: Optional[WebhookIngestor] = None
+
+
+def get_webhook_ingestor() -> WebhookIngestor:
+    global _ingestor
+    if _ingestor is None:
+        _ingestor = WebhookIngestor()
+    return _ingestor
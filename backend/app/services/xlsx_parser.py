@@ -0,0 +1,159 @@
+"""
+Import of trade history workbooks (.xlsx), as exported by Brazilian
+brokers and platforms (Profit, Clear, ...).
+
+The workbook is opened in openpyxl's read-only mode, which streams the
+sheet XML instead of building every cell, and rows are turned into
+DataFrames of `BATCH_SIZE` rows that go through the same column-wise parse
+as CSV uploads (csv_parser.parse_frame). Memory depends on the batch size,
+not on the workbook size.
+
+The trade sheet is the one whose header row (searched in the first rows,
+below any title/logo rows) matches the most csv_parser.COLUMN_MAPPINGS
+aliases.
+"""
+
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+import datetime
+import io
+
+import pandas as pd
+
+from app.services.csv_parser import (
+    COLUMN_MAPPINGS, normalize_columns, headers_signature, detect_layout, parse_frame
+)
+
+BATCH_SIZE = 10000
+
+# Linhas iniciais onde o cabeçalho é procurado (relatórios têm título, filtros...)
+HEADER_SCAN_ROWS = 30
+
+_ALIASES = {alias: field for field, aliases in COLUMN_MAPPINGS.items() for alias in aliases}
+
+
+def _load_openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise ValueError("Importação de Excel indisponível: instale o pacote openpyxl")
+    return openpyxl
+
+
+def _header_score(cells: Tuple[Any, ...]) -> int:
+    names = normalize_columns(c for c in cells if isinstance(c, str) and c.strip())
+    fields = {_ALIASES[name] for name in names if name in _ALIASES}
+    # Sem ativo não é uma tabela de trades
+    return len(fields) if 'symbol' in fields else 0
+
+
+class TradeSheet:
+    """The trade table of a workbook: sheet, header row and normalized column names"""
+
+    def __init__(self, stream: IO[bytes]):
+        openpyxl = _load_openpyxl()
+        self.workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+        self.layout: Optional[Dict[str, Any]] = None
+        self._datetime_formats: Optional[Dict[str, str]] = None
+
+        best = None
+        for sheet in self.workbook.worksheets:
+            # Algumas planilhas gravam dimensões erradas (ex: A1:A1)
+            sheet.reset_dimensions()
+            for number, cells in enumerate(sheet.iter_rows(max_row=HEADER_SCAN_ROWS, values_only=True), 1):
+                score = _header_score(cells)
+                if score and (best is None or score > best[0]):
+                    best = (score, sheet, number, cells)
+        if best is None:
+            self.close()
+            raise ValueError("Nenhuma planilha com colunas de trades (ativo, resultado...) encontrada")
+
+        _, self.sheet, self.header_row, cells = best
+        self.headers = [
+            name if cell is not None and str(cell).strip() else f'column_{i}'
+            for i, (cell, name) in enumerate(zip(cells, normalize_columns('' if c is None else c for c in cells)))
+        ]
+        self.header_hash = headers_signature(self.headers)
+
+    def close(self):
+        self.workbook.close()
+
+    def _frame(self, rows: List[Tuple[int, Tuple[Any, ...]]]) -> pd.DataFrame:
+        """DataFrame of (sheet row number, cells) pairs, indexed by row number"""
+        width = len(self.headers)
+        df = pd.DataFrame(
+            [cells[:width] + (None,) * (width - len(cells)) for _, cells in rows],
+            columns=self.headers,
+            index=[number for number, _ in rows]
+        )
+
+        # Datas já vêm como datetime: viram texto num formato fixo por arquivo
+        # (decidido no 1º lote) para o formato detectado valer em todos os lotes
+        if self._datetime_formats is None:
+            self._datetime_formats = {}
+            for col in df.columns:
+                if pd.api.types.is_datetime64_any_dtype(df[col]):
+                    values = df[col].dropna()
+                    midnight = (values == values.dt.normalize()).all()
+                    self._datetime_formats[col] = '%Y-%m-%d' if midnight else '%Y-%m-%d %H:%M:%S'
+        for col in df.columns:
+            values = df[col]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                df[col] = values.dt.strftime(self._datetime_formats.get(col, '%Y-%m-%d %H:%M:%S'))
+            elif values.dtype == object and values.map(lambda v: isinstance(v, (datetime.datetime, datetime.time))).any():
+                df[col] = values.map(lambda v: v if v is None else str(v))
+        return df
+
+    def _row_batches(self, batch_size: int) -> Iterator[List[Tuple[int, Tuple[Any, ...]]]]:
+        batch = []
+        rows = self.sheet.iter_rows(min_row=self.header_row + 1, values_only=True)
+        for number, cells in enumerate(rows, self.header_row + 1):
+            if all(cell is None for cell in cells):
+                continue
+            batch.append((number, cells))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def frames(self, batch_size: int = BATCH_SIZE) -> Iterator[pd.DataFrame]:
+        """Raw row batches as DataFrames (index = sheet row number)"""
+        for rows in self._row_batches(batch_size):
+            yield self._frame(rows)
+
+    def batches(self, layout: Optional[Dict[str, Any]] = None, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Parsed trades, one list per batch of rows. Without `layout` it is
+        detected from the first batch (available in `self.layout`).
+        Blocking: drive it from a worker thread.
+        """
+        self.layout = layout
+        total = 0
+        for df in self.frames(batch_size):
+            if self.layout is None:
+                self.layout = detect_layout(df)
+            trades = parse_frame(df, self.layout)
+            total += len(trades)
+            if trades:
+                yield trades
+        if total == 0:
+            raise ValueError("Nenhum trade válido encontrado na planilha")
+
+
+def read_xlsx_trades(contents: bytes, layouts: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """
+    Whole-file variant (multi-file import). `layouts` maps header hashes to
+    saved layouts; returns trades plus the layout and header used.
+    """
+    sheet = TradeSheet(io.BytesIO(contents))
+    try:
+        layout = (layouts or {}).get(sheet.header_hash)
+        trades = [trade for batch in sheet.batches(layout) for trade in batch]
+        return {
+            "trades": trades,
+            "layout": sheet.layout,
+            "header_hash": sheet.header_hash,
+            "headers": sheet.headers,
+        }
+    finally:
+        sheet.close()
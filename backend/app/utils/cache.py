@@ -0,0 +1,75 @@
+"""
+In-process request coalescing and caching helpers.
+
+- SingleFlight: concurrent calls with the same key share one in-flight
+  task instead of each hitting the upstream.
+- TTLCache: small bounded cache whose entries expire after a few seconds.
+- KeyedLocks: one asyncio.Lock per key, created on demand.
+"""
+
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+import asyncio
+import time
+
+from app.utils.metrics import metrics
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Runs `fn()` once per key at a time; callers arriving meanwhile await the same result"""
+        task = self._calls.get(key)
+        if task is not None:
+            metrics.inc(f"singleflight.{self.name}.shared")
+        else:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+            metrics.inc(f"singleflight.{self.name}.calls")
+        # shield: um chamador cancelado não cancela a chamada dos demais
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+class TTLCache:
+    def __init__(self, ttl: float, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+
+class KeyedLocks:
+    def __init__(self):
+        self._locks: Dict[Hashable, asyncio.Lock] = {}
+
+    def __call__(self, key: Hashable) -> asyncio.Lock:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
@@ -0,0 +1,50 @@
+"""
+Encryption at rest for third-party credentials (MetaAPI tokens, MT5
+passwords of queued jobs).
+
+Fernet (AES-128-CBC + HMAC-SHA256) with a key derived from SECRET_KEY by
+HKDF, so no extra key has to be managed. Changing SECRET_KEY makes the
+stored values unreadable: the accounts have to be registered again.
+"""
+
+from functools import lru_cache
+import base64
+
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+from app.config import get_settings
+
+# Todo token Fernet começa com a versão 0x80 em base64
+_FERNET_PREFIX = "gAAAAA"
+
+
+class SecretUnavailable(ValueError):
+    """Stored secret cannot be decrypted (SECRET_KEY changed or value corrupted)"""
+
+
+@lru_cache
+def _fernet() -> Fernet:
+    key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"tradestars:credentials",
+    ).derive(get_settings().secret_key.encode())
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def encrypt_secret(value: str) -> str:
+    return _fernet().encrypt(value.encode()).decode()
+
+
+def decrypt_secret(token: str) -> str:
+    try:
+        return _fernet().decrypt(token.encode()).decode()
+    except (InvalidToken, AttributeError) as e:
+        raise SecretUnavailable("Credencial salva ilegível; cadastre a conta novamente") from e
+
+
+def is_encrypted(value: str) -> bool:
+    return bool(value) and value.startswith(_FERNET_PREFIX)
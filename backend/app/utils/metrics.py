@@ -0,0 +1,109 @@
+"""
+In-process metrics registry.
+
+Lightweight counters, gauges and latency histograms kept in memory and
+exposed as JSON through the /metrics endpoint. No external dependency.
+"""
+
+from collections import deque
+from typing import Dict, Any, Optional
+import threading
+import time
+
+
+class Histogram:
+    """Keeps count/sum and a bounded window of recent samples for percentiles"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self._samples = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self._samples.append(value)
+
+    def _percentile(self, ordered: list, p: float) -> float:
+        if not ordered:
+            return 0.0
+        idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self._samples)
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "avg": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": round(self._percentile(ordered, 50), 6),
+            "p95": round(self._percentile(ordered, 95), 6),
+            "p99": round(self._percentile(ordered, 99), 6),
+            "max": round(ordered[-1], 6) if ordered else 0.0,
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+        self._started_at = time.time()
+
+    def inc(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.observe(value)
+
+    def timer(self, name: str) -> "_Timer":
+        """Context manager that records elapsed seconds into a histogram"""
+        return _Timer(self, name)
+
+    def counter(self, name: str) -> float:
+        return self._counters.get(name, 0)
+
+    def rate(self, name: str, since: Optional[float] = None) -> float:
+        """Average per-second rate of a counter since `since` (default: process start)"""
+        elapsed = time.time() - (since or self._started_at)
+        return self.counter(name) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self, prefix: str = "") -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self._started_at, 1),
+                "counters": {k: v for k, v in self._counters.items() if k.startswith(prefix)},
+                "gauges": {k: v for k, v in self._gauges.items() if k.startswith(prefix)},
+                "histograms": {
+                    k: h.snapshot() for k, h in self._histograms.items() if k.startswith(prefix)
+                },
+            }
+
+
+class _Timer:
+    def __init__(self, registry: MetricsRegistry, name: str):
+        self.registry = registry
+        self.name = name
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self._start
+        self.registry.observe(self.name, self.elapsed)
+        return False
+
+
+metrics = MetricsRegistry()
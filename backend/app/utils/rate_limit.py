@@ -0,0 +1,56 @@
+"""
+Async token-bucket rate limiter.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at `rate_per_minute`.
+
+    `acquire(n)` waits until n tokens are available. Requests larger than the
+    bucket capacity are clamped to the capacity so they can still go through.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """Take tokens from the bucket, returns the seconds spent waiting"""
+        tokens = min(tokens, self.capacity)
+        waited = 0.0
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate_per_second
+                waited += delay
+                await asyncio.sleep(delay)
+
+    def consume(self, tokens: float):
+        """Adjust for tokens actually used after the fact (may go negative)"""
+        self._refill()
+        self._tokens -= tokens
+
+    def pause(self, seconds: float):
+        """Drain the bucket so the next acquire waits at least `seconds`"""
+        self._refill()
+        self._tokens = min(self._tokens, -seconds * self.rate_per_second)
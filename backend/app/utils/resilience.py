@@ -0,0 +1,217 @@
+"""
+Resilience helpers for external dependencies (OpenAI, MetaAPI).
+
+Each dependency gets a named CircuitBreaker that:
+- fails fast with CircuitOpenError while the dependency is known to be down,
+- derives its timeout from the observed latency (EWMA per operation, so
+  short calls do not shrink the timeout of long ones) instead of always
+  waiting out the worst case. A timeout raises the EWMA to the timeout
+  value, so the timeout follows latency up as well as down, and the
+  half-open probe gets `max_timeout`, so a dependency that became slower
+  (not down) can still close the breaker,
+- retries a bounded number of times with jittered exponential backoff.
+
+Breaker state is exposed by /health/dependencies.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional
+import asyncio
+import random
+import time
+
+from app.config import get_settings
+from app.utils.metrics import metrics
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the breaker is open"""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} indisponível, nova tentativa em {retry_in:.0f}s")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class RetryableResponse(Exception):
+    """Raised internally when a result should count as a failure (e.g. HTTP 5xx)"""
+
+    def __init__(self, result: Any):
+        super().__init__("retryable response")
+        self.result = result
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        min_timeout: float = 2.0,
+        max_timeout: float = 30.0,
+        timeout_multiplier: float = 4.0,
+        max_retries: int = 2,
+        backoff_base: float = 0.25,
+        backoff_max: float = 4.0,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._latency_ewma: Dict[str, float] = {}
+        self._half_open_in_flight = False
+
+    # ---------- state ----------
+
+    def timeout(self, operation: str = "default") -> float:
+        """Adaptive timeout: a multiple of the operation's typical latency, within bounds"""
+        latency = self._latency_ewma.get(operation)
+        if latency is None:
+            return self.max_timeout
+        return max(self.min_timeout, min(self.max_timeout, latency * self.timeout_multiplier))
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if self.retry_in() > 0:
+                return False
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            # Só uma chamada de teste por vez enquanto meio-aberto
+            if self._half_open_in_flight:
+                return False
+            self._half_open_in_flight = True
+        return True
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == OPEN and self.retry_in() > 0
+
+    def record_success(self, latency: float, operation: str = "default"):
+        previous = self._latency_ewma.get(operation)
+        self._latency_ewma[operation] = latency if previous is None else 0.8 * previous + 0.2 * latency
+        self.consecutive_failures = 0
+        self._half_open_in_flight = False
+        if self.state != CLOSED:
+            metrics.inc(f"breaker.{self.name}.closed")
+        self.state = CLOSED
+        metrics.inc(f"breaker.{self.name}.success")
+
+    def record_timeout(self, timeout: float, operation: str = "default"):
+        """A timed-out call took at least `timeout`: raises the EWMA to it, then counts as a failure"""
+        previous = self._latency_ewma.get(operation)
+        if previous is not None:
+            # Próximo timeout fica `timeout_multiplier` vezes maior; sucessos trazem de volta
+            self._latency_ewma[operation] = max(previous, timeout)
+        self.record_failure()
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._half_open_in_flight = False
+        metrics.inc(f"breaker.{self.name}.failure")
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                metrics.inc(f"breaker.{self.name}.opened")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    # ---------- calls ----------
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniforme entre 0 e o teto exponencial
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[Any]],
+        is_failure: Callable[[Any], bool] = None,
+        retries: int = None,
+        operation: str = "default",
+    ) -> Any:
+        """
+        Runs `fn()` under the breaker with adaptive timeout and retries.
+
+        `operation` names the latency profile the timeout is derived from
+        (e.g. "chat" vs "insights"); failures of any operation count
+        towards opening the breaker. `is_failure(result)` marks results
+        that should count as failures and be retried (e.g. HTTP 5xx/429);
+        the last such result is returned when retries are exhausted.
+        Raises CircuitOpenError when rejected.
+        """
+        retries = self.max_retries if retries is None else retries
+        attempt = 0
+        while True:
+            if not self.allow():
+                metrics.inc(f"breaker.{self.name}.rejected")
+                raise CircuitOpenError(self.name, self.retry_in())
+
+            # Teste do meio-aberto com o teto: com o timeout adaptado ele falharia
+            # sempre se a latência normal da dependência subiu
+            limit = self.max_timeout if self.state == HALF_OPEN else self.timeout(operation)
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(fn(), timeout=limit)
+                if is_failure and is_failure(result):
+                    raise RetryableResponse(result)
+                self.record_success(time.monotonic() - started, operation)
+                return result
+            except asyncio.CancelledError:
+                # Cancelada (cliente desconectou, shutdown): não é falha da dependência,
+                # mas a vaga de teste do meio-aberto precisa ser liberada
+                self._half_open_in_flight = False
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    self.record_timeout(limit, operation)
+                else:
+                    self.record_failure()
+                if attempt >= retries or self.state == OPEN:
+                    if isinstance(e, RetryableResponse):
+                        return e.result
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": OPEN if self.is_open else (HALF_OPEN if self.state != CLOSED else CLOSED),
+            "consecutive_failures": self.consecutive_failures,
+            "timeout_seconds": {operation: round(self.timeout(operation), 2) for operation in self._latency_ewma},
+            "typical_latency_seconds": {operation: round(latency, 3) for operation, latency in self._latency_ewma.items()},
+            "retry_in_seconds": round(self.retry_in(), 1) if self.state == OPEN else 0,
+        }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str, **overrides) -> CircuitBreaker:
+    """Returns the process-wide breaker for a dependency, creating it on first use"""
+    if name not in _breakers:
+        settings = get_settings()
+        options = {
+            "failure_threshold": settings.breaker_failure_threshold,
+            "reset_timeout": settings.breaker_reset_seconds,
+            "max_retries": settings.breaker_max_retries,
+        }
+        options.update(overrides)
+        _breakers[name] = CircuitBreaker(name, **options)
+    return _breakers[name]
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
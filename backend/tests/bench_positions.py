@@ -0,0 +1,78 @@
+"""
+Benchmark of PositionBook (FIFO deal matching) on ~1M synthetic deals.
+
+    cd backend && python -m tests.bench_positions [deals] [--memory]
+
+The mix has scale-ins, partial closes, full closes and INOUT reversals
+over a few concurrent positions, like an active scalping account. Prints
+the throughput of the matching pass and, with --memory, its peak memory
+(tracemalloc).
+"""
+
+from datetime import datetime, timedelta
+import random
+import sys
+import time
+import tracemalloc
+
+from app.services.positions import IN, OUT, INOUT, PositionBook
+
+
+def generate(count: int, seed: int = 1):
+    rnd = random.Random(seed)
+    now = datetime(2020, 1, 1)
+    open_volume = {}
+    next_position = 0
+    deals = []
+
+    def emit(position, side, entry, volume):
+        deals.append((position, side, entry, volume, now.isoformat(), len(deals)))
+
+    while len(deals) < count:
+        now += timedelta(seconds=30)
+        roll = rnd.random()
+        if len(open_volume) < 3 or roll < 0.35:
+            next_position += 1
+            open_volume[next_position] = 1.0
+            emit(next_position, "BUY", IN, 1.0)
+            continue
+        position = rnd.choice(list(open_volume))
+        if roll < 0.45:
+            open_volume[position] += 0.5
+            emit(position, "BUY", IN, 0.5)
+        elif roll < 0.65 and open_volume[position] > 0.5:
+            open_volume[position] -= 0.5
+            emit(position, "SELL", OUT, 0.5)
+        elif roll < 0.7:
+            # Reversão: fecha a compra e fica 1.0 vendido, zerado no deal seguinte
+            emit(position, "SELL", INOUT, open_volume.pop(position) + 1.0)
+            emit(position, "BUY", OUT, 1.0)
+        else:
+            emit(position, "SELL", OUT, open_volume.pop(position))
+    return deals
+
+
+def run(count: int, memory: bool = False):
+    deals = generate(count)
+    if memory:
+        # tracemalloc deixa o loop várias vezes mais lento: só com --memory
+        tracemalloc.start()
+    book = PositionBook()
+    trades = 0
+    started = time.perf_counter()
+    for position, side, entry, volume, when, deal_id in deals:
+        trades += len(book.apply(position, "EURUSD", side, entry, volume, 1.1, when, deal_id=deal_id))
+    elapsed = time.perf_counter() - started
+    line = (
+        f"{len(deals):,} deals in {elapsed:.2f}s ({len(deals) / elapsed:,.0f} deals/s), "
+        f"{trades:,} trades, {len(book.positions)} open, {book.unmatched_exits} unmatched"
+    )
+    if memory:
+        line += f", peak {tracemalloc.get_traced_memory()[1] / 1024:.0f} KiB"
+        tracemalloc.stop()
+    print(line)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--memory"]
+    run(int(args[0]) if args else 1_000_000, memory="--memory" in sys.argv)
@@ -0,0 +1,76 @@
+import os
+import tempfile
+
+# Antes de qualquer import de app.*: banco descartável e nada de rede real
+_tmp = tempfile.mkdtemp(prefix="tradestars-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp}/test.db")
+os.environ.setdefault("JOB_SPOOL_DIR", f"{_tmp}/job_files")
+os.environ["METAAPI_BASE_URL"] = "http://stub"
+
+import asyncio
+
+import httpx
+import pytest
+
+from app import database
+from app.services import metaapi_service
+from app.utils import resilience
+from tests.stubs import metaapi as metaapi_stub
+from tests.stubs import openai as openai_stub
+
+STUB_URL = "http://stub"
+
+
+@pytest.fixture(autouse=True)
+def fresh_dependencies():
+    """Breakers, caches e stubs são globais do processo; cada teste começa do zero"""
+    resilience._breakers.clear()
+    metaapi_service._account_cache.clear()
+    metaapi_service._account_info_cache = metaapi_service.TTLCache(0)
+    metaapi_stub.state.update(mode="ok", latency=0.0, requests=0)
+    openai_stub.state.update(mode="ok", requests=0)
+    yield
+
+
+def run(coro):
+    """asyncio.run que devolve as conexões do banco no mesmo loop (os pools são globais)"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await database.engine.dispose()
+            await database.read_engine.dispose()
+
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def metaapi_http(monkeypatch):
+    """Serviços criados internamente (sync, scheduler) falam com o stub"""
+    monkeypatch.setattr(metaapi_service, "get_http_client", lambda: stub_client(metaapi_stub.app))
+
+
+@pytest.fixture
+def db_tables():
+    run(database.create_tables())
+
+
+def stub_client(app) -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url=STUB_URL)
+
+
+def metaapi_client(account_id: str = "acc-1", api_token: str = "token") -> metaapi_service.MetaAPIService:
+    """MetaAPIService apontado para o stub (in-process)"""
+    service = metaapi_service.MetaAPIService(api_token, account_id)
+    service.base_url = STUB_URL
+    service._client = stub_client(metaapi_stub.app)
+    service._owns_client = True
+    return service
+
+
+def breaker(name: str, **options) -> resilience.CircuitBreaker:
+    """Registra o breaker do processo com parâmetros de teste (timeouts e backoff curtos)"""
+    options = {"failure_threshold": 3, "reset_timeout": 0.2, "max_retries": 1,
+               "backoff_base": 0.001, "max_timeout": 1.0, "min_timeout": 0.05, **options}
+    resilience._breakers[name] = resilience.CircuitBreaker(name, **options)
+    return resilience._breakers[name]
@@ -0,0 +1,85 @@
+"""
+Fault-injecting stub of the MetaAPI REST endpoints used by MetaAPIService.
+
+Used in-process by the tests (httpx.ASGITransport) or as a local server:
+
+    uvicorn tests.stubs.metaapi:app --port 8001
+    METAAPI_BASE_URL=http://localhost:8001
+
+POST /mode/{mode} switches the failure mode: ok, down (503), slow
+(answers after `slow_seconds`), ratelimit (429 + Retry-After).
+
+The history endpoint serves one position per hour from 2020-01-01: entry
+at :00 and exit 50 minutes later, except every 5th position that stays
+open for almost 3 hours (so positions cross window boundaries). Like the
+real API, both ends of the range are inclusive.
+"""
+
+from datetime import datetime, timedelta
+import asyncio
+
+from fastapi import FastAPI, Response
+
+BASE = datetime(2020, 1, 1)
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.000Z"
+
+app = FastAPI()
+state = {"mode": "ok", "slow_seconds": 5.0, "retry_after": 7, "latency": 0.0, "requests": 0}
+
+
+def position_deals(hour: int):
+    """Entry and exit deals of the position opened `hour` hours after BASE"""
+    opened = BASE + timedelta(hours=hour)
+    closed = opened + timedelta(minutes=50 if hour % 5 else 170)
+    return [
+        {"id": f"in{hour}", "type": "DEAL_TYPE_BUY", "entryType": "DEAL_ENTRY_IN", "positionId": hour,
+         "symbol": "EURUSD", "volume": 1, "price": 1.1, "time": opened.strftime(TIME_FORMAT)},
+        {"id": f"out{hour}", "type": "DEAL_TYPE_SELL", "entryType": "DEAL_ENTRY_OUT", "positionId": hour,
+         "symbol": "EURUSD", "volume": 1, "price": 1.2, "profit": 10.0, "time": closed.strftime(TIME_FORMAT)},
+    ]
+
+
+def deals_between(start: datetime, end: datetime):
+    first = max(0, int((start - BASE).total_seconds() // 3600) - 3)
+    last = int((end - BASE).total_seconds() // 3600)
+    deals = [deal for hour in range(first, last + 1) for deal in position_deals(hour)]
+    deals = [deal for deal in deals if start <= datetime.strptime(deal["time"], TIME_FORMAT) <= end]
+    return sorted(deals, key=lambda deal: deal["time"])
+
+
+async def _fault():
+    state["requests"] += 1
+    if state["mode"] == "down":
+        return Response(status_code=503)
+    if state["mode"] == "ratelimit":
+        return Response(status_code=429, headers={"Retry-After": str(state["retry_after"])})
+    if state["mode"] == "slow":
+        await asyncio.sleep(state["slow_seconds"])
+    elif state["latency"]:
+        await asyncio.sleep(state["latency"])
+    return None
+
+
+@app.post("/mode/{mode}")
+async def set_mode(mode: str):
+    state["mode"] = mode
+    return state
+
+
+@app.get("/users/current/accounts/{account_id}")
+async def account(account_id: str):
+    return await _fault() or {
+        "name": "Demo", "login": "1", "server": "Stub-Server", "platform": "mt5", "state": "DEPLOYED"
+    }
+
+
+@app.get("/users/current/accounts/{account_id}/account-information")
+async def account_information(account_id: str):
+    return await _fault() or {"balance": 1000.0, "equity": 1000.0, "currency": "USD", "leverage": 100}
+
+
+@app.get("/users/current/accounts/{account_id}/history-deals/time/{start}/{end}")
+async def history_deals(account_id: str, start: str, end: str):
+    return await _fault() or deals_between(
+        datetime.strptime(start, TIME_FORMAT), datetime.strptime(end, TIME_FORMAT)
+    )
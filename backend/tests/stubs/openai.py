@@ -0,0 +1,47 @@
+"""
+Fault-injecting stub of the OpenAI chat completions endpoint.
+
+Used in-process by the tests (httpx.ASGITransport) or as a local server:
+
+    uvicorn tests.stubs.openai:app --port 8002
+    OPENAI_BASE_URL=http://localhost:8002/v1 OPENAI_API_KEY=stub
+
+POST /mode/{mode} switches the failure mode: ok, down (503), slow
+(answers after `slow_seconds`). Completions carry a fixed insight list.
+"""
+
+import asyncio
+import json
+
+from fastapi import FastAPI, Response
+
+app = FastAPI()
+state = {"mode": "ok", "slow_seconds": 5.0, "requests": 0}
+
+INSIGHTS = [{
+    "type": "info", "category": "general", "title": "Stub",
+    "description": "Resposta do stub", "action": "Nenhuma",
+}]
+
+
+@app.post("/mode/{mode}")
+async def set_mode(mode: str):
+    state["mode"] = mode
+    return state
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(body: dict):
+    state["requests"] += 1
+    if state["mode"] == "down":
+        return Response(status_code=503)
+    if state["mode"] == "slow":
+        await asyncio.sleep(state["slow_seconds"])
+    return {
+        "id": "stub", "object": "chat.completion", "created": 0, "model": body["model"],
+        "choices": [{
+            "index": 0, "finish_reason": "stop",
+            "message": {"role": "assistant", "content": json.dumps(INSIGHTS)},
+        }],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+    }
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app.services.behavior import BehaviorAnalyzer
+
+
+def _analyzer(profits, volumes):
+    start = datetime(2024, 3, 4, 9)
+    rows = [
+        (start + timedelta(minutes=10 * i), start + timedelta(minutes=10 * i + 5), profit, volume)
+        for i, (profit, volume) in enumerate(zip(profits, volumes))
+    ]
+    return BehaviorAnalyzer.from_rows(rows)
+
+
+def test_single_outlier_does_not_flag_size_escalation():
+    # Mão constante depois de losses e gains, exceto um 1 -> 100 isolado
+    profits = [-10, 5] * 20
+    volumes = [1.0] * 40
+    volumes[21] = 100.0
+    volumes[22] = 1.0
+    report = _analyzer(profits, volumes).report()
+
+    after_loss = report["volume_escalation"]["after_loss"]
+    assert after_loss["median_size_ratio"] == 1.0
+    assert after_loss["typical_size_ratio"] < 1.3
+    assert "size_escalation_after_losses" not in report["signals"]
+
+
+def test_consistent_doubling_after_losses_is_flagged():
+    profits, volumes, size = [], [], 1.0
+    for i in range(30):
+        loss = i % 3 != 2
+        profits.append(-10 if loss else 10)
+        volumes.append(size)
+        size = size * 2 if loss else 1.0
+    report = _analyzer(profits, volumes).report()
+
+    after_loss = report["volume_escalation"]["after_loss"]
+    assert after_loss["typical_size_ratio"] == 2.0
+    assert "size_escalation_after_losses" in report["signals"]
+
+
+def test_zero_volume_ratios_are_ignored():
+    report = _analyzer([-10, -10, 5], np.array([1.0, 0.0, 1.0])).report()
+    assert report["volume_escalation"]["after_loss"] is None
@@ -0,0 +1,57 @@
+import io
+import os
+
+from sqlalchemy import select
+
+from app import database
+from app.config import get_settings
+from app.models.uploaded_file import UploadedFile
+from app.services import bulk_import
+from tests.conftest import run
+
+SAMPLE = os.path.join(os.path.dirname(__file__), "..", "..", "sample_trades.csv")
+
+
+def _statements():
+    with open(SAMPLE, "rb") as f:
+        header, *lines = f.read().splitlines(keepends=True)
+    return header + b"".join(lines[:20]), header + b"".join(lines[20:40]), header + b"".join(lines[40:])
+
+
+def test_write_error_fails_only_its_file(db_tables, monkeypatch):
+    monkeypatch.setattr(get_settings(), "import_workers", 1)
+    first, second, earlier = _statements()
+    insert_trades, calls = bulk_import.insert_trades, []
+
+    async def failing_once(db, user_id, trades, source):
+        calls.append(source)
+        if len(calls) == 2:
+            raise RuntimeError("disk I/O error")
+        return await insert_trades(db, user_id, trades, source)
+
+    monkeypatch.setattr(bulk_import, "insert_trades", failing_once)
+
+    async def scenario():
+        async with database.async_session() as db:
+            # Layout e ledger já carregados quando a falha acontece (o rollback os expira)
+            await bulk_import.import_files(db, 51, [("dec.csv", io.BytesIO(earlier))])
+            result = await bulk_import.import_files(
+                db, 51, [("jan.csv", io.BytesIO(first)), ("feb.csv", io.BytesIO(second))]
+            )
+            # O arquivo que falhou não entrou no ledger: reenviar importa normalmente
+            again = await bulk_import.import_files(db, 51, [("jan.csv", io.BytesIO(first))])
+        async with database.read_session() as db:
+            ledger = (await db.execute(select(UploadedFile.filename).where(UploadedFile.user_id == 51))).scalars().all()
+        return result, again, ledger
+
+    try:
+        result, again, ledger = run(scenario())
+    finally:
+        bulk_import.shutdown_import_pool()
+
+    jan, feb = result["files"]
+    assert jan["errors"] == ["Erro ao gravar: disk I/O error"] and jan["imported"] == 0
+    assert not feb["errors"] and feb["imported"] == 20
+    assert result["failed_files"] == 1
+    assert again["files"][0]["imported"] == 20 and not again["files"][0].get("already_imported")
+    assert sorted(ledger) == ["dec.csv", "feb.csv", "jan.csv"]
@@ -0,0 +1,54 @@
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import database
+from app.models.trade import Trade
+from app.routers.trades import create_trade, update_trade
+from app.schemas.trade import TradeCreate, TradeUpdate
+from app.services import data_migrations
+from app.services.trade_writer import insert_trades, natural_key
+from tests.conftest import run
+
+ROW = {"symbol": "WINZ24", "trade_type": "BUY", "volume": 1.0, "entry_price": 120000.0,
+       "profit": 50.0, "open_time": datetime(2024, 3, 1, 10, 0)}
+
+
+def test_migrations_run_once(db_tables, monkeypatch):
+    calls = []
+
+    async def migrate(db):
+        calls.append(1)
+        return 0
+
+    monkeypatch.setattr(data_migrations, "MIGRATIONS", [("test_once", migrate)])
+
+    async def scenario():
+        for _ in range(2):
+            async with database.async_session() as db:
+                await data_migrations.run_data_migrations(db)
+
+    run(scenario())
+    assert calls == [1]
+
+
+def test_manual_trade_is_recognized_by_later_import(db_tables):
+    async def scenario():
+        async with database.async_session() as db:
+            created = await create_trade(TradeCreate(**ROW), user_id=21, db=db)
+            imported, skipped = await insert_trades(db, 21, [dict(ROW)], "CSV")
+            await db.commit()
+        return created, imported, skipped
+
+    created, imported, skipped = run(scenario())
+    assert (imported, skipped) == (0, 1)
+
+
+def test_update_recomputes_natural_key(db_tables):
+    async def scenario():
+        async with database.async_session() as db:
+            created = await create_trade(TradeCreate(**ROW), user_id=22, db=db)
+            await update_trade(created.id, TradeUpdate(profit=-30.0), user_id=22, db=db)
+            return (await db.execute(select(Trade.natural_key).where(Trade.id == created.id))).scalar()
+
+    assert run(scenario()) == natural_key({**ROW, "profit": -30.0})
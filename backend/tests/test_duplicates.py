@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from app import database
+from app.config import get_settings
+from app.models.trade import Trade
+from app.routers.trades import create_trade, update_trade
+from app.schemas.trade import TradeCreate, TradeUpdate
+from app.services.duplicate_matcher import rebuild_duplicates
+from app.services.trade_writer import insert_trades
+from tests.conftest import run
+
+OPEN = datetime(2024, 5, 2, 14, 0)
+ROW = {"symbol": "EURUSD", "trade_type": "SELL", "volume": 0.5, "entry_price": 1.0712, "profit": 12.0}
+
+
+def test_update_rematches_old_and_new_windows(db_tables):
+    async def duplicate_of(db, trade_id):
+        return (await db.execute(select(Trade.duplicate_of).where(Trade.id == trade_id))).scalar()
+
+    async def scenario():
+        async with database.async_session() as db:
+            await insert_trades(db, 31, [{**ROW, "open_time": OPEN, "external_id": "deal-1"}], "METAAPI")
+            await db.commit()
+            broker = (await db.execute(select(Trade.id).where(Trade.user_id == 31))).scalar()
+            manual = await create_trade(TradeCreate(**ROW, open_time=OPEN + timedelta(hours=3)), user_id=31, db=db)
+            states = [await duplicate_of(db, manual.id)]
+
+            # Movido para o horário do deal da corretora: vira duplicata dele
+            await update_trade(manual.id, TradeUpdate(open_time=OPEN + timedelta(seconds=5)), user_id=31, db=db)
+            states.append(await duplicate_of(db, manual.id))
+
+            # Movido de volta: a marcação da janela antiga é desfeita
+            await update_trade(manual.id, TradeUpdate(open_time=OPEN + timedelta(hours=3)), user_id=31, db=db)
+            states.append(await duplicate_of(db, manual.id))
+        return broker, states
+
+    broker, states = run(scenario())
+    assert states == [None, broker, None]
+
+
+def _broker_and_statement(user_id: int):
+    """Same execution: MetaAPI in UTC, CSV statement in the broker's server time (UTC+3)"""
+    async def scenario():
+        async with database.async_session() as db:
+            await insert_trades(db, user_id, [{**ROW, "open_time": OPEN, "external_id": "deal-tz"}], "METAAPI")
+            # Outro trade do extrato, 1h depois em UTC: não pode casar com nada
+            await insert_trades(db, user_id, [
+                {**ROW, "open_time": OPEN + timedelta(hours=3, seconds=20)},
+                {**ROW, "open_time": OPEN + timedelta(hours=4), "profit": 3.0},
+            ], "CSV")
+            await db.commit()
+            rows = (await db.execute(
+                select(Trade.source, Trade.id, Trade.duplicate_of).where(Trade.user_id == user_id).order_by(Trade.open_time)
+            )).all()
+            rebuilt = await rebuild_duplicates(db, user_id)
+        return rows, rebuilt
+
+    return run(scenario())
+
+
+def test_cross_source_offset_is_not_matched_without_configuration(db_tables):
+    rows, rebuilt = _broker_and_statement(32)
+    assert all(row.duplicate_of is None for row in rows)
+    assert rebuilt["duplicates"] == 0
+
+
+def test_cross_source_pair_matches_with_utc_offset(db_tables, monkeypatch):
+    monkeypatch.setattr(get_settings(), "duplicate_source_utc_offset_hours", {"CSV": 3})
+    rows, rebuilt = _broker_and_statement(33)
+    broker, statement, later = rows
+    assert broker.source == "METAAPI" and broker.duplicate_of is None
+    assert statement.duplicate_of == broker.id
+    assert later.duplicate_of is None
+    # Varredura completa (fontes mescladas em UTC) chega ao mesmo resultado
+    assert rebuilt["duplicates"] == 1 and rebuilt["changed"] == 0
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from app.services.insight_rules import RULES, RuleEngine, extract_features, trades_to_frame
+
+MONDAY = datetime(2024, 6, 3, 10)
+
+
+def _frame(rows):
+    """rows: (symbol, profit, open_time)"""
+    return trades_to_frame(SimpleNamespace(symbol=s, profit=p, open_time=t) for s, p, t in rows)
+
+
+def _with_title(insights, title):
+    return [i for i in insights if title in i["title"]]
+
+
+def test_breakeven_trades_are_neither_wins_nor_losses():
+    df = _frame([
+        ("WIN", 100.0, MONDAY),
+        ("WIN", 0.0, MONDAY + timedelta(minutes=5)),
+        ("WIN", -40.0, MONDAY + timedelta(minutes=10)),
+        ("WDO", None, MONDAY + timedelta(hours=1)),
+    ])
+    f = extract_features(df)
+
+    assert (f["winning_trades"], f["losing_trades"], f["total_trades"]) == (1, 1, 4)
+    assert f["hourly_performance"][10] == {"wins": 1, "losses": 1, "profit": 60.0}
+    assert f["hourly_performance"][11] == {"wins": 0, "losses": 0, "profit": 0.0}
+    assert f["symbol_performance"]["WIN"] == {"wins": 1, "losses": 1, "profit": 60.0, "trades": 3}
+    # As contagens agrupadas batem com os totais
+    assert sum(s["losses"] for s in f["symbol_performance"].values()) == f["losing_trades"]
+
+
+def test_extract_features_aggregates():
+    profits = [50.0, -20.0, -30.0, -10.0, 80.0, 40.0]
+    df = _frame([("WIN", p, MONDAY + timedelta(days=i // 3, hours=i)) for i, p in enumerate(profits)])
+    f = extract_features(df)
+
+    assert f["win_rate"] == 50.0
+    assert f["total_profit"] == 110.0
+    assert (f["average_win"], f["average_loss"]) == (56.67, 20.0)
+    assert (f["best_trade"], f["worst_trade"]) == (80.0, -30.0)
+    assert f["profit_factor"] == round(170 / 60, 2)
+    assert (f["max_win_streak"], f["max_loss_streak"]) == (2, 3)
+    assert f["weekday_performance"] == {
+        "Monday": {"trades": 3, "profit": 0.0},
+        "Tuesday": {"trades": 3, "profit": 110.0},
+    }
+
+
+def test_streaks_follow_open_time_not_input_order():
+    rows = [("WIN", -10.0, MONDAY + timedelta(hours=h)) for h in (0, 2, 4)]
+    rows += [("WIN", 10.0, MONDAY + timedelta(hours=h)) for h in (1, 3)]
+    f = extract_features(_frame(rows), ["max_loss_streak", "max_win_streak"])
+    assert f == {"max_loss_streak": 1, "max_win_streak": 1}
+
+
+def test_rule_engine_runs_rules_over_trades():
+    losing = [("WDO", -50.0, MONDAY + timedelta(minutes=i)) for i in range(5)]
+    winning = [("WIN", 20.0, MONDAY + timedelta(hours=4, minutes=i)) for i in range(6)]
+    insights = RuleEngine().run(_frame(losing + winning))
+
+    assert _with_title(insights, "Possível Revenge Trading")
+    assert _with_title(insights, "Baixo Win Rate em WDO")
+    assert _with_title(insights, "Excelente em WIN")
+    assert _with_title(insights, "Melhor Horário: 14:00")
+    assert _with_title(insights, "Horário Problemático: 10:00")
+    assert not _with_title(insights, "Win Rate Abaixo")
+    assert {i["category"] for i in insights} <= {"general", "risk", "psychology", "timing", "symbol"}
+
+
+def test_rule_engine_skips_rules_without_their_features():
+    revenge = [r for r in RULES if r.name == "revenge_trading"]
+    engine = RuleEngine(revenge)
+
+    assert engine.required_features == ["max_loss_streak"]
+    assert engine.evaluate({"win_rate": 10.0}) == []
+    assert len(engine.evaluate({"max_loss_streak": 3})) == 1
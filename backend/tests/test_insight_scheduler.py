@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+import json
+
+from openai import AsyncOpenAI
+from sqlalchemy import select
+
+from app import database
+from app.models.insight import InsightSnapshot
+from app.services import insight_scheduler
+from app.services.ai_service import AIService
+from app.services.insight_scheduler import InsightScheduler
+from app.services.trade_writer import insert_trades
+from app.utils.metrics import metrics
+from tests.conftest import STUB_URL, breaker, run, stub_client
+from tests.stubs import openai as openai_stub
+
+
+def _stub_ai_service() -> AIService:
+    """AIService do scheduler apontado para o stub da OpenAI"""
+    service = AIService()
+    service.settings = service.settings.model_copy(update={"openai_api_key": "stub"})
+    service._client = AsyncOpenAI(
+        api_key="stub", base_url=f"{STUB_URL}/v1", max_retries=0, http_client=stub_client(openai_stub.app)
+    )
+    return service
+
+
+async def _seed_trades(user_id: int, n: int = 12):
+    start = datetime(2024, 3, 4, 10)
+    rows = [
+        {"symbol": "WINJ24", "trade_type": "BUY", "volume": 1, "entry_price": 100.0, "exit_price": 101.0,
+         "profit": 50.0 if i % 3 else -80.0, "open_time": start + timedelta(hours=i),
+         "close_time": start + timedelta(hours=i, minutes=30), "duration_minutes": 30}
+        for i in range(n)
+    ]
+    async with database.async_session() as db:
+        await insert_trades(db, user_id, rows, "CSV")
+        await db.commit()
+
+
+async def _snapshot(user_id: int):
+    async with database.async_session() as db:
+        result = await db.execute(select(InsightSnapshot).where(InsightSnapshot.user_id == user_id))
+        return result.scalar_one_or_none()
+
+
+async def _drain(scheduler: InsightScheduler):
+    await scheduler.start()
+    try:
+        await scheduler.queue.join()
+    finally:
+        await scheduler.stop()
+
+
+def test_scheduler_stores_model_insights_and_dedupes_queue(db_tables, monkeypatch):
+    breaker("openai")
+    monkeypatch.setattr(insight_scheduler, "AIService", _stub_ai_service)
+    generated = metrics.counter("insights.scheduler.generated")
+    tokens = metrics.counter("insights.scheduler.tokens")
+
+    async def scenario():
+        await _seed_trades(71)
+        scheduler = InsightScheduler(workers=1, tokens_per_minute=100_000)
+        await scheduler.enqueue_changed_users()
+        queued = 71 in scheduler._queued
+        # Já na fila: uma segunda rodada não enfileira o usuário de novo
+        await scheduler.enqueue_changed_users()
+        pending = list(scheduler.queue._queue).count(71)
+        await _drain(scheduler)
+        snapshot = await _snapshot(71)
+        # Snapshot atual: nada a regerar para o usuário
+        await scheduler.enqueue_changed_users()
+        requeued = 71 in scheduler._queued
+        return queued, pending, snapshot, requeued
+
+    queued, pending, snapshot, requeued = run(scenario())
+    assert queued and pending == 1
+    assert snapshot is not None and snapshot.source == "SCHEDULER"
+    assert json.loads(snapshot.insights) == openai_stub.INSIGHTS
+    assert snapshot.trades_analyzed == 12
+    assert not requeued
+    assert metrics.counter("insights.scheduler.generated") > generated
+    # Consumo real informado pelo stub (150 tokens por chamada) entra na conta do rate limiter
+    assert metrics.counter("insights.scheduler.tokens") - tokens >= 150
+
+
+def test_scheduler_does_not_store_fallback_insights(db_tables, monkeypatch):
+    breaker("openai", max_retries=0)
+    monkeypatch.setattr(insight_scheduler, "AIService", _stub_ai_service)
+    openai_stub.state["mode"] = "down"
+    fallback = metrics.counter("insights.scheduler.fallback")
+
+    async def scenario():
+        await _seed_trades(72)
+        scheduler = InsightScheduler(workers=1, tokens_per_minute=100_000)
+        scheduler._queued.add(72)
+        scheduler.queue.put_nowait(72)
+        await _drain(scheduler)
+        return await _snapshot(72), scheduler._queued
+
+    snapshot, queued = run(scenario())
+    assert openai_stub.state["requests"] >= 1
+    assert snapshot is None
+    assert metrics.counter("insights.scheduler.fallback") - fallback == 1
+    assert 72 not in queued
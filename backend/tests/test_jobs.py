@@ -0,0 +1,86 @@
+import asyncio
+import sqlite3
+from urllib.parse import urlparse
+
+from app import database
+from app.services.jobs import JobRunner, enqueue_job, job_handler
+from tests.conftest import run
+
+received = []
+
+
+@job_handler("test_secret")
+async def _secret_job(job, payload):
+    received.append(payload)
+    return {"ok": True}
+
+
+def _raw_job(job_id: int):
+    path = urlparse(database.settings.database_url.replace("sqlite+aiosqlite", "sqlite")).path
+    return sqlite3.connect(path).execute("SELECT payload, secrets FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def test_secrets_are_encrypted_and_cleared(db_tables):
+    received.clear()
+
+    async def scenario():
+        async with database.async_session() as db:
+            job = await enqueue_job(db, "test_secret", {"account_id": "a"}, user_id=1,
+                                    unique=True, secrets={"api_token": "s3cret"})
+            again = await enqueue_job(db, "test_secret", {"account_id": "a"}, user_id=1,
+                                      unique=True, secrets={"api_token": "s3cret"})
+        queued = _raw_job(job.id)
+        runner = JobRunner(poll_seconds=0.05)
+        row = await runner.claim_next("test_secret")
+        await runner._run("test_secret", _secret_job, row)
+        return job, again, queued
+
+    job, again, queued = run(scenario())
+    # Credenciais fora do payload: `unique` continua casando
+    assert again.id == job.id
+    assert "s3cret" not in queued[0] and "s3cret" not in queued[1]
+    assert received == [{"account_id": "a", "api_token": "s3cret"}]
+    payload, secrets = _raw_job(job.id)
+    assert payload == "{}" and secrets is None
+
+
+@job_handler("test_idle")
+async def _idle_job(job, payload):
+    received.append(payload)
+    return None
+
+
+def test_idle_workers_only_take_the_writer_for_due_jobs(db_tables):
+    received.clear()
+    runner = JobRunner(poll_seconds=0.02)
+    claims = []
+    claim_next = runner.claim_next
+
+    async def counting_claim(kind):
+        claims.append(kind)
+        return await claim_next(kind)
+
+    runner.claim_next = counting_claim
+
+    async def scenario():
+        runner._wakeups["test_idle"] = asyncio.Event()
+        worker = asyncio.create_task(runner._worker("test_idle"))
+        await asyncio.sleep(0.2)
+        idle_claims = len(claims)
+
+        async with database.async_session() as db:
+            # Job agendado: o worker dorme até o run_after, sem claims no caminho
+            await enqueue_job(db, "test_idle", {"n": 1}, delay=0.3)
+        runner.wake("test_idle")
+        await asyncio.sleep(0.15)
+        early = list(received)
+        await asyncio.sleep(0.4)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+        return idle_claims, early
+
+    idle_claims, early = run(scenario())
+    assert idle_claims == 0
+    assert early == []
+    assert received == [{"n": 1}]
+    assert claims == ["test_idle"]
@@ -0,0 +1,73 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from tests.conftest import breaker, metaapi_client
+from tests.stubs import metaapi as metaapi_stub
+
+
+def _history(start: datetime, end: datetime, window_days: int = 7, concurrency: int = 4):
+    async def scenario():
+        service = metaapi_client()
+        service._window_days = window_days
+        service._concurrency = concurrency
+        result = await service.get_history_range(start, end)
+        await service.close()
+        return result
+
+    return asyncio.run(scenario())
+
+
+def test_windows_pair_every_position_across_boundaries():
+    breaker("metaapi")
+    start = datetime(2020, 1, 1)
+    end = start + timedelta(days=30)
+    result = _history(start, end)
+
+    assert result["success"]
+    expected = metaapi_stub.deals_between(start, end)
+    # O stub devolve as fronteiras nas duas janelas; cada deal conta uma vez só
+    assert result["total_deals"] == len(expected)
+    closed = {deal["positionId"] for deal in expected if deal["entryType"] == "DEAL_ENTRY_OUT"}
+    opened = {deal["positionId"] for deal in expected if deal["entryType"] == "DEAL_ENTRY_IN"}
+    assert len(result["trades"]) == len(closed & opened)
+    assert len({trade["exit_deal_id"] for trade in result["trades"]}) == len(result["trades"])
+    # Ordem cronológica preservada entre as janelas
+    close_times = [trade["close_time"] for trade in result["trades"]]
+    assert close_times == sorted(close_times)
+
+
+def test_window_size_does_not_change_the_result():
+    breaker("metaapi")
+    start = datetime(2020, 2, 1, 7, 30)
+    end = start + timedelta(days=20)
+    single = _history(start, end, window_days=30, concurrency=1)
+    windowed = _history(start, end, window_days=1, concurrency=8)
+    assert [t["exit_deal_id"] for t in windowed["trades"]] == [t["exit_deal_id"] for t in single["trades"]]
+
+
+def test_windows_run_concurrently():
+    breaker("metaapi")
+    metaapi_stub.state["latency"] = 0.1
+    start = datetime(2020, 1, 1)
+    end = start + timedelta(days=16)
+
+    started = datetime.now()
+    _history(start, end, window_days=1, concurrency=16)
+    # 16 janelas de 0.1s em paralelo, não 1.6s em sequência
+    assert (datetime.now() - started).total_seconds() < 1.0
+
+
+def test_failed_window_fails_the_whole_fetch():
+    breaker("metaapi", failure_threshold=100)
+    metaapi_stub.state["mode"] = "down"
+    result = _history(datetime(2020, 1, 1), datetime(2020, 1, 20))
+    assert not result["success"]
+    assert result["trades"] == []
+
+
+def test_rate_limit_surfaces_retry_after():
+    breaker("metaapi", failure_threshold=100)
+    metaapi_stub.state.update(mode="ratelimit", retry_after=7)
+    result = _history(datetime(2020, 1, 1), datetime(2020, 1, 3))
+    assert result["rate_limited"]
+    assert result["retry_after"] == 7
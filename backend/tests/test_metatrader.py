@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+from app.config import get_settings
+from app.services.metatrader_service import MetaTraderService, MetaTraderTimeout
+
+
+@pytest.fixture
+def mt5_stub_terminal(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "mt5_use_stub", True)
+    monkeypatch.setattr(settings, "mt5_stub_latency_ms", 0)
+    return settings
+
+
+def test_connect_timeout_is_raised_not_swallowed(mt5_stub_terminal, monkeypatch):
+    # Terminal travado: cada chamada demora mais que o timeout
+    monkeypatch.setattr(mt5_stub_terminal, "mt5_stub_latency_ms", 500)
+    service = MetaTraderService()
+    service._timeout = 0.1
+    with pytest.raises(MetaTraderTimeout):
+        asyncio.run(service.connect(login=1, password="x", server="Stub"))
+
+
+def test_connect_with_responsive_terminal(mt5_stub_terminal):
+    result = asyncio.run(MetaTraderService().connect(login=1, password="x", server="Stub"))
+    assert result["success"]
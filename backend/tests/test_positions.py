@@ -0,0 +1,205 @@
+import copy
+import json
+from datetime import datetime, timedelta
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from app.services.positions import IN, OUT, INOUT, PositionBook
+
+START = datetime(2024, 1, 1)
+
+
+class NaiveBook:
+    """
+    Reference implementation: the FIFO rules written as plainly as possible
+    (lists of dicts, no in-place lot splitting tricks), to check PositionBook.
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.unmatched = 0
+
+    def apply(self, pid, side, entry, volume, price, time, deal_id, commission):
+        key = str(pid)
+        if entry == IN:
+            pos = self.positions.setdefault(key, {"side": side, "lots": [], "exits": 0})
+            pos["lots"].append({"volume": volume, "price": price, "time": time, "commission": commission, "id": deal_id})
+            return []
+        pos = self.positions.get(key)
+        if pos is None or not pos["lots"]:
+            if entry == INOUT:
+                self.positions[key] = {"side": side, "exits": 0, "lots": [
+                    {"volume": volume, "price": price, "time": time, "commission": commission, "id": deal_id}
+                ]}
+            else:
+                self.unmatched += 1
+            return []
+
+        first = pos["lots"][0]
+        taken = []
+        remaining = volume
+        while pos["lots"] and remaining > 1e-9:
+            lot = pos["lots"][0]
+            take = min(lot["volume"], remaining)
+            share = take / lot["volume"]
+            taken.append((take, lot["price"], lot["commission"] * share))
+            lot["commission"] -= lot["commission"] * share
+            lot["volume"] -= take
+            remaining -= take
+            if lot["volume"] <= 1e-9:
+                pos["lots"].pop(0)
+        closed = sum(t[0] for t in taken)
+        pos["exits"] += 1
+        flat = not pos["lots"]
+        if flat:
+            del self.positions[key]
+        trade = {
+            "position_id": key,
+            "type": pos["side"],
+            "volume": closed,
+            "entry_price": sum(t[0] * t[1] for t in taken) / closed,
+            "exit_price": price,
+            "open_time": first["time"],
+            "close_time": time,
+            "commission": sum(t[2] for t in taken) + commission,
+            "entry_deal_id": first["id"],
+            "exit_deal_id": deal_id,
+            "partial": not (flat and pos["exits"] == 1),
+        }
+        if entry == INOUT and volume - closed > 1e-9:
+            self.positions[key] = {"side": side, "exits": 0, "lots": [
+                {"volume": volume - closed, "price": price, "time": time, "commission": 0.0, "id": deal_id}
+            ]}
+        return [trade]
+
+    def open_volume(self):
+        return {key: sum(lot["volume"] for lot in pos["lots"]) for key, pos in self.positions.items() if pos["lots"]}
+
+
+# Deal: (position, side, entry, volume, price, commission); tempo e id vêm da posição na lista
+deal_strategy = st.tuples(
+    st.integers(min_value=1, max_value=4),
+    st.sampled_from(["BUY", "SELL"]),
+    st.sampled_from([IN, IN, OUT, INOUT]),
+    st.integers(min_value=1, max_value=40).map(lambda v: v / 10),
+    st.integers(min_value=9000, max_value=11000).map(lambda p: p / 10000),
+    st.sampled_from([0.0, 0.5, 1.25]),
+)
+deals_strategy = st.lists(deal_strategy, max_size=60)
+
+
+def _deals(raw):
+    return [
+        (pid, side, entry, volume, price, (START + timedelta(minutes=i)).isoformat(), f"d{i}", commission)
+        for i, (pid, side, entry, volume, price, commission) in enumerate(raw)
+    ]
+
+
+def _apply(book: PositionBook, deal):
+    pid, side, entry, volume, price, time, deal_id, commission = deal
+    return book.apply(pid, "EURUSD", side, entry, volume, price, time, deal_id=deal_id, commission=commission)
+
+
+def _comparable(trade):
+    keys = ("position_id", "type", "exit_price", "open_time", "close_time", "entry_deal_id", "exit_deal_id", "partial")
+    return (
+        {key: trade[key] for key in keys},
+        pytest.approx(trade["volume"]),
+        pytest.approx(trade["entry_price"]),
+        pytest.approx(trade["commission"]),
+    )
+
+
+@settings(max_examples=300, deadline=None)
+@given(deals_strategy)
+def test_matches_naive_reference(raw):
+    deals = _deals(raw)
+    book, naive = PositionBook(), NaiveBook()
+    for deal in deals:
+        got = _apply(book, deal)
+        expected = naive.apply(*deal)
+        assert len(got) == len(expected)
+        for g, e in zip(got, expected):
+            fields, volume, entry_price, commission = _comparable(e)
+            assert {key: g[key] for key in fields} == fields
+            assert g["volume"] == volume and g["entry_price"] == entry_price and g["commission"] == commission
+    assert book.unmatched_exits == naive.unmatched
+    open_volume = {key: sum(lot[0] for lot in pos["lots"]) for key, pos in book.positions.items() if pos["lots"]}
+    assert open_volume == pytest.approx(naive.open_volume())
+
+
+@settings(max_examples=300, deadline=None)
+@given(deals_strategy)
+def test_volume_is_conserved(raw):
+    deals = _deals(raw)
+    book = PositionBook()
+    opened = closed = 0.0
+    for deal in deals:
+        before = {key: sum(lot[0] for lot in pos["lots"]) for key, pos in book.positions.items()}
+        trades = _apply(book, deal)
+        after = {key: sum(lot[0] for lot in pos["lots"]) for key, pos in book.positions.items()}
+        closed += sum(trade["volume"] for trade in trades)
+        opened += max(0.0, sum(after.values()) - sum(before.values()) + sum(trade["volume"] for trade in trades))
+    still_open = sum(lot[0] for pos in book.positions.values() for lot in pos["lots"])
+    assert opened == pytest.approx(closed + still_open)
+
+
+@settings(max_examples=200, deadline=None)
+@given(deals_strategy, st.lists(st.integers(min_value=0, max_value=60), max_size=4), st.integers(0, 5))
+def test_chunked_with_overlap_and_json_state_matches_single_pass(raw, cuts, overlap):
+    deals = _deals(raw)
+    single = PositionBook()
+    expected = [trade for deal in deals for trade in _apply(single, deal)]
+
+    # Syncs sucessivos: estado salvo em JSON entre eles e cada busca repete os últimos deals
+    positions, applied, got = {}, {}, []
+    bounds = sorted({0, len(deals), *[min(c, len(deals)) for c in cuts]})
+    for start, end in zip(bounds, bounds[1:]):
+        book = PositionBook(positions, applied_deals=applied)
+        for deal in deals[max(0, start - overlap):end]:
+            got.extend(_apply(book, deal))
+        positions = json.loads(json.dumps(book.positions))
+        applied = json.loads(json.dumps(book.applied_deals))
+
+    assert got == expected
+    assert positions == json.loads(json.dumps(single.positions))
+
+
+def test_inout_without_open_position_opens_full_volume():
+    book = PositionBook()
+    assert book.apply(7, "EURUSD", "SELL", INOUT, 2.0, 1.1, "2024-01-01T10:00:00", deal_id="r1") == []
+    assert book.unmatched_exits == 0
+    trades = book.apply(7, "EURUSD", "BUY", OUT, 2.0, 1.0, "2024-01-01T11:00:00", deal_id="x1")
+    assert len(trades) == 1
+    assert trades[0]["type"] == "SELL" and trades[0]["volume"] == 2.0 and trades[0]["entry_price"] == 1.1
+
+
+def test_reversal_opens_excess_on_the_other_side():
+    book = PositionBook()
+    book.apply(1, "EURUSD", "BUY", IN, 1.0, 1.0, "2024-01-01T10:00:00", deal_id="a")
+    trades = book.apply(1, "EURUSD", "SELL", INOUT, 3.0, 1.2, "2024-01-01T11:00:00", deal_id="b")
+    assert trades[0]["volume"] == 1.0 and trades[0]["type"] == "BUY"
+    assert book.positions["1"]["side"] == "SELL"
+    assert book.positions["1"]["lots"][0][0] == pytest.approx(2.0)
+
+
+def test_partial_closes_use_fifo_weighted_entry_price():
+    book = PositionBook()
+    book.apply(1, "EURUSD", "BUY", IN, 1.0, 1.0, "2024-01-01T10:00:00", deal_id="a")
+    book.apply(1, "EURUSD", "BUY", IN, 1.0, 2.0, "2024-01-01T10:05:00", deal_id="b")
+    first = book.apply(1, "EURUSD", "SELL", OUT, 1.5, 3.0, "2024-01-01T11:00:00", deal_id="c")[0]
+    second = book.apply(1, "EURUSD", "SELL", OUT, 0.5, 3.0, "2024-01-01T12:00:00", deal_id="d")[0]
+    assert first["entry_price"] == pytest.approx((1.0 * 1.0 + 0.5 * 2.0) / 1.5)
+    assert second["entry_price"] == pytest.approx(2.0)
+    assert first["partial"] and second["partial"]
+    assert book.positions == {}
+
+
+def test_legacy_state_is_converted():
+    legacy = {"9": {"symbol": "EURUSD", "type": "BUY", "volume": 1.0, "entry_price": 1.1,
+                    "open_time": "2024-01-01T10:00:00", "commission": 0.5, "ticket": 99}}
+    book = PositionBook(copy.deepcopy(legacy))
+    trade = book.apply(9, "EURUSD", "SELL", OUT, 1.0, 1.2, "2024-01-01T11:00:00", deal_id=100)[0]
+    assert trade["entry_deal_id"] == 99 and trade["commission"] == pytest.approx(0.5)
+    assert not trade["partial"]
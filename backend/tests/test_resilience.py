@@ -0,0 +1,238 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from openai import AsyncOpenAI
+
+from app.services.ai_service import AIService
+from app.utils.resilience import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+from tests.conftest import STUB_URL, breaker, metaapi_client, stub_client
+from tests.stubs import metaapi as metaapi_stub
+from tests.stubs import openai as openai_stub
+
+
+async def _fail():
+    raise RuntimeError("boom")
+
+
+async def _ok():
+    return "ok"
+
+
+def _open(b: CircuitBreaker):
+    for _ in range(b.failure_threshold):
+        with pytest.raises(RuntimeError):
+            asyncio.run(b.call(_fail, retries=0))
+    assert b.state == OPEN
+
+
+def test_opens_after_consecutive_failures_and_fails_fast():
+    b = CircuitBreaker("t", failure_threshold=3, reset_timeout=60, max_retries=0)
+    _open(b)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(b.call(_ok))
+
+
+def test_half_open_probe_closes_on_success():
+    b = CircuitBreaker("t", failure_threshold=1, reset_timeout=0.01, max_retries=0)
+    _open(b)
+
+    async def scenario():
+        await asyncio.sleep(0.02)
+        return await b.call(_ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert b.state == CLOSED
+
+
+def test_half_open_allows_a_single_probe():
+    b = CircuitBreaker("t", failure_threshold=1, reset_timeout=0.01, max_retries=0)
+    _open(b)
+
+    async def scenario():
+        await asyncio.sleep(0.02)
+        probe = asyncio.create_task(b.call(lambda: asyncio.sleep(0.05)))
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            await b.call(_ok)
+        await probe
+
+    asyncio.run(scenario())
+    assert b.state == CLOSED
+
+
+def test_cancelled_probe_releases_the_half_open_slot():
+    b = CircuitBreaker("t", failure_threshold=1, reset_timeout=0.01, max_retries=0)
+    _open(b)
+
+    async def scenario():
+        await asyncio.sleep(0.02)
+        probe = asyncio.create_task(b.call(lambda: asyncio.sleep(10)))
+        await asyncio.sleep(0.01)
+        assert b.state == HALF_OPEN
+        probe.cancel()
+        await asyncio.gather(probe, return_exceptions=True)
+        # Sem a liberação o breaker rejeitaria todas as chamadas daqui em diante
+        return await b.call(_ok)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert b.state == CLOSED
+
+
+def test_timeouts_adapt_per_operation():
+    b = CircuitBreaker("t", min_timeout=0.05, max_timeout=1.0, timeout_multiplier=4, max_retries=0)
+
+    async def scenario():
+        for _ in range(10):
+            await b.call(_ok, operation="chat")
+        # A operação longa não herda o timeout curto da rápida
+        return await b.call(lambda: asyncio.sleep(0.2, "slow"), operation="insights")
+
+    assert asyncio.run(scenario()) == "slow"
+    assert b.timeout("chat") == pytest.approx(0.05)
+    assert b.timeout("insights") == pytest.approx(0.8, rel=0.2)
+
+
+def test_retryable_result_is_returned_when_retries_run_out():
+    b = CircuitBreaker("t", failure_threshold=10, max_retries=2, backoff_base=0.001)
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        return 503
+
+    assert asyncio.run(b.call(fn, is_failure=lambda status: status >= 500)) == 503
+    assert len(calls) == 3
+    assert b.consecutive_failures == 3
+
+
+def test_metaapi_down_opens_breaker_and_serves_last_known_account():
+    # 1 tentativa + 1 retry: a primeira chamada com o stub fora já abre
+    b = breaker("metaapi", failure_threshold=2)
+
+    async def scenario():
+        service = metaapi_client()
+        ok = await service.test_connection()
+        assert ok["success"] and not ok.get("stale")
+
+        metaapi_stub.state["mode"] = "down"
+        down = await service.test_connection()
+        assert not down["success"]
+        assert b.state == OPEN
+
+        requests = metaapi_stub.state["requests"]
+        stale = await service.test_connection()
+        await service.close()
+        return stale, requests
+
+    stale, requests = asyncio.run(scenario())
+    assert stale["success"] and stale["stale"]
+    assert stale["account"]["server"] == "Stub-Server"
+    # Aberto: responde sem chegar ao stub
+    assert metaapi_stub.state["requests"] == requests
+
+
+def test_metaapi_slow_times_out_with_adaptive_timeout():
+    breaker("metaapi", max_timeout=0.3)
+    metaapi_stub.state.update(mode="slow", slow_seconds=5.0)
+
+    async def scenario():
+        service = metaapi_client()
+        started = asyncio.get_running_loop().time()
+        result = await service.test_connection()
+        await service.close()
+        return result, asyncio.get_running_loop().time() - started
+
+    result, elapsed = asyncio.run(scenario())
+    assert not result["success"]
+    assert "Timeout" in result["message"]
+    assert elapsed < 2
+
+
+def _ai_service() -> AIService:
+    service = AIService()
+    service.settings = service.settings.model_copy(update={"openai_api_key": "stub"})
+    service._client = AsyncOpenAI(
+        api_key="stub", base_url=f"{STUB_URL}/v1", max_retries=0, http_client=stub_client(openai_stub.app)
+    )
+    return service
+
+
+def _trades(n=20):
+    start = datetime(2024, 1, 1, 10)
+    return [
+        SimpleNamespace(
+            symbol="WINZ24", trade_type="BUY", volume=1, entry_price=100.0, exit_price=101.0,
+            profit=50.0 if i % 3 else -80.0, open_time=start + timedelta(hours=i),
+            close_time=start + timedelta(hours=i, minutes=30), duration_minutes=30,
+            commission=0.0, swap=0.0, profit_pips=None, source="CSV",
+        )
+        for i in range(n)
+    ]
+
+
+def test_openai_down_falls_back_to_rules_then_fails_fast():
+    b = breaker("openai", failure_threshold=2, max_retries=0)
+    openai_stub.state["mode"] = "down"
+
+    async def scenario():
+        service = _ai_service()
+        trades = _trades()
+        first, _ = await service.generate_insights(trades)
+        second, _ = await service.generate_insights(trades)
+        requests = openai_stub.state["requests"]
+        third, from_llm = await service.generate_insights(trades)
+        return first, second, third, from_llm, requests
+
+    first, second, third, from_llm, requests = asyncio.run(scenario())
+    assert b.state == OPEN
+    assert first and second and third
+    assert not from_llm
+    assert all(insight["title"] != "Stub" for insight in third)
+    assert openai_stub.state["requests"] == requests
+
+
+def test_openai_ok_returns_model_insights():
+    breaker("openai")
+    insights, from_llm = asyncio.run(_ai_service().generate_insights(_trades()))
+    assert insights == openai_stub.INSIGHTS and from_llm
+
+
+def test_timeout_grows_when_latency_rises():
+    b = CircuitBreaker("t", min_timeout=0.01, max_timeout=1.0, timeout_multiplier=2,
+                       failure_threshold=100, max_retries=0)
+
+    async def scenario():
+        for _ in range(5):
+            await b.call(_ok, operation="op")
+        shrunk = b.timeout("op")
+        # Latência normal subiu para 0.2s: os timeouts empurram a EWMA para cima até caber
+        results = []
+        for _ in range(12):
+            try:
+                results.append(await b.call(lambda: asyncio.sleep(0.2, "slow"), operation="op"))
+            except asyncio.TimeoutError:
+                results.append("timeout")
+        return shrunk, results
+
+    shrunk, results = asyncio.run(scenario())
+    assert shrunk == pytest.approx(0.01)
+    assert results[0] == "timeout" and results[-1] == "slow"
+
+
+def test_half_open_probe_uses_max_timeout():
+    b = CircuitBreaker("t", min_timeout=0.01, max_timeout=1.0, failure_threshold=1,
+                       reset_timeout=0.01, max_retries=0)
+
+    async def scenario():
+        await b.call(_ok)
+        with pytest.raises(asyncio.TimeoutError):
+            await b.call(lambda: asyncio.sleep(0.3))
+        assert b.state == OPEN
+        await asyncio.sleep(0.02)
+        # O teste espera até max_timeout: a dependência mais lenta fecha o breaker
+        return await b.call(lambda: asyncio.sleep(0.2, "slow"))
+
+    assert asyncio.run(scenario()) == "slow"
+    assert b.state == CLOSED
@@ -0,0 +1,111 @@
+import asyncio
+import sqlite3
+import time
+from urllib.parse import urlparse
+
+from sqlalchemy import select, func
+
+from app import database
+from app.models.broker_account import MetaAPIAccount
+from app.models.trade import Trade
+from app.services.sync_scheduler import SyncScheduler, encrypt_legacy_tokens, round_robin
+from app.utils.crypto import decrypt_secret, encrypt_secret, is_encrypted
+from tests.conftest import breaker, run
+from tests.stubs import metaapi as metaapi_stub
+
+
+def _db_path() -> str:
+    return urlparse(database.settings.database_url.replace("sqlite+aiosqlite", "sqlite")).path
+
+
+async def _add_account(user_id: int, account_id: str, token: str) -> int:
+    async with database.async_session() as db:
+        account = MetaAPIAccount(user_id=user_id, account_id=account_id, api_token_encrypted=encrypt_secret(token))
+        db.add(account)
+        await db.commit()
+        return account.id
+
+
+async def _sync_once(scheduler: SyncScheduler, account_pk: int):
+    await scheduler.refresh_accounts()
+    account = scheduler._accounts[account_pk]
+    scheduler.queue.put_nowait(account)
+    scheduler._in_flight.add(account_pk)
+    worker = asyncio.create_task(scheduler._worker(0))
+    await scheduler.queue.join()
+    worker.cancel()
+
+
+def test_round_robin_interleaves_users():
+    accounts = [{"user_id": 1, "n": 1}, {"user_id": 1, "n": 2}, {"user_id": 2, "n": 3}, {"user_id": 1, "n": 4}]
+    assert [a["n"] for a in round_robin(accounts)] == [1, 3, 2, 4]
+
+
+def test_token_is_encrypted_at_rest_and_synced(db_tables, metaapi_http):
+    breaker("metaapi")
+
+    async def scenario():
+        account_pk = await _add_account(101, "acc-enc", "plain-secret-token")
+        scheduler = SyncScheduler(workers=1, jitter_seconds=0)
+        await _sync_once(scheduler, account_pk)
+        async with database.read_session() as db:
+            trades = await db.scalar(select(func.count(Trade.id)).where(Trade.user_id == 101))
+            account = await db.get(MetaAPIAccount, account_pk)
+        return scheduler, trades, account
+
+    scheduler, trades, account = run(scenario())
+    assert trades > 0
+    assert account.last_error is None and account.last_synced_at is not None
+
+    raw = sqlite3.connect(_db_path()).execute("SELECT api_token FROM metaapi_accounts WHERE user_id = 101").fetchone()[0]
+    assert "plain-secret-token" not in raw
+    assert decrypt_secret(raw) == "plain-secret-token"
+    assert "plain-secret-token" not in repr(scheduler.status())
+
+
+def test_rate_limit_pauses_the_pool_and_reschedules(db_tables, metaapi_http):
+    breaker("metaapi", failure_threshold=100, max_retries=0)
+    metaapi_stub.state.update(mode="ratelimit", retry_after=42)
+
+    async def scenario():
+        account_pk = await _add_account(102, "acc-429", "token")
+        scheduler = SyncScheduler(workers=1, jitter_seconds=0)
+        await _sync_once(scheduler, account_pk)
+        return scheduler, account_pk
+
+    scheduler, account_pk = run(scenario())
+    assert scheduler.rate_limiter.available <= 0
+    assert scheduler._next_due[account_pk] - time.time() > 40
+
+
+def test_unreadable_token_is_reported_not_raised(db_tables, metaapi_http):
+    breaker("metaapi")
+
+    async def scenario():
+        async with database.async_session() as db:
+            account = MetaAPIAccount(user_id=103, account_id="acc-bad", api_token_encrypted="gAAAAA-corrupted")
+            db.add(account)
+            await db.commit()
+        scheduler = SyncScheduler(workers=1, jitter_seconds=0)
+        await _sync_once(scheduler, account.id)
+        async with database.read_session() as db:
+            return await db.get(MetaAPIAccount, account.id)
+
+    account = run(scenario())
+    assert "ilegível" in account.last_error
+
+
+def test_legacy_plaintext_tokens_are_encrypted(db_tables):
+    async def scenario():
+        async with database.async_session() as db:
+            db.add(MetaAPIAccount(user_id=104, account_id="acc-old", api_token_encrypted="legacy-token"))
+            await db.commit()
+            migrated = await encrypt_legacy_tokens(db)
+            await db.commit()
+            again = await encrypt_legacy_tokens(db)
+            account = (await db.execute(select(MetaAPIAccount).where(MetaAPIAccount.user_id == 104))).scalar_one()
+        return migrated, again, account.api_token_encrypted
+
+    migrated, again, stored = run(scenario())
+    assert migrated >= 1 and again == 0
+    assert is_encrypted(stored) and decrypt_secret(stored) == "legacy-token"
@@ -0,0 +1,35 @@
+from sqlalchemy import select, func
+
+from app import database
+from app.models.sync_state import SyncState
+from app.models.trade import Trade
+from app.services.sync_service import sync_metaapi_account
+from tests.conftest import breaker, run
+from tests.stubs import metaapi as metaapi_stub
+
+
+def test_metaapi_sync_does_not_hold_the_writer_while_fetching(db_tables, metaapi_http, monkeypatch):
+    breaker("metaapi")
+    metaapi_stub.state["latency"] = 0.01
+    writer_in_use = []
+    fault = metaapi_stub._fault
+
+    async def observed():
+        # Conexão de escrita em uso enquanto a "rede" responde = transação presa na busca
+        writer_in_use.append(database.engine.pool.checkedout())
+        return await fault()
+
+    monkeypatch.setattr(metaapi_stub, "_fault", observed)
+
+    async def scenario():
+        async with database.async_session() as db:
+            result = await sync_metaapi_account(db, 41, "token", "acc-writer", days=20, check_connection=False)
+        async with database.read_session() as db:
+            trades = await db.scalar(select(func.count(Trade.id)).where(Trade.user_id == 41))
+            state = (await db.execute(select(SyncState).where(SyncState.user_id == 41))).scalar_one()
+        return result, trades, state
+
+    result, trades, state = run(scenario())
+    assert result["success"] and trades == result["trades_imported"] > 0
+    assert state.last_deal_time is not None and state.backfill_start is not None
+    assert writer_in_use and not any(writer_in_use)
@@ -0,0 +1,96 @@
+import json
+
+from sqlalchemy import exc as sa_exc, func, select
+
+from app import database
+from app.models.trade import Trade
+from app.models.webhook_dead_letter import WebhookDeadLetter
+from app.services import webhook_ingest
+from app.services.webhook_ingest import WebhookIngestor
+from tests.conftest import run
+
+
+def _alert(n: int, **overrides):
+    # Símbolos distintos: entradas no mesmo símbolo viram pirâmide de uma posição só
+    return {"symbol": f"SYM{n}", "type": "BUY", "price": 1.1 + n / 1000, "volume": 1.0, "id": f"wh-{n}", **overrides}
+
+
+async def _count(model, *where):
+    async with database.read_session() as db:
+        return (await db.execute(select(func.count()).select_from(model).where(*where))).scalar()
+
+
+def test_pool_timeout_retries_the_whole_batch(db_tables, monkeypatch):
+    monkeypatch.setattr(webhook_ingest, "RETRY_BASE_SECONDS", 0.01)
+    ingestor = WebhookIngestor(flush_ms=20)
+    write, calls = ingestor._write, []
+
+    async def flaky(alerts):
+        calls.append(len(alerts))
+        if len(calls) <= 2:
+            raise sa_exc.TimeoutError("QueuePool limit reached")
+        await write(alerts)
+
+    ingestor._write = flaky
+
+    async def scenario():
+        for n in range(5):
+            await ingestor.submit(7, _alert(n))
+        await ingestor.stop()
+        return await _count(Trade, Trade.user_id == 7)
+
+    assert run(scenario()) == 5
+    # Lote inteiro reenviado: nada de um retry por alerta
+    assert calls == [5, 5, 5]
+
+
+def test_bad_alert_goes_to_dead_letters(db_tables):
+    ingestor = WebhookIngestor(flush_ms=20)
+
+    async def scenario():
+        for n in range(3):
+            await ingestor.submit(8, _alert(n))
+        await ingestor.submit(8, _alert(3, symbol=None))
+        await ingestor.stop()
+        async with database.read_session() as db:
+            letters = (await db.execute(select(WebhookDeadLetter).where(WebhookDeadLetter.user_id == 8))).scalars().all()
+        return await _count(Trade, Trade.user_id == 8), letters
+
+    written, letters = run(scenario())
+    assert written == 3
+    assert [letter.external_id for letter in letters] == ["wh-3"]
+    assert json.loads(letters[0].payload)["price"] == _alert(3)["price"]
+
+
+def test_shutdown_spools_and_start_replays(db_tables, tmp_path, monkeypatch):
+    monkeypatch.setattr(webhook_ingest, "RETRY_BASE_SECONDS", 0.001)
+    ingestor = WebhookIngestor(flush_ms=20)
+    ingestor.spool_file = str(tmp_path / "spool.jsonl")
+    write = ingestor._write
+
+    async def down(alerts):
+        raise sa_exc.OperationalError("INSERT", {}, Exception("database is locked"))
+
+    async def scenario():
+        ingestor._closing = False
+        await ingestor.start()
+        ingestor._closing = True
+        # Enfileira direto: submit recusa alertas durante o desligamento
+        for n in range(2):
+            ingestor.queue.put_nowait({**_alert(n), "user_id": 9, "type": "BUY",
+                                       "time": webhook_ingest.datetime.now(), "external_id": f"wh-{n}",
+                                       "profit": 0, "strategy": None, "notes": None})
+        await ingestor.stop()
+        spooled = open(ingestor.spool_file).read().count("\n")
+
+        ingestor._write = write
+        await ingestor.start()
+        ingestor._closing = True
+        await ingestor.stop()
+        return spooled, await _count(Trade, Trade.user_id == 9)
+
+    ingestor._write = down
+    spooled, written = run(scenario())
+    assert spooled == 2
+    assert written == 2
+    assert not (tmp_path / "spool.jsonl").exists()